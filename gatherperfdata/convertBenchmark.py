@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+"""Benchmarks and a golden-output regression check of convertLegacyJSon.
+
+corpus: generates legacy results files covering the formats the converter handles:
+ops with the old duration/fileSize fields, value-only ops and current ops; the old
+TestComplete suite label; missing revisions, recovered from the file name or, in the
+bundle, from the test folder in the notes; start times as plain strings and as
+{"$date": ...}; and a bundle of several runs. The same count and seed always give the
+same corpus.
+    convertBenchmark.py corpus <corpus_folder> [-n <files>] [--seed <seed>]
+
+golden: converts the corpus and keeps the outputs, with the throughput, as golden.
+Every output must load with load_test_suite_runs.
+check: converts the corpus again, reports any output that differs from the golden one
+or does not load, and the throughput against the golden throughput. Run it before and
+after a change to the converter; it exits 1 if an output changed.
+    convertBenchmark.py golden <corpus_folder> <golden_folder> [-j <jobs>] [-r <repeats>]
+    convertBenchmark.py check <corpus_folder> <golden_folder> [-j <jobs>] [-r <repeats>]
+
+bundle: builds a bundle (a JSon array of suite runs) from copies of a legacy results
+file and converts it twice, each in a fresh process: streamed a run at a time as
+convertLegacyJSon does, and loaded whole with json.load as it used to be. Reports the
+time and peak resident memory of each, and checks that both give the same output.
+    convertBenchmark.py bundle <legacy.json> [-n <runs>]
+"""
+
+import io
+import sys
+import os
+import os.path
+import json
+import time
+import random
+import shutil
+import difflib
+import filecmp
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime, timedelta
+from gatherperfdata import (JSonLabels, OpLabels, TestLabels, OpResultType, TEST_SUITE_LABEL,
+                            TestSuiteRun, load_test_suite_runs)
+import convertLegacyJSon
+from convertLegacyJSon import convert_bundle, convert_data, is_bundle, peak_rss_mb, MANIFEST_FILE
+
+_DEFAULT_BUNDLE_RUNS = 500
+_DEFAULT_CORPUS_FILES = 200
+_DEFAULT_SEED = 1
+_DEFAULT_REPEATS = 3
+_BUNDLE_FILE_RUNS = 5
+_DIFF_LINES = 20  # of each differing output shown
+
+GOLDEN_INFO_FILE = "golden-info.json"
+
+
+class BundleModes:
+    STREAM = "stream"
+    LOAD = "load"
+    ALL = [STREAM, LOAD]
+
+
+def write_bundle(sample_file, bundle_file, runs):
+    """Write a bundle of runs copies of the legacy results in sample_file."""
+    with open(sample_file, 'r') as f:
+        sample = json.dumps(json.load(f), indent=3)
+
+    with open(bundle_file, 'w') as f:
+        f.write("[\n")
+        for i in range(runs):
+            if i > 0:
+                f.write(",\n")
+            f.write(sample)
+        f.write("\n]\n")
+
+
+def convert_bundle_whole(source_path, target_path, source_file):
+    """The whole-file conversion the streamed one replaces, for comparison."""
+    with open(os.path.join(source_path, source_file), 'r') as f:
+        runs = json.load(f)
+
+    for data in runs:
+        convert_data(data, source_file, bundled=True)
+
+    with open(os.path.join(target_path, source_file), 'w') as f:
+        json.dump(runs, f, indent=3, sort_keys=True)
+
+
+def _run_bundle_mode(mode, source_path, target_path, source_file, results):
+    start = time.perf_counter()
+    if mode == BundleModes.STREAM:
+        error = convert_bundle(source_path, target_path, source_file)[1]
+        if error is not None:
+            raise Exception(error)
+    else:
+        convert_bundle_whole(source_path, target_path, source_file)
+    results.put((mode, time.perf_counter() - start, peak_rss_mb()))
+
+
+def benchmark_bundle(sample_file, runs=_DEFAULT_BUNDLE_RUNS):
+    """{mode: (seconds, peak MB)} converting a bundle of runs copies of sample_file."""
+    # spawn so each child starts with nothing loaded and its peak is its own
+    context = multiprocessing.get_context("spawn")
+    measurements = {}
+    with tempfile.TemporaryDirectory(prefix="convert-bench-") as work_dir:
+        source_path = os.path.join(work_dir, "legacy")
+        os.mkdir(source_path)
+        source_file = "bundle.json"
+        write_bundle(sample_file, os.path.join(source_path, source_file), runs)
+        print("Bundle of {} runs: {:.1f} MB".format(
+            runs, os.path.getsize(os.path.join(source_path, source_file)) / (1024 * 1024)))
+
+        results = context.Queue()
+        for mode in BundleModes.ALL:
+            target_path = os.path.join(work_dir, mode)
+            os.mkdir(target_path)
+            process = context.Process(target=_run_bundle_mode,
+                                      args=(mode, source_path, target_path, source_file, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise Exception("Converting the bundle by {} failed".format(mode))
+            _, seconds, peak = results.get()
+            measurements[mode] = (seconds, peak)
+
+        same = filecmp.cmp(os.path.join(work_dir, BundleModes.STREAM, source_file),
+                           os.path.join(work_dir, BundleModes.LOAD, source_file), shallow=False)
+
+    for mode in BundleModes.ALL:
+        seconds, peak = measurements[mode]
+        print("{:<8}{:>8.2f}s{:>10} peak".format(mode, seconds,
+                                                 "{:.1f} MB".format(peak) if peak is not None else "?"))
+    print("Outputs {}.".format("match" if same else "DIFFER"))
+    return measurements
+
+
+# ---------------------------------------------------------
+# Corpus of legacy files
+# ---------------------------------------------------------
+
+class OpFormats:
+    """How the ops of a corpus file are written, oldest first"""
+    OLD_FIELDS = "oldFields"  # duration and fileSize fields
+    VALUE_ONLY = "valueOnly"  # label and value only
+    CURRENT = "current"  # type and value
+    ALL = [OLD_FIELDS, VALUE_ONLY, CURRENT]
+
+
+# test label -> ops as (label, ms range, file size range)
+_CORPUS_TESTS = [
+    ("DPT1", [("AverageCheck", (400, 600), None), ("AverageDesign", (700, 900), None),
+              (OpLabels.TO_LOGIN, (5000, 8000), None), (OpLabels.TO_MAIN_FORM, (3000, 5000), None)]
+     + [(name + str(i), (400, 1800), None) for i in range(1, 6) for name in ["Design", "Check"]]
+     + [(OpLabels.PAMIR_SHUTDOWN, (9000, 12000), None)]),
+    ("DPT2", [("AverageCheck", (400, 600), None), ("AverageDesign", (700, 900), None)]
+     + [(name + str(i), (400, 1800), None) for i in range(1, 6) for name in ["Design", "Check"]]),
+    ("BBT3", [(OpLabels.AVERAGE_BUILD, (2000, 3000), None)]
+     + [("Build" + str(i), (1800, 4000), None) for i in range(1, 11)]),
+    ("NTT4", [(OpLabels.TO_LOGIN, (5000, 8000), None), (OpLabels.FILE_SIZE, None, (100000, 900000)),
+              (OpLabels.PAMIR_SHUTDOWN, (9000, 12000), None)]),
+    (TestLabels.SW_FORMWORK_TEST, [(OpLabels.LAYOUT_PAINT, (100, 900), None),
+                                   (OpLabels.LAYOUT_REFRESH, (100, 900), None),
+                                   (OpLabels.FILE_SIZE, None, (50000, 500000))]),
+    (TestLabels.UK_FBMT_TEST, [(OpLabels.LAYOUT_PAINT, (100, 900), None),
+                               (OpLabels.LAYOUT_REFRESH, (100, 900), None)]),
+    ("MDT5", [(OpLabels.SAPPHIRE_REPORT, (1000, 20000), None), (OpLabels.SAPPHIRE_SHUTDOWN, (500, 2000), None)]),
+]
+
+
+def _legacy_op(label, ms, file_size, op_format):
+    if op_format == OpFormats.OLD_FIELDS:
+        return {JSonLabels.LABEL: label, JSonLabels.DURATION: ms, JSonLabels.FILE_SIZE: file_size}
+    if op_format == OpFormats.VALUE_ONLY:
+        return {JSonLabels.LABEL: label, JSonLabels.VALUE: file_size or ms}
+    op_type = OpResultType.FileSize if file_size > 0 else OpResultType.Duration
+    return {JSonLabels.LABEL: label, JSonLabels.TYPE: op_type.name, JSonLabels.VALUE: file_size or ms}
+
+
+def _legacy_time(when, bson_date):
+    text = when.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return {JSonLabels.BSON_DATE: text} if bson_date else text
+
+
+def legacy_run(rng, revision, version, start_time, op_format, old_suite_label, missing_revision, bson_date):
+    """A legacy results JSon object in the given variant."""
+    test_results = []
+    when = start_time
+    for test_label, ops in _CORPUS_TESTS:
+        failed = rng.random() < 0.05
+        op_results = []
+        if not failed:
+            for label, ms_range, size_range in ops:
+                ms = rng.randint(*ms_range) if ms_range is not None else 0
+                file_size = rng.randint(*size_range) if size_range is not None else 0
+                op_results.append(_legacy_op(label, ms, file_size, op_format))
+
+        duration = rng.randint(30000, 300000)
+        test_results.append({
+            JSonLabels.LABEL: test_label,
+            JSonLabels.DURATION: duration,
+            JSonLabels.START_TIME: _legacy_time(when, bson_date),
+            JSonLabels.STATUS: "fail" if failed else "pass",
+            JSonLabels.OP_RESULTS: op_results,
+        })
+        when += timedelta(milliseconds=duration)
+
+    return {
+        JSonLabels.BUILD_TESTED: {
+            JSonLabels.REVISION: 0 if missing_revision else revision,
+            JSonLabels.VERSION_SHORT: "" if missing_revision else version,
+            JSonLabels.VERSION_LONG: "" if missing_revision else version,
+        },
+        JSonLabels.DURATION: int((when - start_time).total_seconds() * 1000),
+        JSonLabels.MACHINE: {JSonLabels.CPU_COUNT: 8, JSonLabels.MEMORY: 16384, JSonLabels.NAME: "PERF01",
+                             JSonLabels.OPERATING_SYSTEM: "Windows-7", JSonLabels.PROCESSOR: "x86"},
+        JSonLabels.NOTES: "Test folder: r{}_v{}".format(revision, version),
+        JSonLabels.START_TIME: _legacy_time(start_time, bson_date),
+        JSonLabels.TEST_RESULTS: test_results,
+        JSonLabels.TEST_SUITE_LABEL: "TestComplete" if old_suite_label else "tcPERF01",
+    }
+
+
+def generate_corpus(corpus_path, files=_DEFAULT_CORPUS_FILES, seed=_DEFAULT_SEED):
+    """Write files legacy results files into corpus_path, the last a bundle, cycling through
+    the variants so that each combination appears. Returns the file names."""
+    rng = random.Random(seed)
+    os.makedirs(corpus_path, exist_ok=True)
+    start_time = datetime(2016, 5, 26, 12, 3, 45, 583382)
+    names = []
+
+    def next_run(i):
+        revision = 70000 + i
+        version = "5.1.{}".format(i)
+        variant = (OpFormats.ALL[i % 3], i % 2 == 1, i % 5 == 0, (i // 2) % 2 == 1)
+        return revision, version, legacy_run(rng, revision, version, start_time + timedelta(hours=i), *variant)
+
+    for i in range(files - 1):
+        revision, version, run = next_run(i)
+        # the revision is recovered from the name when missing: r<revision>...v<version>
+        name = "r{}_v{}.json".format(revision, version)
+        with open(os.path.join(corpus_path, name), 'w') as f:
+            json.dump(run, f, indent=3)
+        names.append(name)
+
+    if files > 0:
+        runs = [next_run(files - 1 + i)[2] for i in range(_BUNDLE_FILE_RUNS)]
+        name = "r{}_v5.1.{}.bundle.json".format(70000 + files - 1, files - 1)
+        with open(os.path.join(corpus_path, name), 'w') as f:
+            json.dump(runs, f, indent=3)
+        names.append(name)
+
+    return names
+
+
+# ---------------------------------------------------------
+# Golden outputs and throughput
+# ---------------------------------------------------------
+
+class GoldenLabels:
+    """Magic strings for the golden info file"""
+    CONVERTER_VERSION = "converterVersion"
+    TEST_SUITE_LABEL = "testSuiteLabel"
+    FILES = "files"
+    MEGABYTES = "megabytes"
+    SECONDS = "seconds"
+    JOBS = "jobs"
+
+
+def corpus_files(corpus_path):
+    return sorted(name for name in os.listdir(corpus_path)
+                  if name.endswith(".json") and name != MANIFEST_FILE)
+
+
+def time_conversion(corpus_path, work_dir, jobs=1, repeats=_DEFAULT_REPEATS):
+    """Convert the corpus repeats times into fresh folders under work_dir, as
+    convertLegacyJSon does. Returns (fastest seconds, folder of the last conversion)."""
+    fastest = None
+    target_path = None
+    for repeat in range(repeats):
+        target_path = os.path.join(work_dir, "run{}".format(repeat))
+        os.mkdir(target_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            errors = convertLegacyJSon.main(corpus_path, target_path, jobs=jobs)
+            seconds = time.perf_counter() - start
+        if len(errors) > 0:
+            raise Exception("Converting the corpus failed:\n" + "\n".join(errors.values()))
+        fastest = seconds if fastest is None else min(fastest, seconds)
+
+    return fastest, target_path
+
+
+def print_throughput(corpus_path, seconds, golden_info=None, outfile=sys.stdout):
+    files = len(corpus_files(corpus_path))
+    megabytes = sum(os.path.getsize(os.path.join(corpus_path, name))
+                    for name in corpus_files(corpus_path)) / (1024 * 1024)
+    text = "{} files, {:.1f} MB in {:.2f}s: {:.1f} files/s, {:.1f} MB/s".format(
+        files, megabytes, seconds, files / seconds, megabytes / seconds)
+    if golden_info is not None:
+        golden_seconds = golden_info[GoldenLabels.SECONDS]
+        text += " (throughput {:+.1f}% vs golden {:.2f}s)".format(100.0 * (golden_seconds / seconds - 1), golden_seconds)
+    print(text, file=outfile)
+    return files, megabytes
+
+
+def load_error(output_file):
+    """Why a converted output does not load as suite runs, or None if it does."""
+    try:
+        if is_bundle(output_file):
+            with open(output_file, 'r') as f:
+                for json_run in json.load(f):
+                    TestSuiteRun.from_json_object(json_run)
+        else:
+            load_test_suite_runs([output_file])
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, e)
+    return None
+
+
+def record_golden(corpus_path, golden_path, jobs=1, repeats=_DEFAULT_REPEATS):
+    """Convert the corpus and keep the outputs and throughput in golden_path, replacing any there.
+    Nothing is kept if an output does not load."""
+    with tempfile.TemporaryDirectory(prefix="convert-golden-") as work_dir:
+        seconds, output_path = time_conversion(corpus_path, work_dir, jobs, repeats)
+        errors = [(name, load_error(os.path.join(output_path, name))) for name in corpus_files(corpus_path)]
+        errors = ["{}: {}".format(name, error) for name, error in errors if error is not None]
+        if len(errors) > 0:
+            raise Exception("Outputs that do not load cannot be golden:\n" + "\n".join(errors))
+        if os.path.exists(golden_path):
+            shutil.rmtree(golden_path)
+        shutil.copytree(output_path, golden_path, ignore=shutil.ignore_patterns(MANIFEST_FILE))
+
+    files, megabytes = print_throughput(corpus_path, seconds)
+    with open(os.path.join(golden_path, GOLDEN_INFO_FILE), 'w') as f:
+        json.dump({GoldenLabels.CONVERTER_VERSION: convertLegacyJSon.CONVERTER_VERSION,
+                   GoldenLabels.TEST_SUITE_LABEL: TEST_SUITE_LABEL,
+                   GoldenLabels.FILES: files,
+                   GoldenLabels.MEGABYTES: round(megabytes, 3),
+                   GoldenLabels.SECONDS: round(seconds, 4),
+                   GoldenLabels.JOBS: jobs}, f, indent=3, sort_keys=True)
+    print("Golden outputs written to {}".format(golden_path))
+
+
+def output_diff(golden_file, output_file):
+    """First lines of a unified diff between a golden and a new output."""
+    with open(golden_file, 'r') as f:
+        golden_lines = f.readlines()
+    with open(output_file, 'r') as f:
+        output_lines = f.readlines()
+    diff = difflib.unified_diff(golden_lines, output_lines, "golden", "output", n=1)
+    return "".join(line for _, line in zip(range(_DIFF_LINES), diff))
+
+
+def check_golden(corpus_path, golden_path, jobs=1, repeats=_DEFAULT_REPEATS, outfile=sys.stdout):
+    """Convert the corpus and compare with the golden outputs.
+    Returns the names of those that differ or do not load."""
+    with open(os.path.join(golden_path, GOLDEN_INFO_FILE), 'r') as f:
+        golden_info = json.load(f)
+
+    if golden_info[GoldenLabels.TEST_SUITE_LABEL] != TEST_SUITE_LABEL:
+        raise Exception("Golden outputs were recorded with suite label {}, this machine's is {}. "
+                        "Set COMPUTERNAME to match.".format(golden_info[GoldenLabels.TEST_SUITE_LABEL],
+                                                            TEST_SUITE_LABEL))
+
+    if golden_info[GoldenLabels.CONVERTER_VERSION] != convertLegacyJSon.CONVERTER_VERSION:
+        print("Golden outputs are from converter version {}, this is {}. Outputs are expected to differ."
+              .format(golden_info[GoldenLabels.CONVERTER_VERSION], convertLegacyJSon.CONVERTER_VERSION),
+              file=outfile)
+
+    differing = []
+    with tempfile.TemporaryDirectory(prefix="convert-check-") as work_dir:
+        seconds, output_path = time_conversion(corpus_path, work_dir, jobs, repeats)
+        for name in corpus_files(corpus_path):
+            golden_file = os.path.join(golden_path, name)
+            output_file = os.path.join(output_path, name)
+            error = load_error(output_file)
+            if error is not None:
+                differing.append(name)
+                print("{}: does not load: {}".format(name, error), file=outfile)
+            elif not os.path.exists(golden_file):
+                differing.append(name)
+                print("{}: no golden output".format(name), file=outfile)
+            elif not filecmp.cmp(golden_file, output_file, shallow=False):
+                differing.append(name)
+                print("{}: differs\n{}".format(name, output_diff(golden_file, output_file)), file=outfile)
+
+    print_throughput(corpus_path, seconds, golden_info, outfile)
+    print("{} of {} outputs differ from golden.".format(len(differing), len(corpus_files(corpus_path))),
+          file=outfile)
+    return differing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the legacy results converter.")
+    commands = parser.add_subparsers(dest="command")
+
+    bundle_parser = commands.add_parser("bundle", help="streamed vs whole-file conversion of a large bundle")
+    bundle_parser.add_argument("sample", help="legacy results file to fill the bundle with, e.g. from corpus")
+    bundle_parser.add_argument("-n", "--runs", type=int, default=_DEFAULT_BUNDLE_RUNS,
+                               help="suite runs in the bundle")
+
+    corpus_parser = commands.add_parser("corpus", help="generate a corpus of legacy files")
+    corpus_parser.add_argument("corpus", help="folder to write the corpus to")
+    corpus_parser.add_argument("-n", "--files", type=int, default=_DEFAULT_CORPUS_FILES)
+    corpus_parser.add_argument("--seed", type=int, default=_DEFAULT_SEED)
+
+    golden_parser = commands.add_parser("golden", help="record golden outputs and throughput of a corpus")
+    check_parser = commands.add_parser("check", help="compare outputs and throughput with the golden ones")
+    for command_parser in (golden_parser, check_parser):
+        command_parser.add_argument("corpus", help="corpus folder")
+        command_parser.add_argument("golden", help="golden outputs folder")
+        command_parser.add_argument("-j", "--jobs", type=int, default=1,
+                                    help="processes to convert with, 0 for one per core")
+        command_parser.add_argument("-r", "--repeats", type=int, default=_DEFAULT_REPEATS,
+                                    help="conversions to time, the fastest is taken")
+
+    args = parser.parse_args()
+    if args.command == "bundle":
+        benchmark_bundle(args.sample, args.runs)
+    elif args.command == "corpus":
+        print("Wrote {} files to {}".format(len(generate_corpus(args.corpus, args.files, args.seed)), args.corpus))
+    elif args.command == "golden":
+        record_golden(args.corpus, args.golden, args.jobs, args.repeats)
+    elif args.command == "check":
+        if len(check_golden(args.corpus, args.golden, args.jobs, args.repeats)) > 0:
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
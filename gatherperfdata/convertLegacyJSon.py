@@ -3,23 +3,70 @@
 import sys
 import os.path
 import json
+import time
+import hashlib
+import codecs
+import textwrap
 from gatherperfdata import (JSonLabels, OpLabels, TestLabels,
-                            TEST_SUITE_LABEL, OpResultType)
+                            TEST_SUITE_LABEL, OpResultType,
+                            SCHEMA_VERSION, schema_version_of)
+from revisionIndex import RevisionIndex
+from resultsContainer import ResultsContainerWriter, CONTAINER_SUFFIX
 import re
 
+# Increase when a change to the migrations changes their output, so files are converted again
+CONVERTER_VERSION = 2
+MANIFEST_FILE = "convert-manifest.json"
+CONTAINER_FILE = "results" + CONTAINER_SUFFIX
+_MANIFEST_SAVE_INTERVAL = 100  # files
 
-def treat_build_number(data, source_file):
-    """Look for and correct build version missing."""
+
+def run_name_from_json_file(source_file):
+    """r79586_V6.results.json -> r79586_V6"""
+    for suffix in [".results.json", ".json"]:
+        if source_file.endswith(suffix):
+            return source_file[:-len(suffix)]
+
+    return source_file
+
+
+def missing_build_number(data):
     build_tested = data[JSonLabels.BUILD_TESTED]
-    if (build_tested[JSonLabels.REVISION] > 0
-        and build_tested[JSonLabels.VERSION_SHORT] != ""):
+    return build_tested[JSonLabels.REVISION] <= 0 or build_tested[JSonLabels.VERSION_SHORT] == ""
+
+
+_TEST_FOLDER_NOTES_REGEX = r"Test folder: (\S+)"
+_BUILD_IN_NAME_REGEX = r"r([0-9]+).*?v([0-9]+(?:\.[0-9]+)*)"
+
+
+def run_name_from_notes(data):
+    """Notes "Test folder: r79586_V6" -> r79586_V6, or None"""
+    match = re.search(_TEST_FOLDER_NOTES_REGEX, data.get(JSonLabels.NOTES) or "")
+    return match.group(1) if match else None
+
+
+def treat_build_number(data, source_file, run_index=None, bundled=False):
+    """Look for and correct build version missing.
+    The run is named by the file, or for a run in a bundle by the test folder in its notes.
+    The revision index is consulted first, falling back to the run name."""
+    if not missing_build_number(data):
         return
 
-    REGEX = r"r([0-9]+).*?v([0-9.]+)"
-    match = re.search(REGEX, source_file)
+    build_tested = data[JSonLabels.BUILD_TESTED]
+    run_name = run_name_from_notes(data) if bundled else run_name_from_json_file(source_file)
+
+    if run_index is not None and run_name is not None:
+        run = run_index.find_run(run_name)
+        if run is not None and run[JSonLabels.REVISION] > 0:
+            build_tested[JSonLabels.REVISION] = run[JSonLabels.REVISION]
+            build_tested[JSonLabels.VERSION_SHORT] = run[JSonLabels.VERSION_SHORT]
+            build_tested[JSonLabels.VERSION_LONG] = run[JSonLabels.VERSION_LONG]
+            return
+
+    match = re.search(_BUILD_IN_NAME_REGEX, run_name) if run_name is not None else None
     if match is None:
-        msg = "Could not fix build num for: {}".format(source_file)
-        print(msg, sys.stderr)
+        where = "{} in {}".format(run_name, source_file) if bundled else source_file
+        print("Could not fix build num for: {}".format(where), file=sys.stderr)
         return
 
     rev = int(match.group(1))
@@ -37,127 +84,150 @@ def treat_suite_label(data):
     data[JSonLabels.TEST_SUITE_LABEL] = TEST_SUITE_LABEL
 
 
-def treat_op_structure(data):
-    """This will convert old format duration/filesize to new."""
-    test_results = data[JSonLabels.TEST_RESULTS]
-    if len(test_results) == 0:
-        return
-
-    op_results = test_results[0][JSonLabels.OP_RESULTS]
-    if len(op_results) == 0:
-        return
+# ---------------------------------------------------------
+# Migrations of the test results. Each is a rule applied during a single
+# pass over the test results and their ops; add new fix-ups as rules.
+# ---------------------------------------------------------
 
-    # if one op has correct format they all will
-    if JSonLabels.TYPE in op_results[0]:
-        return
+class MigrationRule:
+    """A fix-up applied while migrate_test_results walks a file's test results.
+    tests, if set, limits the rule to the test results with those labels."""
+    tests = None
 
-    for test_result in test_results:
-        for op_result in test_result[JSonLabels.OP_RESULTS]:
-            if JSonLabels.TYPE in op_result:
-                continue
+    def applies(self, data):
+        """Called once per file before the pass. Return False to skip the rule for the file."""
+        return True
 
-            # another iteration of the format that just had label and value
-            filesize = 0
-            if JSonLabels.FILE_SIZE in op_result:
-                filesize = op_result.pop(JSonLabels.FILE_SIZE)
-            elif op_result[JSonLabels.LABEL] == OpLabels.FILE_SIZE:
-                filesize = op_result[JSonLabels.VALUE]
-
-            duration = 0
-            if filesize == 0:
-                if JSonLabels.DURATION in op_result:
-                    duration = op_result.pop(JSonLabels.DURATION)
-                else:
-                    duration = op_result[JSonLabels.VALUE]
-
-            if filesize > 0:
-                op_result[JSonLabels.TYPE] = OpResultType.FileSize.name
-                op_result[JSonLabels.VALUE] = filesize
-            else:
-                op_result[JSonLabels.TYPE] = OpResultType.Duration.name
-                op_result[JSonLabels.VALUE] = duration
+    def begin_test(self, test_result):
+        pass
 
+    def visit_op(self, op):
+        pass
 
-def test_result_iter(data, label_sel_func):
-    test_results = data[JSonLabels.TEST_RESULTS]
-    for test_result in test_results:
-        test_label = test_result[JSonLabels.LABEL]
-        if label_sel_func(test_label):
-            yield (test_label, test_result)
-
-
-def treat_basic_avg_ops(data):
-    """This will recalculate the averages in ms."""
-    def calc_avg(test_res, op_name):
-        total_duration = 0
-        op_count = 0
-        op_results = test_res[JSonLabels.OP_RESULTS]
-        for op in op_results:
-            op_label = op[JSonLabels.LABEL]
-            if (not op_label.startswith(op_name)) or op_label.endswith("1"):
-                continue
+    def end_test(self, test_result):
+        pass
 
-            op_count += 1
-            if JSonLabels.DURATION in op:
-                total_duration += op[JSonLabels.DURATION]
-            else:
-                total_duration += op[JSonLabels.VALUE]
 
-        if op_count == 0:
-            # can happen if the test failed
+class OpStructureRule(MigrationRule):
+    """This will convert old format duration/filesize to new."""
+    def applies(self, data):
+        # a failed test may have no ops, so look at the first that has some
+        for test_result in data[JSonLabels.TEST_RESULTS]:
+            op_results = test_result[JSonLabels.OP_RESULTS]
+            if len(op_results) > 0:
+                # if one op has correct format they all will
+                return JSonLabels.TYPE not in op_results[0]
+
+        return False
+
+    def visit_op(self, op_result):
+        if JSonLabels.TYPE in op_result:
             return
 
-        avg = int(total_duration/op_count)
-        avg_label = "Average" + op_name
-
-        # find average result and update it
-        for op in op_results:
-            op_label = op[JSonLabels.LABEL]
-            if not op_label == avg_label:
-                continue
-
-            if JSonLabels.DURATION in op:
-                op[JSonLabels.DURATION] = avg
+        # another iteration of the format that just had label and value
+        filesize = 0
+        if JSonLabels.FILE_SIZE in op_result:
+            filesize = op_result.pop(JSonLabels.FILE_SIZE)
+        elif op_result[JSonLabels.LABEL] == OpLabels.FILE_SIZE:
+            filesize = op_result[JSonLabels.VALUE]
+
+        duration = 0
+        if filesize == 0:
+            if JSonLabels.DURATION in op_result:
+                duration = op_result.pop(JSonLabels.DURATION)
             else:
-                op[JSonLabels.VALUE] = avg
-
-    def test_selector(label):
-        return label == "DPT1" or label == "DPT2" or label == "BBT3"
+                duration = op_result[JSonLabels.VALUE]
 
-    for (test_label, test_result) in test_result_iter(data, test_selector):
-        if test_label == "BBT3":
-            calc_avg(test_result, "Build")
+        if filesize > 0:
+            op_result[JSonLabels.TYPE] = OpResultType.FileSize.name
+            op_result[JSonLabels.VALUE] = filesize
         else:
-            calc_avg(test_result, "Check")
-            calc_avg(test_result, "Design")
-    return
+            op_result[JSonLabels.TYPE] = OpResultType.Duration.name
+            op_result[JSonLabels.VALUE] = duration
+
+
+def _op_value_key(op):
+    return JSonLabels.DURATION if JSonLabels.DURATION in op else JSonLabels.VALUE
+
+
+class BasicAverageRule(MigrationRule):
+    """This will recalculate the averages in ms.
+    Averages leave out the first run, e.g. AverageDesign is the mean of Design2..Design5."""
+    averaged_ops = {
+        "DPT1": ["Check", "Design"],
+        "DPT2": ["Check", "Design"],
+        "BBT3": ["Build"],
+    }
+    tests = set(averaged_ops)
+
+    # op label -> names of the averages it counts towards, filled as labels are seen
+    _label_to_names = {}
+
+    def __init__(self):
+        self._names = []
+        self._totals = {}  # name -> [total duration, count]
+        self._average_ops = {}  # "Average" + name -> ops holding the average
+
+    def begin_test(self, test_result):
+        self._names = BasicAverageRule.averaged_ops[test_result[JSonLabels.LABEL]]
+        self._totals = {name: [0, 0] for name in self._names}
+        self._average_ops = {"Average" + name: [] for name in self._names}
+
+    def visit_op(self, op):
+        op_label = op[JSonLabels.LABEL]
+        if op_label in self._average_ops:
+            self._average_ops[op_label].append(op)
+
+        key = (op_label, tuple(self._names))
+        names = BasicAverageRule._label_to_names.get(key)
+        if names is None:
+            names = [name for name in self._names if op_label.startswith(name) and not op_label.endswith("1")]
+            BasicAverageRule._label_to_names[key] = names
+
+        for name in names:
+            total = self._totals[name]
+            total[0] += op[_op_value_key(op)]
+            total[1] += 1
+
+    def end_test(self, test_result):
+        for name, (total_duration, op_count) in self._totals.items():
+            if op_count == 0:
+                # can happen if the test failed
+                continue
 
+            avg = int(total_duration/op_count)
+            for op in self._average_ops["Average" + name]:
+                op[_op_value_key(op)] = avg
 
-def treat_frame_ops(data):
-    """Fix all ops that say LayoutPaint when they should be FramePaint"""
-    def test_selector(label):
-        return (label == TestLabels.SW_FORMWORK_TEST
-                or label == TestLabels.UK_FBMT_TEST)
 
-    for (test_label, test_result) in test_result_iter(data, test_selector):
-        op_results = test_result[JSonLabels.OP_RESULTS]
-        for op in op_results:
-            op_label = op[JSonLabels.LABEL]
-            if op_label == "LayoutPaint":
-                op[JSonLabels.LABEL] = OpLabels.FRAME_PAINT
+class FrameOpsRule(MigrationRule):
+    """Fix all ops that say LayoutPaint when they should be FramePaint"""
+    tests = {TestLabels.SW_FORMWORK_TEST, TestLabels.UK_FBMT_TEST}
+    renames = {
+        "LayoutPaint": OpLabels.FRAME_PAINT,
+        "Refresh": OpLabels.FRAME_REFRESH,
+    }
 
-            if op_label == "Refresh":
-                op[JSonLabels.LABEL] = OpLabels.FRAME_REFRESH
+    def visit_op(self, op):
+        new_label = FrameOpsRule.renames.get(op[JSonLabels.LABEL])
+        if new_label is not None:
+            op[JSonLabels.LABEL] = new_label
 
 
-def treat_bson_compat(data):
+class BsonCompatRule(MigrationRule):
     """ Make necessary alterations for JSon to be strict.
     This allows MongoDB to convert it to BSON correctly whilst still
     retaining human readability.
     """
-    BSON_DATE = "$date"
+    @staticmethod
+    def convert_date(json_obj):
+        if JSonLabels.START_TIME not in json_obj:
+            return
+
+        start_time = json_obj[JSonLabels.START_TIME]
+        json_obj[JSonLabels.START_TIME] = {JSonLabels.BSON_DATE: start_time}
 
-    def conversion_necessary():
+    def applies(self, data):
         # check if conversion necessary
         if JSonLabels.TEST_RESULTS not in data:
             return False
@@ -166,74 +236,491 @@ def treat_bson_compat(data):
         if len(test_res) < 1:
             return False
 
-        if BSON_DATE in test_res[0][JSonLabels.START_TIME]:
+        if JSonLabels.BSON_DATE in test_res[0][JSonLabels.START_TIME]:
             return False
 
+        BsonCompatRule.convert_date(data)
         return True
 
-    def convert_date(json_obj):
-        if JSonLabels.START_TIME not in json_obj:
+    def end_test(self, test_result):
+        BsonCompatRule.convert_date(test_result)
+
+
+def migration_rules():
+    """Fresh rules for one file, in the order they apply to each op."""
+    return [OpStructureRule(), BasicAverageRule(), FrameOpsRule(), BsonCompatRule()]
+
+
+def migrate_test_results(data, rules):
+    """Apply the rules in one pass over the test results and their ops."""
+    rules = [rule for rule in rules if rule.applies(data)]
+    rules_by_test = {}  # test label -> rules for it
+
+    for test_result in data[JSonLabels.TEST_RESULTS]:
+        test_label = test_result[JSonLabels.LABEL]
+        test_rules = rules_by_test.get(test_label)
+        if test_rules is None:
+            test_rules = [rule for rule in rules if rule.tests is None or test_label in rule.tests]
+            rules_by_test[test_label] = test_rules
+
+        if len(test_rules) == 0:
+            continue
+
+        for rule in test_rules:
+            rule.begin_test(test_result)
+
+        for op in test_result[JSonLabels.OP_RESULTS]:
+            for rule in test_rules:
+                rule.visit_op(op)
+
+        for rule in test_rules:
+            rule.end_test(test_result)
+
+
+def convert_data(data, source_file, run_index=None, bundled=False):
+    treat_build_number(data, source_file, run_index, bundled)
+    treat_suite_label(data)
+    migrate_test_results(data, migration_rules())
+    data[JSonLabels.SCHEMA_VERSION] = SCHEMA_VERSION
+
+
+class Outcome:
+    """What convert_file did with a file"""
+    CONVERTED = "converted"
+    COPIED = "copied"  # already current, copied without parsing
+    SKIPPED = "skipped"  # already current, left out
+    UNCHANGED = "unchanged"  # converted by an earlier run, see ConversionManifest
+    FAILED = "failed"
+    BUNDLE = "bundle"  # a JSon array of runs, left for convert_bundle; not counted
+
+    ALL = [CONVERTED, COPIED, SKIPPED, UNCHANGED, FAILED]
+
+
+def convert_file(source_path, target_path, source_file, run_index=None, skip_current=False):
+    """Convert one file. Files already stamped with the current schema version are
+    copied (or with skip_current left out) without being parsed.
+    Bundles are not read beyond their first chunk, and are returned as Outcome.BUNDLE.
+    With target_path None nothing is written and the converted JSon is returned instead,
+    for writing to a container.
+    Returns (Outcome, description of the error if it could not be converted, sha256 of the source,
+    the converted JSon or None)."""
+    current_filepath = os.path.join(source_path, source_file)
+    try:
+        with open(current_filepath, 'rb') as f:
+            raw = f.read(_BUNDLE_CHUNK)
+            if starts_json_array(raw):
+                return Outcome.BUNDLE, None, None, None
+            raw += f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        data = None
+        if schema_version_of(raw) == SCHEMA_VERSION:
+            # gathered without a build number (revision 0), which only the index can put right
+            if run_index is not None:
+                data = json.loads(raw.decode())
+
+            if data is None or not missing_build_number(data):
+                if skip_current:
+                    return Outcome.SKIPPED, None, digest, None
+                if target_path is None:
+                    return Outcome.COPIED, None, digest, data if data is not None else json.loads(raw.decode())
+                with open(os.path.join(target_path, source_file), 'wb') as f:
+                    f.write(raw)
+                return Outcome.COPIED, None, digest, None
+
+            treat_build_number(data, source_file, run_index)
+        else:
+            data = json.loads(raw.decode())
+            convert_data(data, source_file, run_index)
+
+        if target_path is None:
+            return Outcome.CONVERTED, None, digest, data
+
+        with open(os.path.join(target_path, source_file), 'w') as f:
+            json.dump(data, f, indent=3, sort_keys=True)
+
+    except Exception:
+        from traceback import format_tb
+        return Outcome.FAILED, "Error processing: {}\n{} : {}\n{}".format(source_file,
+                                                                         sys.exc_info()[0].__name__,
+                                                                         sys.exc_info()[1],
+                                                                         "".join(format_tb(sys.exc_info()[2]))), None, None
+
+    return Outcome.CONVERTED, None, digest, None
+
+
+# ---------------------------------------------------------
+# Bundles: legacy exports holding a JSon array of many suite runs. These are
+# parsed incrementally, one suite run at a time, so memory stays bounded
+# whatever the size of the file.
+# ---------------------------------------------------------
+
+_BUNDLE_CHUNK = 1024 * 1024  # characters read at a time
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+def starts_json_array(head):
+    return head.lstrip()[:1] == b"["
+
+
+def is_bundle(filepath):
+    """True if the file holds a JSon array rather than a single results object."""
+    with open(filepath, 'rb') as f:
+        return starts_json_array(f.read(_BUNDLE_CHUNK))
+
+
+def read_text_chunks(f, digest=None):
+    """Decoded text of a binary file a chunk at a time, adding the bytes to digest as read."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        raw = f.read(_BUNDLE_CHUNK)
+        if digest is not None:
+            digest.update(raw)
+        text = decoder.decode(raw, final=not raw)
+        if text:
+            yield text
+        if not raw:
             return
 
-        start_time = json_obj[JSonLabels.START_TIME]
-        json_obj[JSonLabels.START_TIME] = {BSON_DATE: start_time}
 
-    if not conversion_necessary():
+def iter_json_array(chunks):
+    """Yield the elements of a top level JSon array, given its text in chunks, one at a time.
+    Only the element being parsed is held, with what is left of the chunk it ends in."""
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0  # parsed up to here
+    eof = False
+
+    def fill(length):
+        """Drop the parsed text and read until length characters are left to parse or the end."""
+        nonlocal buffer, pos, eof
+        buffer = buffer[pos:]
+        pos = 0
+        while not eof and len(buffer) < length:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer += chunk
+
+    def next_char():
+        """Skip white space and return the next character, None at the end."""
+        nonlocal pos
+        while True:
+            match = _WHITESPACE.match(buffer, pos)
+            pos = match.end()
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1] or None
+            fill(1)
+
+    if next_char() != "[":
+        raise ValueError("Not a JSon array")
+    pos += 1
+    if next_char() == "]":
         return
 
-    convert_date(data)
-    for test_result in data[JSonLabels.TEST_RESULTS]:
-        convert_date(test_result)
+    while True:
+        length = max(len(buffer) - pos, _BUNDLE_CHUNK)
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # a number cut short by the end of the buffer goes on in the next chunk
+                if eof or (end < len(buffer) and buffer[end] not in _NUMBER_CHARS):
+                    break
+            except ValueError:
+                if eof:
+                    raise
+            # double what is read each time, so a large element is not parsed over and over
+            length *= 2
+            fill(length)
+
+        pos = end
+        yield element
+
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Expected , or ] after element of JSon array, found {!r}".format(separator))
+        pos += 1
+        if next_char() is None:
+            raise ValueError("JSon array ends after ,")
+
+
+def convert_bundle(source_path, target_path, source_file, run_index=None, writer=None):
+    """Convert a bundle one suite run at a time, writing each as it is converted: to a JSon array
+    in target_path, laid out as json.dump of the whole array would, or to the container writer.
+    Returns (outcome, error, digest, None) like convert_file."""
+    digest = hashlib.sha256()
+    try:
+        with open(os.path.join(source_path, source_file), 'rb') as f:
+            runs = iter_json_array(read_text_chunks(f, digest))
+            if writer is not None:
+                for data in runs:
+                    convert_data(data, source_file, run_index, bundled=True)
+                    writer.append(data)
+            else:
+                with open(os.path.join(target_path, source_file), 'w') as out:
+                    separator = "[\n"
+                    for data in runs:
+                        convert_data(data, source_file, run_index, bundled=True)
+                        out.write(separator)
+                        out.write(textwrap.indent(json.dumps(data, indent=3, sort_keys=True), "   "))
+                        separator = ",\n"
+                    out.write("\n]" if separator != "[\n" else "[]")
+
+    except Exception:
+        from traceback import format_tb
+        return Outcome.FAILED, "Error processing: {}\n{} : {}\n{}".format(source_file,
+                                                                         sys.exc_info()[0].__name__,
+                                                                         sys.exc_info()[1],
+                                                                         "".join(format_tb(sys.exc_info()[2]))), None, None
+
+    return Outcome.CONVERTED, None, digest.hexdigest(), None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if it cannot be found."""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    import importlib.util
+    if importlib.util.find_spec("psutil") is None:
+        return None
+    import psutil
+    return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+class ManifestLabels:
+    """Magic strings for the conversion manifest"""
+    CONVERTER_VERSION = "converterVersion"
+    FILES = "files"
+    PATH = "path"
+    SIZE = "size"
+    MODIFIED = "modified"
+    HASH = "sha256"
+    OUTCOME = "outcome"
+
+
+class ConversionManifest:
+    """Record in the target folder of each source converted: its path, size, modified time,
+    content hash and the converter version that converted it. A source is converted again
+    only if it is new, its content has changed or CONVERTER_VERSION has been increased."""
+    def __init__(self, target_path):
+        self.filename = os.path.join(target_path, MANIFEST_FILE)
+        self.files = {}  # source file name -> entry
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
 
+        with open(self.filename, 'r') as f:
+            self.files = json.load(f)[ManifestLabels.FILES]
+
+    def save(self):
+        """Write atomically so that an interrupted run leaves the last saved manifest to resume from."""
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump({ManifestLabels.CONVERTER_VERSION: CONVERTER_VERSION,
+                       ManifestLabels.FILES: self.files}, f, indent=1, sort_keys=True)
+
+        os.replace(temp_filename, self.filename)
+
+    def is_unchanged(self, source_path, source_file, output_file):
+        """True if the source was converted from the same content by this converter version
+        and its output_file is still there. The content is only hashed when the size or
+        modified time differ."""
+        entry = self.files.get(source_file)
+        if entry is None or entry[ManifestLabels.CONVERTER_VERSION] != CONVERTER_VERSION:
+            return False
+
+        if entry[ManifestLabels.OUTCOME] != Outcome.SKIPPED and not os.path.exists(output_file):
+            return False
 
-def main(source_path, target_path):
+        source_filepath = os.path.join(source_path, source_file)
+        stat = os.stat(source_filepath)
+        if entry[ManifestLabels.SIZE] == stat.st_size and entry[ManifestLabels.MODIFIED] == stat.st_mtime_ns:
+            return True
+
+        with open(source_filepath, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() != entry[ManifestLabels.HASH]:
+                return False
+
+        # touched but not changed
+        entry[ManifestLabels.SIZE] = stat.st_size
+        entry[ManifestLabels.MODIFIED] = stat.st_mtime_ns
+        return True
+
+    def record(self, source_path, source_file, outcome, digest):
+        stat = os.stat(os.path.join(source_path, source_file))
+        self.files[source_file] = {
+            ManifestLabels.PATH: os.path.abspath(os.path.join(source_path, source_file)),
+            ManifestLabels.SIZE: stat.st_size,
+            ManifestLabels.MODIFIED: stat.st_mtime_ns,
+            ManifestLabels.HASH: digest,
+            ManifestLabels.CONVERTER_VERSION: CONVERTER_VERSION,
+            ManifestLabels.OUTCOME: outcome,
+        }
+
+
+# state of each process in the pool, set up once by _init_pool_worker
+_pool_run_index = None
+_pool_args = None
+
+
+def _init_pool_worker(source_path, target_path, index_file, skip_current):
+    global _pool_run_index, _pool_args
+    _pool_args = (source_path, target_path, skip_current)
+    if index_file is not None:
+        _pool_run_index = RevisionIndex(index_file)
+        _pool_run_index.load()
+
+
+def _convert_file_in_pool(source_file):
+    source_path, target_path, skip_current = _pool_args
+    return convert_file(source_path, target_path, source_file, _pool_run_index, skip_current)
+
+
+def main(source_path, target_path, index_file=None, jobs=1, skip_current=False, container=False):
+    """Convert the .json files in source_path into target_path, leaving out those the
+    manifest in target_path shows are already converted.
+    With jobs > 1 the files are shared across that many processes (0 for one per core).
+    With container the runs are appended to one compact container in target_path
+    (see resultsContainer.py) instead of being written as separate files.
+    Files holding a JSon array of suite runs (bundles) are parsed and converted a run at a time.
+    Returns {file name: error} for the files that could not be converted."""
     print("Converting files in {}. Output to {}"
           .format(source_path, target_path))
 
     if not os.path.exists(source_path):
         print("Folder '{}' does not exist.".format(source_path))
-        return
+        return {}
 
     if not os.path.exists(target_path):
         print("Folder '{}' does not exist.".format(target_path))
-        return
-
-    source_files = [name for name in os.listdir(source_path)
-                    if (os.path.isfile(os.path.join(source_path, name))
-                        and name.endswith(".json"))]
-
+        return {}
+
+    source_files = sorted(name for name in os.listdir(source_path)
+                          if (os.path.isfile(os.path.join(source_path, name))
+                              and name.endswith(".json")
+                              and name != MANIFEST_FILE))
+
+    start = time.perf_counter()
+    manifest = ConversionManifest(target_path)
+    manifest.load()
+    container_file = os.path.join(target_path, CONTAINER_FILE)
+    counts = {outcome: 0 for outcome in Outcome.ALL}
+    to_convert = []
+    bundles = []  # converted after the pool finds them: each streams through bounded memory
     for source_file in source_files:
-        current_filepath = os.path.join(source_path, source_file)
-        target_filepath = os.path.join(target_path, source_file)
-        try:
-            with open(current_filepath, 'r') as f:
-                data = json.load(f)
-
-            treat_build_number(data, source_file)
-            treat_suite_label(data)
-            treat_op_structure(data)
-            treat_basic_avg_ops(data)
-            treat_frame_ops(data)
-            treat_bson_compat(data)
-
-            with open(target_filepath, 'w') as f:
-                json.dump(data, f, indent=3, sort_keys=True)
-
-        except Exception as e:
-            from traceback import print_tb
-            print("Error processing: {}".format(source_file))
-            print("{} : {}".format(sys.exc_info()[0].__name__,
-                                   sys.exc_info()[1]))
-            print_tb(sys.exc_info()[2])
-            exit()
+        output_file = container_file if container else os.path.join(target_path, source_file)
+        if manifest.is_unchanged(source_path, source_file, output_file):
+            counts[Outcome.UNCHANGED] += 1
+        else:
+            to_convert.append(source_file)
+
+    # converted files are written by convert_file, or returned to be added to the container
+    file_target_path = None if container else target_path
+    writer = ResultsContainerWriter(container_file) if container else None
+
+    def save_progress():
+        # the container before the manifest, so the manifest never lists runs the container lacks
+        if writer is not None:
+            writer.save()
+        manifest.save()
+
+    run_index = None
+
+    def load_run_index():
+        nonlocal run_index
+        if index_file is not None and run_index is None:
+            run_index = RevisionIndex(index_file)
+            run_index.load()
+
+    if jobs == 1:
+        load_run_index()
+
+    errors = {}
+    executor = None
+    try:
+        if jobs == 1:
+            results = (convert_file(source_path, file_target_path, source_file, run_index, skip_current)
+                       for source_file in to_convert)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=jobs or None, initializer=_init_pool_worker,
+                                           initargs=(source_path, file_target_path, index_file, skip_current))
+            results = executor.map(_convert_file_in_pool, to_convert, chunksize=16)
+
+        for count, (source_file, (outcome, error, digest, json_run)) in enumerate(zip(to_convert, results), 1):
+            if outcome == Outcome.BUNDLE:
+                bundles.append(source_file)
+                continue
+            counts[outcome] += 1
+            if error is not None:
+                errors[source_file] = error
+            else:
+                if json_run is not None:
+                    writer.append(json_run)
+                manifest.record(source_path, source_file, outcome, digest)
+
+            if count % _MANIFEST_SAVE_INTERVAL == 0:
+                save_progress()
+
+        if bundles:
+            load_run_index()
+        for source_file in bundles:
+            outcome, error, digest, _ = convert_bundle(source_path, file_target_path, source_file, run_index, writer)
+            counts[outcome] += 1
+            if error is not None:
+                errors[source_file] = error
+            else:
+                manifest.record(source_path, source_file, outcome, digest)
+            save_progress()
+    finally:
+        save_progress()
+        if writer is not None:
+            writer.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    seconds = time.perf_counter() - start
+    for error in errors.values():
+        print(error)
+
+    print("{} files in {:.2f}s ({:.1f} files/s): {}."
+          .format(len(source_files), seconds, len(source_files) / max(seconds, 1e-9),
+                  ", ".join("{} {}".format(counts[outcome], outcome) for outcome in Outcome.ALL)))
+    peak = peak_rss_mb()
+    if peak is not None:
+        print("Peak memory: {:.1f} MB".format(peak))
+    return errors
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: {} <source_path> <target_path>".format(sys.argv[0]))
-        exit()
-
-    source_p = sys.argv[1] if sys.argv[1] != "-" else r"./jcv_test/legacy"
-    target_p = sys.argv[2] if sys.argv[2] != "-" else r"./jcv_test/converted"
-
-    main(source_p, target_p)
+    import argparse
+    _parser = argparse.ArgumentParser(description="Convert legacy results JSon files to the current format.")
+    _parser.add_argument("source_path", help="folder of legacy files, - for ./jcv_test/legacy")
+    _parser.add_argument("target_path", help="folder for converted files, - for ./jcv_test/converted")
+    _parser.add_argument("index_file", nargs="?", help="revision index to look up missing build numbers")
+    _parser.add_argument("-j", "--jobs", type=int, default=1, help="processes to convert with, 0 for one per core")
+    _parser.add_argument("-s", "--skip-current", action="store_true",
+                         help="leave out files already in the current format instead of copying them")
+    _parser.add_argument("-c", "--container", action="store_true",
+                         help="write all runs to one compact " + CONTAINER_FILE + " in target_path")
+    _args = _parser.parse_args()
+
+    source_p = _args.source_path if _args.source_path != "-" else r"./jcv_test/legacy"
+    target_p = _args.target_path if _args.target_path != "-" else r"./jcv_test/converted"
+
+    if len(main(source_p, target_p, _args.index_file, _args.jobs, _args.skip_current, _args.container)) > 0:
+        sys.exit(1)
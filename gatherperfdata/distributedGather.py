@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""Gather many test runs at once with a coordinator and worker processes.
+
+The coordinator puts the run folders and <run>.7z archives to gather on a shared
+queue served by a multiprocessing manager over a local socket. Workers, on this or
+any other machine that can see the runs, take the next run whenever they are free,
+so a fast worker simply takes more of them. Each worker scrapes the run and sends
+the TestSuiteRun JSon back; the coordinator merges them into one NDJSON store keyed
+as ingestResults keys them.
+
+Workers are rarely the machine that ran the tests, so each run is filed under the
+machine and suite label of the results.json gathered on the test machine, in the run
+folder or loose beside its archive. For runs without one, the coordinator is told the
+test machine with -m; runs with neither fail rather than being filed under the worker.
+
+The coordinator only listens on this machine unless given -b; workers on other machines
+need it to listen on their network (-b 0.0.0.0), which it will only do with a key of
+its own (-k) that the workers are given too.
+
+A run that fails is queued again, up to a number of attempts. A run taken by a
+worker that then goes quiet for longer than the lease is queued again for another
+worker to take; whichever result comes back first is kept.
+
+Usage:
+    distributedGather.py coordinator <store.ndjson> <runs_folder> [...] [-l <local_workers>] [-m <test_machine>]
+                                     [-b <listen_address> -k <authkey>]
+    distributedGather.py worker <coordinator_host> [-k <authkey>]
+"""
+
+import sys
+import os
+import os.path
+import json
+import time
+import queue
+import socket
+import tempfile
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from gatherperfdata import gather_run, archive_run_name, recorded_test_machine, TestMachine
+from ingestResults import FileStore, document_id
+from revisionIndex import find_runs
+
+_DEFAULT_PORT = 50070
+_DEFAULT_AUTHKEY = "pamirperf"  # only for a coordinator listening on this machine alone
+_DEFAULT_BIND = "localhost"
+_LOCAL_ADDRESSES = ["localhost", "127.0.0.1", "::1"]
+_DEFAULT_ATTEMPTS = 3
+_DEFAULT_LEASE = 600.0  # seconds a worker may hold a run without reporting back
+_POLL_INTERVAL = 1.0  # seconds
+
+_ID = "_id"
+
+
+class Messages:
+    """First item of each tuple a worker puts on the result queue"""
+    STARTED = "started"  # (STARTED, run_path, worker)
+    DONE = "done"  # (DONE, run_path, worker, results JSon object)
+    FAILED = "failed"  # (FAILED, run_path, worker, error text)
+
+
+# ---------------------------------------------------------
+# Queues shared through the manager. These live in the coordinator's
+# manager server process; workers only ever see proxies.
+# ---------------------------------------------------------
+
+_task_queue = queue.Queue()
+_result_queue = queue.Queue()
+_stop_event = threading.Event()
+
+
+def _get_task_queue():
+    return _task_queue
+
+
+def _get_result_queue():
+    return _result_queue
+
+
+def _get_stop_event():
+    return _stop_event
+
+
+class TaskDispenser:
+    """Hands a worker the next task and reports it STARTED in one step, in the manager's
+    process, so a worker that dies as it takes a task still leaves a lease to run out."""
+    def take(self, worker, timeout):
+        """The next (run path, machine name), or None if there is none within timeout seconds."""
+        try:
+            task = _task_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        _result_queue.put((Messages.STARTED, task[0], worker))
+        return task
+
+
+_task_dispenser = TaskDispenser()
+
+
+def _get_task_dispenser():
+    return _task_dispenser
+
+
+class GatherManager(BaseManager):
+    pass
+
+
+GatherManager.register("get_task_queue", callable=_get_task_queue)
+GatherManager.register("get_task_dispenser", callable=_get_task_dispenser)
+GatherManager.register("get_result_queue", callable=_get_result_queue)
+GatherManager.register("get_stop_event", callable=_get_stop_event)
+
+
+# ---------------------------------------------------------
+# Worker
+# ---------------------------------------------------------
+
+def worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def scrape_run_json(run_path, work_dir, machine_name=None):
+    """Gather one run and return its results as a JSon object.
+    The run keeps the machine and suite label it was recorded with, else is given machine_name's.
+    The spreadsheet text files go to work_dir; only the JSon is sent back."""
+    machine, suite_label = recorded_test_machine(run_path)
+    if machine is None:
+        if machine_name is None:
+            raise ValueError("No results.json to take the test machine from. "
+                             "Give the coordinator -m <test machine>.")
+        machine = TestMachine()
+        machine.name = machine_name
+        suite_label = "tc" + machine_name
+
+    output_prefix = os.path.join(work_dir, archive_run_name(run_path) + ".")
+    return gather_run(run_path, output_prefix, machine=machine, suite_label=suite_label).to_json_object()
+
+
+def worker_main(host, port=_DEFAULT_PORT, authkey=_DEFAULT_AUTHKEY):
+    """Take runs from the coordinator until it says stop. Returns the number gathered."""
+    manager = GatherManager(address=(host, port), authkey=authkey.encode())
+    manager.connect()
+    tasks = manager.get_task_dispenser()
+    results = manager.get_result_queue()
+    stop = manager.get_stop_event()
+
+    name = worker_name()
+    gathered = 0
+    with tempfile.TemporaryDirectory(prefix="gather-") as work_dir:
+        while not stop.is_set():
+            try:
+                task = tasks.take(name, _POLL_INTERVAL)
+            except (EOFError, ConnectionError):
+                break  # the coordinator has finished and shut down
+            if task is None:
+                continue
+
+            run_path, machine_name = task
+            try:
+                run_json = scrape_run_json(run_path, work_dir, machine_name)
+            except Exception as err:
+                results.put((Messages.FAILED, run_path, name, "{}: {}".format(type(err).__name__, err)))
+                continue
+
+            results.put((Messages.DONE, run_path, name, run_json))
+            gathered += 1
+
+    return gathered
+
+
+# ---------------------------------------------------------
+# Coordinator
+# ---------------------------------------------------------
+
+class GatherStatus:
+    def __init__(self):
+        self.gathered = 0
+        self.failed = {}  # run path -> last error
+        self.retries = 0
+        self.reissued = 0
+        self.by_worker = {}  # worker -> runs gathered
+        self.seconds = 0.0
+
+    def report(self, outfile=sys.stdout):
+        print("Gathered {} runs ({} failed) in {:.1f}s: {} retries, {} reissued after the lease ran out."
+              .format(self.gathered, len(self.failed), self.seconds, self.retries, self.reissued), file=outfile)
+        for worker, count in sorted(self.by_worker.items()):
+            print("  {}: {} runs".format(worker, count), file=outfile)
+        for run_path, error in sorted(self.failed.items()):
+            print("  Failed: {}: {}".format(run_path, error), file=outfile)
+
+
+def coordinate(tasks, results, run_paths, store,
+               attempts=_DEFAULT_ATTEMPTS, lease=_DEFAULT_LEASE, outfile=sys.stdout, machine_name=None):
+    """Hand out run_paths and merge the results into store until every run is
+    gathered or has failed attempts times. machine_name is the test machine of runs
+    without a results.json to say."""
+    status = GatherStatus()
+    start = time.perf_counter()
+    pending = set(run_paths)
+    tries = {run_path: 0 for run_path in run_paths}
+    leases = {}  # run path -> (worker, time taken)
+
+    for run_path in run_paths:
+        tasks.put((run_path, machine_name))
+
+    while pending:
+        now = time.monotonic()
+        for run_path, (worker, taken) in list(leases.items()):
+            if now - taken > lease:
+                print("{} has not finished {} in {:.0f}s. Queued again.".format(worker, run_path, lease),
+                      file=outfile)
+                del leases[run_path]
+                status.reissued += 1
+                tasks.put((run_path, machine_name))
+
+        try:
+            message = results.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+
+        kind, run_path, worker = message[:3]
+        if run_path not in pending:
+            continue  # a late result for a run another worker already finished
+
+        if kind == Messages.STARTED:
+            leases[run_path] = (worker, time.monotonic())
+        elif kind == Messages.DONE:
+            run_json = message[3]
+            run_json[_ID] = document_id(run_json)
+            store.write_batch([json.dumps(run_json, separators=(",", ":"), sort_keys=True)])
+            leases.pop(run_path, None)
+            pending.discard(run_path)
+            status.gathered += 1
+            status.by_worker[worker] = status.by_worker.get(worker, 0) + 1
+            print("{} gathered {}".format(worker, run_path), file=outfile)
+        elif kind == Messages.FAILED:
+            leases.pop(run_path, None)
+            tries[run_path] += 1
+            if tries[run_path] < attempts:
+                print("{} failed {} ({}). Queued again.".format(worker, run_path, message[3]), file=outfile)
+                status.retries += 1
+                tasks.put((run_path, machine_name))
+            else:
+                pending.discard(run_path)
+                status.failed[run_path] = message[3]
+
+    status.seconds = time.perf_counter() - start
+    return status
+
+
+def coordinator_main(store_filename, runs_folders, local_workers=0, port=_DEFAULT_PORT,
+                     authkey=None, attempts=_DEFAULT_ATTEMPTS, lease=_DEFAULT_LEASE,
+                     bind=_DEFAULT_BIND, machine_name=None):
+    """Gather the runs in runs_folders. The manager listens on bind; anything other than this
+    machine alone needs an authkey of its own, as whoever has the key can run code here."""
+    if authkey is None:
+        if bind not in _LOCAL_ADDRESSES:
+            raise ValueError("Listening on {} needs an authkey of its own (-k)".format(bind))
+        authkey = _DEFAULT_AUTHKEY
+
+    run_paths = []
+    for runs_folder in runs_folders:
+        run_paths.extend(sorted(find_runs(runs_folder)))
+
+    manager = GatherManager(address=(bind, port), authkey=authkey.encode())
+    local_host = "localhost" if bind in _LOCAL_ADDRESSES + ["", "0.0.0.0", "::"] else bind
+    manager.start()
+    workers = []
+    try:
+        for i in range(local_workers):
+            worker = multiprocessing.Process(target=worker_main, args=(local_host, port, authkey))
+            worker.start()
+            workers.append(worker)
+
+        store = FileStore(store_filename)
+        store.connect()
+        try:
+            print("Gathering {} runs. Workers connect to {} port {}.".format(len(run_paths), bind, port))
+            status = coordinate(manager.get_task_queue(), manager.get_result_queue(), run_paths,
+                                store, attempts, lease, machine_name=machine_name)
+        finally:
+            store.close()
+
+        manager.get_stop_event().set()
+        for worker in workers:
+            worker.join()
+    finally:
+        manager.shutdown()
+
+    status.report()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gather test runs with a coordinator and worker processes.")
+    commands = parser.add_subparsers(dest="command")
+
+    coordinator_parser = commands.add_parser("coordinator", help="hand out runs and merge the results")
+    coordinator_parser.add_argument("store", help="NDJSON file the results are merged into")
+    coordinator_parser.add_argument("runs_folders", nargs="+", help="folders holding run folders or .7z archives")
+    coordinator_parser.add_argument("-l", "--local-workers", type=int, default=0,
+                                    help="worker processes to start on this machine")
+    coordinator_parser.add_argument("--attempts", type=int, default=_DEFAULT_ATTEMPTS)
+    coordinator_parser.add_argument("--lease", type=float, default=_DEFAULT_LEASE,
+                                    help="seconds before a run taken by a silent worker is queued again")
+    coordinator_parser.add_argument("-m", "--machine", help="test machine of the runs that have no results.json")
+    coordinator_parser.add_argument("-b", "--bind", default=_DEFAULT_BIND,
+                                    help="address to listen on, default this machine only; "
+                                         "any other needs -k")
+
+    worker_parser = commands.add_parser("worker", help="gather runs handed out by a coordinator")
+    worker_parser.add_argument("host", help="coordinator host name")
+
+    for command_parser in (coordinator_parser, worker_parser):
+        command_parser.add_argument("-p", "--port", type=int, default=_DEFAULT_PORT)
+        command_parser.add_argument("-k", "--authkey", help="shared by the coordinator and its workers")
+
+    args = parser.parse_args()
+    if args.command == "coordinator":
+        if args.authkey is None and args.bind not in _LOCAL_ADDRESSES:
+            coordinator_parser.error("listening on {} needs -k/--authkey".format(args.bind))
+        coordinator_main(args.store, args.runs_folders, args.local_workers, args.port,
+                         args.authkey, args.attempts, args.lease, args.bind, args.machine)
+    elif args.command == "worker":
+        authkey = args.authkey if args.authkey is not None else _DEFAULT_AUTHKEY
+        print("Gathered {} runs.".format(worker_main(args.host, args.port, authkey)))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
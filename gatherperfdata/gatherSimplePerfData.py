@@ -18,6 +18,8 @@ Several more tests have been added since.
 5. Added code to collect data from CHP_FDT10 (FR_ChapeauFramDesignTest) log files
 6. Modified FDT4 to HD4_FDT4
 7. Added several new tests
+8. Each log is read once per run folder. Added batch mode: many run folders in parallel,
+   written as CSV or JSON (gatherSimplePerfData.py batch <folders> -o results.csv)
 """
 
 import sys
@@ -28,29 +30,36 @@ import traceback
 debug = False
 global outputfile
 
+# stripped lines of each log read so far, by path. Each collector searches the
+# same logs for several tags; this way a log is read once per run folder.
+# Cleared by collectRunTimings.
+logCache = {}
+
+def readLogLines(filename):
+    """stripped lines of the file, or an empty list if it can't be read"""
+    key = os.path.normcase(os.path.abspath(filename))
+    lines = logCache.get(key)
+    if lines is None:
+        lines = []
+        try:
+            with open(filename,mode="r") as file:
+                lines = [line.strip() for line in file]
+        except IOError:
+            pass
+        logCache[key] = lines
+
+    return lines
+
 def getDataFromFile(searchSpec):
     """traverses the file stream to get perf data from the tagToFind elements.
     returns as a list"""
     (filename, tagToFind) = searchSpec
     results = []
-    file = None
-    try:
-        file = open(filename,mode="r")
-
-        line = file.readline()
-        while line:
-            line = line.strip()
-            if line.find(tagToFind) >= 0:
-                # remove the seconds unit suffix
-                line = line.replace("s "," ")
-                results.append(line)
-
-            line = file.readline()
-    except IOError:
-        pass
-    finally:
-        if file:
-            file.close()
+    for line in readLogLines(filename):
+        if line.find(tagToFind) >= 0:
+            # remove the seconds unit suffix
+            line = line.replace("s "," ")
+            results.append(line)
 
     return results
 
@@ -516,78 +525,211 @@ def collectDataFromFrameDesignWithScabTest(folderName):
     
     return timingData
     
+def timingValues(td):
+    """(name, value) of each number of the timing data, in spreadsheet order"""
+    values = [("startToLogin", td.startToLogin), ("loginToMainForm", td.loginToMainForm)]
+
+    if (td.selectMetalwork != None):
+        values.append(("selectMetalwork", td.selectMetalwork))
+
+    for index, runTime in enumerate(td.runTimes, 1):
+        values.append(("run%d" % index, runTime))
+
+    if (td.sapphireReport != None):
+        values.append(("sapphireReport", td.sapphireReport))
+
+    if (td.pamirShutdown != None):
+        values.append(("pamirShutdown", td.pamirShutdown))
+
+    if (td.sapphireShutdown != None):
+        values.append(("sapphireShutdown", td.sapphireShutdown))
+
+    values.append(("shutdown", td.shutdown))
+
+    if (td.fileSize != None):
+        values.append(("fileSize", td.fileSize))
+
+    return values
+
 def outputTimingArrayToFile(timingArray):
     if debug: print ("\n===========================\n", file=outputfile)
 
     for td in timingArray:
         if (td == None):
             continue
-        
-        print ("%.3f\n%.3f" % (td.startToLogin, td.loginToMainForm), file=outputfile)
-       
-        if (td.selectMetalwork != None):
-            print ("%.3f" % (td.selectMetalwork), file=outputfile)  ## print the time of selected Metalwork
-            
-        if (len(td.runTimes) != 0):
-            for runTime in td.runTimes:
-               print("%.3f" % (runTime), file = outputfile)
-
-        if (td.sapphireReport != None):
-            print ("%.3f" % (td.sapphireReport), file=outputfile)  ## print the time of generating Sapphire Report
-
-        if (td.pamirShutdown != None):
-            print ("%.3f" % (td.pamirShutdown), file=outputfile)  ## print the time of Pamir Shutdown
-
-        if (td.sapphireShutdown != None):
-            print ("%.3f" % (td.sapphireShutdown), file=outputfile)  ## print the time of Sapphire Report Viewer Shutdown
-        
-        print ("%.3f" % (td.shutdown), file=outputfile)
-        
-        if (td.fileSize != None):
-            print ("%.3f" % (td.fileSize), file=outputfile)  ## print file size of the saved Pamir job
-            
+
+        for name, value in timingValues(td):
+            print ("%.3f" % (value), file=outputfile)
+
         print ("", file=outputfile)  ## new line to create a gap for next result
 
-def main(): 
-    global outputfile       
-    with open("baseline-results.txt",mode="w") as outputfile:
-        timingArray = []
+# (collector, test folder) of the extra tests, in spreadsheet order
+extraTests = [
+    (collectDataFromNavigationTrimTest, "NTT4"),
+    (collectDataFromMonoToDuoTest, "MDT5"),
+    (collectDataFromFrameDesignTest, "HD4_FDT6"),
+    (collectDataFromFrameDesignTest, "CHP_FDT10"),
+    (collectDataFromHipToHipPlusTest, "FR-HHT7"),
+    (collectDataFromHipToHipPlusTest, "UK-HHT8"),
+    (collectDataFromBenchmarkTest, "FR_LWS9"),
+    (collectDataFromUK_ThousandDrawingObjectsTest, "UK_TDOT17"),
+    (collectDataFromBenchmarkTest, "SW_FBMT11"),
+    (collectDataFromBenchmarkTest, "UK_HT1_FBMT12"),
+    (collectDataFromOutputPDFTests, "ISOLA_PDF13"),
+    (collectDataFromOutputPDFTests, "UK_LayoutPDF14"),
+    (collectDataFromUK_DisableHangerHipToHipTest, "UK-DISH15"),
+    (collectDataFromUK_EnableHangerHipToHipTest, "UK-ENAH16"),
+    (collectDataFromFR_FileSizeTest, "FR-MST18"),
+    (collectDataFromFR_FileSizeTest, "FR-SST19"),
+    (collectDataFromFR_FileSizeTest, "FR-DST20"),
+    (collectDataFromUK_OpenAndSaveTest, "UK-OST21"),
+    (collectDataFromMultipleDesignCasesTest, "T22-FR-MDC"),
+    (collectDataFromFrameDesignWithScabTest, "T23-FR-SCAB"),
+    (collectDataFromFullSynchronisationTest, "UK-SYNC"),
+    (collectDataFromSapphireReportTest, "UK-SAREP")]
+
+def baselineTestName(index):
+    """DPT1, DPT2 or BBT3 from the search specs"""
+    return searchSpecs[index*2][0].split("/")[1]
+
+def collectRunTimings():
+    """timing data of the run folder in the CWD, as two lists of (test, TimingData or None):
+    the baseline tests and the extra tests"""
+    logCache.clear()
+    try:
+        baseline = []
         for index in [0,1,2]:
             tcLogSpec = searchSpecs[index*2]
             perfLogSpec = searchSpecs[index*2+1]
+            baseline.append((baselineTestName(index), collectDataForOneTest(tcLogSpec,perfLogSpec)))
+
+        extra = [(folderName, collector(folderName)) for (collector, folderName) in extraTests]
+    finally:
+        logCache.clear()
+
+    return baseline, extra
+
+def main(): 
+    global outputfile
+    baseline, extra = collectRunTimings()
+
+    with open("baseline-results.txt",mode="w") as outputfile:
+        outputTimingArrayToFile([td for (test, td) in baseline])
 
-            timingArray.append(collectDataForOneTest(tcLogSpec,perfLogSpec))
-            
-        outputTimingArrayToFile(timingArray)
-        
     with open("extra-results.txt",mode="w") as outputfile:
-        timingArray = []
-        
-        # collect data from extra tests
-        timingArray.append(collectDataFromNavigationTrimTest("NTT4"))
-        timingArray.append(collectDataFromMonoToDuoTest("MDT5"))
-        timingArray.append(collectDataFromFrameDesignTest("HD4_FDT6"))
-        timingArray.append(collectDataFromFrameDesignTest("CHP_FDT10"))
-        timingArray.append(collectDataFromHipToHipPlusTest("FR-HHT7"))
-        timingArray.append(collectDataFromHipToHipPlusTest("UK-HHT8"))
-        timingArray.append(collectDataFromBenchmarkTest("FR_LWS9"))
-        timingArray.append(collectDataFromUK_ThousandDrawingObjectsTest("UK_TDOT17"))
-        timingArray.append(collectDataFromBenchmarkTest("SW_FBMT11"))
-        timingArray.append(collectDataFromBenchmarkTest("UK_HT1_FBMT12"))
-        timingArray.append(collectDataFromOutputPDFTests("ISOLA_PDF13"))
-        timingArray.append(collectDataFromOutputPDFTests("UK_LayoutPDF14"))
-        timingArray.append(collectDataFromUK_DisableHangerHipToHipTest("UK-DISH15"))
-        timingArray.append(collectDataFromUK_EnableHangerHipToHipTest("UK-ENAH16"))
-        timingArray.append(collectDataFromFR_FileSizeTest("FR-MST18"))
-        timingArray.append(collectDataFromFR_FileSizeTest("FR-SST19")) 
-        timingArray.append(collectDataFromFR_FileSizeTest("FR-DST20"))
-        timingArray.append(collectDataFromUK_OpenAndSaveTest("UK-OST21"))
-        timingArray.append(collectDataFromMultipleDesignCasesTest("T22-FR-MDC"))
-        timingArray.append(collectDataFromFrameDesignWithScabTest("T23-FR-SCAB"))
-        timingArray.append(collectDataFromFullSynchronisationTest("UK-SYNC"))
-        timingArray.append(collectDataFromSapphireReportTest("UK-SAREP"))
-        outputTimingArrayToFile(timingArray)
- 
+        outputTimingArrayToFile([td for (test, td) in extra])
+
+# ---------------------------------------------------------
+# Batch mode: many run folders at once, written as CSV or JSON
+# ---------------------------------------------------------
+
+def isRunFolder(path):
+    testFolders = [baselineTestName(index) for index in [0,1,2]] + [folderName for (c, folderName) in extraTests]
+    return any(os.path.isdir(os.path.join(path, folderName)) for folderName in testFolders)
+
+def findRunFolders(paths):
+    """the paths that are run folders, and the run folders directly in the other paths"""
+    runFolders = []
+    for path in paths:
+        if isRunFolder(path):
+            runFolders.append(path)
+        elif os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if isRunFolder(os.path.join(path, name)):
+                    runFolders.append(os.path.join(path, name))
+
+    return runFolders
+
+def collectRunFolder(runFolder):
+    """timings of one run folder as plain data:
+    (runFolder, [(group, test, [(name, value)])], error text or None)"""
+    cwd = os.getcwd()
+    try:
+        os.chdir(runFolder)
+        baseline, extra = collectRunTimings()
+    except Exception as err:
+        return (runFolder, [], "%s: %s" % (type(err).__name__, err))
+    finally:
+        os.chdir(cwd)
+
+    rows = []
+    for (group, timings) in [("baseline", baseline), ("extra", extra)]:
+        for (test, td) in timings:
+            if td != None:
+                rows.append((group, test, timingValues(td)))
+
+    return (runFolder, rows, None)
+
+def writeCsv(results, outfile):
+    import csv
+    writer = csv.writer(outfile, lineterminator="\n")
+    writer.writerow(["runFolder", "group", "test", "name", "value"])
+    for (runFolder, rows, error) in results:
+        for (group, test, values) in rows:
+            for (name, value) in values:
+                writer.writerow([os.path.basename(runFolder), group, test, name, "%.3f" % (value)])
+
+def writeJson(results, outfile):
+    import json
+    runs = []
+    for (runFolder, rows, error) in results:
+        run = {"runFolder": os.path.basename(runFolder), "path": os.path.abspath(runFolder), "tests": []}
+        if error != None:
+            run["error"] = error
+        for (group, test, values) in rows:
+            run["tests"].append({"group": group, "test": test,
+                                 "values": dict((name, round(value, 3)) for (name, value) in values)})
+        runs.append(run)
+    json.dump(runs, outfile, indent=3)
+
+def batchMain(paths, output=None, outputFormat=None, jobs=0):
+    """scrape the run folders in paths, jobs at a time (0 for one per core), into output
+    as CSV or JSON (from the output extension if not given). returns the failed run folders."""
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    if outputFormat == None:
+        outputFormat = "json" if output != None and output.lower().endswith(".json") else "csv"
+
+    runFolders = findRunFolders(paths)
+    start = time.perf_counter()
+    if jobs == 1:
+        results = [collectRunFolder(runFolder) for runFolder in runFolders]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+            results = list(executor.map(collectRunFolder, runFolders, chunksize=4))
+    seconds = time.perf_counter() - start
+
+    write = writeJson if outputFormat == "json" else writeCsv
+    if output == None:
+        write(results, sys.stdout)
+    else:
+        with open(output, mode="w", newline="") as outfile:
+            write(results, outfile)
+
+    failed = [(runFolder, error) for (runFolder, rows, error) in results if error != None]
+    for (runFolder, error) in failed:
+        print("Failed: %s: %s" % (runFolder, error), file=sys.stderr)
+    print("%d run folders in %.2fs, %d failed" % (len(runFolders), seconds, len(failed)), file=sys.stderr)
+    return failed
+
+def parseBatchArgs(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="gatherSimplePerfData.py batch",
+                                     description="Scrape the spreadsheet numbers from many run folders.")
+    parser.add_argument("paths", nargs="+", help="run folders, or folders holding them")
+    parser.add_argument("-o", "--output", help="output file, default standard output")
+    parser.add_argument("-f", "--format", choices=["csv", "json"], help="default from the output extension, else csv")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="processes, default one per core")
+    return parser.parse_args(args)
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "batch":
+    # gatherSimplePerfData.py batch <run folders or folders of them> [-o out.csv|out.json] [-j jobs]
+    batchArgs = parseBatchArgs(sys.argv[2:])
+    if len(batchMain(batchArgs.paths, batchArgs.output, batchArgs.format, batchArgs.jobs)) > 0:
+        sys.exit(1)
+    sys.exit(0)
+
 try:
  
     if __name__ == "__main__":
@@ -2,11 +2,15 @@
 import os
 import sys
 import os.path
+import io
 import json
 import re
-from datetime import datetime
+import locale
+import time
+from datetime import datetime, timedelta
 from typing import Dict
 from enum import Enum
+from contextlib import contextmanager
 
 __author__ = 'JSmith' and 'SZhang'
 
@@ -21,6 +25,8 @@ Several more tests have been added since.
 
 _debug = False
 _output_file = None
+_archived_run = None  # ArchivedRunFolder being scraped, if any
+_gather_stats = None  # GatherStats of the scrape in progress, if any
 TEST_SUITE_LABEL = "tc" + os.environ['COMPUTERNAME']
 
 # ---------------------------------------------------------
@@ -42,6 +48,7 @@ TestResult
     duration: total of the test operation durations. ideally elapsed time
     operationResults: array of TestOperationResult
     status: currently always "pass" as failures are not recorded.
+    hostLoad: optional summary of host CPU, memory, disk and busiest processes during the test
 
 TestOperationResult
     label: operation label
@@ -61,13 +68,48 @@ BuildInfo
 # ---------------------------------------------------------
 
 
+class GatherStats:
+    """Self-metrics of a gather: bytes of log opened for parsing and seconds spent per collector."""
+    def __init__(self):
+        self.bytes_parsed = 0
+        self.collector_seconds = {}  # type: Dict[str, float]
+        self.total_seconds = 0.0
+
+    def add_collector_time(self, collector_name, seconds):
+        self.collector_seconds[collector_name] = self.collector_seconds.get(collector_name, 0.0) + seconds
+
+
+def open_log_file(filename, encoding=None):
+    """Open a log file for reading as text.
+    Logs inside the archived run being scraped are served from memory instead of disk."""
+    if _archived_run is not None and _archived_run.contains(filename):
+        file = _archived_run.open_text(filename, encoding)
+        file_size = _archived_run.get_file_size(filename)
+    else:
+        file = open(filename, mode="r", encoding=encoding, errors="ignore")
+        file_size = os.fstat(file.fileno()).st_size
+
+    if _gather_stats is not None:
+        _gather_stats.bytes_parsed += file_size
+
+    return file
+
+
+def path_exists(path):
+    """os.path.exists that also understands paths inside the archived run being scraped."""
+    if _archived_run is not None and _archived_run.contains(path):
+        return _archived_run.has_path(path)
+
+    return os.path.exists(path)
+
+
 def get_matching_lines_from_file(filename, tag_to_find):
     """traverses the file stream to get perf data from the tag_to_find elements.
     returns as a list"""
     results = []
     file = None
     try:
-        file = open(filename, mode="r", errors="ignore")
+        file = open_log_file(filename)
 
         line = file.readline()
         while line:
@@ -90,26 +132,44 @@ def get_matching_lines_from_file(filename, tag_to_find):
 _TIMESTAMP_PAMIR_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
 _TIMESTAMP_JSON_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
+# We want to capture timestamps from lines like:
+#   2016-05-26 12:28:19,929 Serializer.ArchiveTypeResolver INFO : Processing assemblies on thread 5
+PAMIR_TIMESTAMP_REGEX = r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})"
+
+# capture Pamir version information from lines like:
+# 2016-05-26 12:43:28,262 MiTek.Pamir INFO : Pamir 5.1.0 (Internal WIP 5.1.0.3149 (r70160)) starting
+# 2016-06-14 12:06:11,298 MiTek.Pamir INFO : Pamir 5.1.2 (5.1.2.38 (r70761)) starting
+# 2015-06-18 13:49:35,348 MiTek.Pamir INFO : Pamir 4.0.3 (56480) starting
+# 2017-02-18 04:46:49,967 MiTek.Pamir INFO : Pamir 5.3.11 (Internal WIP 5.3.11.34844 (r79586)) starting
+_PAMIR_VERSION_LINE_REGEX = r"Pamir (\d+.\d+.\d+) \((.+)\) start"
+
+# the version line is logged within the first few hundred bytes of a Pamir log
+_PAMIR_LOG_HEADER_BYTES = 8 * 1024
+
+# Version of the results.json format, stamped in each file written. Increase it when
+# the format changes so convertLegacyJSon knows which files need converting.
+# 1 was the type/value ops and "$date" times; 2 added the stamp itself.
+SCHEMA_VERSION = 2
+
+# With sort_keys the stamp comes before testResults, so within the first few KB
+_SCHEMA_VERSION_BYTES = 4 * 1024
+_SCHEMA_VERSION_REGEX = r'"schemaVersion":\s*(\d+)'
+
 
 def parse_start_and_duration_from_pamir_log(filename):
     """Use first and last long entry in the Pamir log as a guide for when test started and how long it ran.
     Return tuple (start, duration) where start is a datetime and duration is milliseconds (integer).
     If collection fails, start_time may be set to file date time or current time but duration is always set to 0."""
-
-    # We want to capture timestamps from lines like:
-    #   2016-05-26 12:28:19,929 Serializer.ArchiveTypeResolver INFO : Processing assemblies on thread 5
-    _TIMESTAMP_REGEX = r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})"
-
     file = None
     first_valid_stamp = None
     last_valid_stamp = None
     try:
-        file = open(filename, mode="r", encoding="iso_8859_1", errors="ignore")  # latin-1 encoding
+        file = open_log_file(filename, encoding="iso_8859_1")  # latin-1 encoding
 
         line = file.readline()
         while line:
             # decide if current line is worthy
-            match = re.search(_TIMESTAMP_REGEX, line)
+            match = re.search(PAMIR_TIMESTAMP_REGEX, line)
             if match:
                 if first_valid_stamp is None:
                     first_valid_stamp = match.group(1)
@@ -139,10 +199,18 @@ def parse_start_and_duration_from_pamir_log(filename):
 
 
 def get_file_datetime(filename: str) -> datetime:
+    if _archived_run is not None and _archived_run.contains(filename):
+        return _archived_run.get_file_datetime(filename)
+
     mod_time = os.path.getmtime(filename)
     return datetime.fromtimestamp(mod_time)
 
 
+def parse_pamir_timestamp(stamp: str) -> datetime:
+    """Time stamp of a Pamir or perf log line, as captured by PAMIR_TIMESTAMP_REGEX"""
+    return datetime.strptime(stamp, _TIMESTAMP_PAMIR_FORMAT)
+
+
 def datetime_in_utc_format(value: datetime) -> str:
     """Convert a datetime to the UTC format we are using in JSon files"""
     if value is None:
@@ -151,6 +219,17 @@ def datetime_in_utc_format(value: datetime) -> str:
     return value.strftime(_TIMESTAMP_JSON_FORMAT)
 
 
+def datetime_from_utc_format(value) -> datetime:
+    """Reverse of datetime_in_utc_format. Accepts the BSON {"$date": ...} wrapper too."""
+    if isinstance(value, dict):
+        value = value[JSonLabels.BSON_DATE]
+
+    if value == "":
+        return None
+
+    return datetime.strptime(value, _TIMESTAMP_JSON_FORMAT)
+
+
 def get_total_time_from_perf_line(perf_line: str):
     (a, sep, time_plus_splits) = perf_line.rpartition(":")
     (time_str, sep, b) = time_plus_splits.partition("(")
@@ -195,21 +274,13 @@ def search_seconds_from_perf_lines(lines, search_string):
 def get_pamir_version_from_log(filename):
     """Get Pamir version information from log with given filename.
     Returns (version_short, version_full, revision) a tuple of strings."""
-    # capture Pamir version information from lines like:
-    # 2016-05-26 12:43:28,262 MiTek.Pamir INFO : Pamir 5.1.0 (Internal WIP 5.1.0.3149 (r70160)) starting
-    # 2016-06-14 12:06:11,298 MiTek.Pamir INFO : Pamir 5.1.2 (5.1.2.38 (r70761)) starting
-    # 2015-06-18 13:49:35,348 MiTek.Pamir INFO : Pamir 4.0.3 (56480) starting
-    # 2017-02-18 04:46:49,967 MiTek.Pamir INFO : Pamir 5.3.11 (Internal WIP 5.3.11.34844 (r79586)) starting
-
-    _PAMIR_VERSION_LINE_REGEX = r"Pamir (\d+.\d+.\d+) \((.+)\) start"
-
     version_short = ""
     version_full = ""
     revision = 0
 
     file = None
     try:
-        file = open(filename, mode="r", encoding="utf8", errors="ignore")
+        file = open_log_file(filename, encoding="utf8")
 
         line = file.readline()
         while line:
@@ -228,20 +299,48 @@ def get_pamir_version_from_log(filename):
             file.close()
 
     if version_full != "":
-        # look for bracketed revision within the full version string
-        try:
-            match = re.search(r"\((.+)\)", version_full)
-            if match:
-                revision = int(re.sub("r", "", match.group(1)))
-            else:
-                revision = int(version_full)
-        except ValueError:
-            print("Error: failed to parse revision number from '{}'".format(version_full))
-            revision = 0
+        revision = revision_from_version_full(version_full)
 
     return version_short, version_full, revision
 
 
+def revision_from_version_full(version_full):
+    """Look for bracketed revision within the full version string. Returns 0 on failure."""
+    try:
+        match = re.search(r"\((.+)\)", version_full)
+        if match:
+            return int(re.sub("r", "", match.group(1)))
+        else:
+            return int(version_full)
+    except ValueError:
+        print("Error: failed to parse revision number from '{}'".format(version_full))
+        return 0
+
+
+def read_pamir_log_header(file, max_bytes=_PAMIR_LOG_HEADER_BYTES):
+    """Parse the start of an open Pamir log, reading no more than max_bytes.
+    Returns (start_time, version_short, version_full, revision).
+    start_time is None and the version strings empty if they weren't found."""
+    start_time = None
+    version_short = ""
+    version_full = ""
+
+    for line in file.read(max_bytes).splitlines():
+        if start_time is None:
+            match = re.search(PAMIR_TIMESTAMP_REGEX, line)
+            if match:
+                start_time = datetime.strptime(match.group(1), _TIMESTAMP_PAMIR_FORMAT)
+
+        match = re.search(_PAMIR_VERSION_LINE_REGEX, line)
+        if match:
+            version_short = match.group(1)
+            version_full = match.group(2)
+            break
+
+    revision = revision_from_version_full(version_full) if version_full != "" else 0
+    return start_time, version_short, version_full, revision
+
+
 # ---------------------------------------------------------
 # Model classes inc. TestResult
 # ---------------------------------------------------------
@@ -275,6 +374,20 @@ class JSonLabels:
     REVISION = "revision"
     BUILD_TESTED = "buildTested"
     BSON_DATE = "$date"
+    HOST_LOAD = "hostLoad"
+    SAMPLE_COUNT = "samples"
+    CPU_MEAN = "cpuMeanPercent"
+    CPU_MAX = "cpuMaxPercent"
+    MEMORY_MAX = "memoryMaxMB"
+    DISK_READ = "diskReadMB"
+    DISK_WRITE = "diskWriteMB"
+    TOP_PROCESSES = "topProcesses"
+    CALIBRATION = "calibration"
+    SCORE = "score"
+    CPU_SCORE = "cpuScore"
+    IO_SCORE = "ioScore"
+    BENCHMARK_VERSION = "benchmarkVersion"
+    SCHEMA_VERSION = "schemaVersion"
 
 
 class OpLabels:
@@ -294,6 +407,10 @@ class OpLabels:
     FRAME_REFRESH = "FrameRefresh"
     LAYOUT_PAINT = "LayoutPaint"
     LAYOUT_REFRESH = "Refresh"
+    # the labels collected as ops of a test, as opposed to its run times
+    TEST_OPS = frozenset([TO_LOGIN, TO_MAIN_FORM, PAMIR_SHUTDOWN, SELECT_METALWORK, SAPPHIRE_REPORT,
+                          TWENTY20_SHUTDOWN, SAPPHIRE_SHUTDOWN, FILE_SIZE,
+                          AVERAGE_DESIGN, AVERAGE_CHECK, AVERAGE_BUILD])
 
 
 class OpResultType(Enum):
@@ -304,11 +421,22 @@ class OpResultType(Enum):
 
 class OpResult:
     """Result of an operation"""
+    __slots__ = ("label", "value", "type", "source_line")
+
+    # the log line an op was parsed from is only kept when asked for. See use_compact_model.
+    keep_source_lines = True
+
     def __init__(self, label: str, value: int, type: OpResultType, source_line: str = ""):
         self.label = label
         self.value = value
         self.type = type
-        self.source_line = source_line
+        self.source_line = source_line if OpResult.keep_source_lines else ""
+
+    @staticmethod
+    def from_json_object(json_op):
+        return OpResult(sys.intern(json_op[JSonLabels.LABEL]),
+                        json_op[JSonLabels.VALUE],
+                        OpResultType[json_op[JSonLabels.TYPE]])
 
     def to_seconds(self):
         """Assuming value is a duration in ms, returns value in seconds."""
@@ -331,11 +459,15 @@ class OpResult:
 
 
 class DurationOpResult(OpResult):
+    __slots__ = ()
+
     def __init__(self, label: str, duration: int, source_line: str = ""):
         OpResult.__init__(self, label, duration, OpResultType.Duration, source_line)
 
 
 class FileSizeOpResult(OpResult):
+    __slots__ = ()
+
     def __init__(self, label: str, file_size: int, source_line: str = ""):
         OpResult.__init__(self, label, file_size, OpResultType.FileSize, source_line)
 
@@ -345,15 +477,30 @@ class TestMachine:
     information for the machine this code is running on.
 
     Requires psutil which can be installed via  python.exe -m pip install psutil"""
+    __slots__ = ("name", "processor", "logical_cores", "memory", "operating_system", "calibration")
+
     def __init__(self):
         self.name = ""
         self.processor = ""
         self.logical_cores = 0
         self.memory = 0
         self.operating_system = ""
+        self.calibration = None  # MachineCalibration, if the machine was calibrated for the run
+
+    @staticmethod
+    def from_json_object(json_machine):
+        machine = TestMachine()
+        machine.name = sys.intern(json_machine[JSonLabels.NAME])
+        machine.processor = sys.intern(json_machine[JSonLabels.PROCESSOR])
+        machine.operating_system = sys.intern(json_machine[JSonLabels.OPERATING_SYSTEM])
+        machine.logical_cores = json_machine[JSonLabels.CPU_COUNT]
+        machine.memory = json_machine[JSonLabels.MEMORY]
+        if JSonLabels.CALIBRATION in json_machine:
+            machine.calibration = MachineCalibration.from_json_object(json_machine[JSonLabels.CALIBRATION])
+        return machine
 
     def to_json_object(self):
-        return {
+        json_dict = {
             JSonLabels.NAME: self.name,
             JSonLabels.PROCESSOR: self.processor,
             JSonLabels.OPERATING_SYSTEM: self.operating_system,
@@ -361,13 +508,54 @@ class TestMachine:
             JSonLabels.MEMORY: self.memory
         }
 
+        if self.calibration is not None:
+            json_dict[JSonLabels.CALIBRATION] = self.calibration.to_json_object()
+
+        return json_dict
+
+
+class MachineCalibration:
+    """Scores from the calibration micro-benchmark, see machineCalibration.py.
+    A score of 1000 is the reference machine; a machine twice as fast scores 2000.
+    Scores are only comparable between the same benchmark version."""
+    __slots__ = ("score", "cpu_score", "io_score", "benchmark_version")
+
+    def __init__(self, score, cpu_score, io_score, benchmark_version):
+        self.score = score
+        self.cpu_score = cpu_score
+        self.io_score = io_score
+        self.benchmark_version = benchmark_version
+
+    @staticmethod
+    def from_json_object(json_calibration):
+        return MachineCalibration(json_calibration[JSonLabels.SCORE],
+                                  json_calibration[JSonLabels.CPU_SCORE],
+                                  json_calibration[JSonLabels.IO_SCORE],
+                                  json_calibration[JSonLabels.BENCHMARK_VERSION])
+
+    def to_json_object(self):
+        return {
+            JSonLabels.SCORE: self.score,
+            JSonLabels.CPU_SCORE: self.cpu_score,
+            JSonLabels.IO_SCORE: self.io_score,
+            JSonLabels.BENCHMARK_VERSION: self.benchmark_version,
+        }
+
 
 class BuildInfo:
+    __slots__ = ("version_short", "version_long", "revision")
+
     def __init__(self, ver_short, ver_long, rev):
         self.version_short = ver_short
         self.version_long = ver_long
         self.revision = rev
 
+    @staticmethod
+    def from_json_object(json_build):
+        return BuildInfo(sys.intern(json_build[JSonLabels.VERSION_SHORT]),
+                         sys.intern(json_build[JSonLabels.VERSION_LONG]),
+                         json_build[JSonLabels.REVISION])
+
     def to_json_object(self):
         return {
             JSonLabels.VERSION_SHORT: self.version_short,
@@ -376,6 +564,69 @@ class BuildInfo:
         }
 
 
+class HostLoad:
+    """Summary of the host samples taken while a test ran. See hostSampler.py"""
+    __slots__ = ("sample_count", "cpu_mean", "cpu_max", "memory_max", "disk_read", "disk_write", "top_processes")
+
+    def __init__(self):
+        self.sample_count = 0
+        self.cpu_mean = 0.0  # percent
+        self.cpu_max = 0.0
+        self.memory_max = 0  # MB
+        self.disk_read = 0.0  # MB
+        self.disk_write = 0.0
+        self.top_processes = []  # (name, mean cpu percent) busiest first
+
+    @staticmethod
+    def from_samples(samples, top_count=3):
+        host_load = HostLoad()
+        host_load.sample_count = len(samples)
+        if len(samples) == 0:
+            return host_load
+
+        process_cpu = {}
+        for sample in samples:
+            host_load.cpu_mean += sample.cpu_percent
+            host_load.cpu_max = max(host_load.cpu_max, sample.cpu_percent)
+            host_load.memory_max = max(host_load.memory_max, sample.memory_used)
+            host_load.disk_read += sample.disk_read
+            host_load.disk_write += sample.disk_write
+            for name, cpu in sample.top_processes:
+                process_cpu[name] = process_cpu.get(name, 0.0) + cpu
+
+        host_load.cpu_mean = round(host_load.cpu_mean / len(samples), 1)
+        host_load.disk_read = round(host_load.disk_read / (1024 * 1024), 1)
+        host_load.disk_write = round(host_load.disk_write / (1024 * 1024), 1)
+        busiest = sorted(process_cpu.items(), key=lambda p: p[1], reverse=True)[:top_count]
+        host_load.top_processes = [(name, round(cpu / len(samples), 1)) for name, cpu in busiest]
+        return host_load
+
+    def to_json_object(self):
+        return {
+            JSonLabels.SAMPLE_COUNT: self.sample_count,
+            JSonLabels.CPU_MEAN: self.cpu_mean,
+            JSonLabels.CPU_MAX: self.cpu_max,
+            JSonLabels.MEMORY_MAX: self.memory_max,
+            JSonLabels.DISK_READ: self.disk_read,
+            JSonLabels.DISK_WRITE: self.disk_write,
+            JSonLabels.TOP_PROCESSES: [{JSonLabels.NAME: name, JSonLabels.CPU_MEAN: cpu}
+                                       for name, cpu in self.top_processes],
+        }
+
+    @staticmethod
+    def from_json_object(json_load):
+        host_load = HostLoad()
+        host_load.sample_count = json_load[JSonLabels.SAMPLE_COUNT]
+        host_load.cpu_mean = json_load[JSonLabels.CPU_MEAN]
+        host_load.cpu_max = json_load[JSonLabels.CPU_MAX]
+        host_load.memory_max = json_load[JSonLabels.MEMORY_MAX]
+        host_load.disk_read = json_load[JSonLabels.DISK_READ]
+        host_load.disk_write = json_load[JSonLabels.DISK_WRITE]
+        host_load.top_processes = [(sys.intern(p[JSonLabels.NAME]), p[JSonLabels.CPU_MEAN])
+                                   for p in json_load[JSonLabels.TOP_PROCESSES]]
+        return host_load
+
+
 def test_machine_from_host():
     """Get test machine data.
     Requires psutil and py-cpuinfo packages from PyPy:
@@ -404,15 +655,46 @@ def test_machine_from_host():
 
 class TestResult:
     """Collected timing information for a test"""
+    __slots__ = ("op_results", "run_times", "run_ops", "label", "run_labels",
+                 "start_time", "duration", "status", "host_load")
+
     def __init__(self, test_label: str):
         self.op_results = {}  # type: Dict[str, OpResult]
         self.run_times = []
+        self.run_ops = []  # run times as loaded from JSon, in ms
         # for JSon support
         self.label = test_label
         self.run_labels = []
         self.start_time = None  # datetime
         self.duration = 0  # milliseconds
         self.status = "pass"
+        self.host_load = None  # HostLoad, if the host was sampled during the test
+
+    @staticmethod
+    def from_json_object(json_result):
+        """Build a TestResult from its to_json_object form.
+        to_json_object writes the ops sorted by label followed by the run times in run order.
+        The ops are the leading OpLabels.TEST_OPS labels, in order; the run times start at the
+        first other label, as run labels such as "Design1" or "LayoutPaint" are not test ops.
+        Run times are kept as ms ops so that they round trip exactly."""
+        test_result = TestResult(sys.intern(json_result[JSonLabels.LABEL]))
+        test_result.start_time = datetime_from_utc_format(json_result[JSonLabels.START_TIME])
+        test_result.duration = json_result[JSonLabels.DURATION]
+        test_result.status = sys.intern(json_result[JSonLabels.STATUS])
+        if JSonLabels.HOST_LOAD in json_result:
+            test_result.host_load = HostLoad.from_json_object(json_result[JSonLabels.HOST_LOAD])
+
+        prev_label = None
+        for json_op in json_result[JSonLabels.OP_RESULTS]:
+            op = OpResult.from_json_object(json_op)
+            if (len(test_result.run_ops) == 0 and op.label in OpLabels.TEST_OPS
+                    and (prev_label is None or prev_label < op.label)):
+                test_result.add_op_result(op)
+                prev_label = op.label
+            else:
+                test_result.run_ops.append(op)
+
+        return test_result
 
     def add_op_result(self, op_result: OpResult):
         self.op_results[op_result.label] = op_result
@@ -431,6 +713,9 @@ class TestResult:
             JSonLabels.STATUS: self.status,
         }
 
+        if self.host_load is not None:
+            json_dict[JSonLabels.HOST_LOAD] = self.host_load.to_json_object()
+
         for _, op in sorted(self.op_results.items(), key=lambda i: i[0]):
             json_op_results.append(op.to_json_object())
 
@@ -439,6 +724,9 @@ class TestResult:
                 op = DurationOpResult(self.run_labels[key], sec_to_ms(runTime))
                 json_op_results.append(op.to_json_object())
 
+        for op in self.run_ops:
+            json_op_results.append(op.to_json_object())
+
         return json_dict
 
     def sum_op_durations(self):
@@ -487,6 +775,8 @@ class TestResult:
 
 
 class TestSuiteRun:
+    __slots__ = ("suite_label", "test_results", "notes", "machine", "start_time", "duration", "build_info")
+
     def __init__(self, suite_label: str, machine: TestMachine):
         self.suite_label = suite_label
         self.test_results = []
@@ -500,7 +790,7 @@ class TestSuiteRun:
         self.test_results.append(result)
 
     def calc_start_duration_from_tests(self):
-        if self.test_results.count == 0:
+        if len(self.test_results) == 0:
             return False
 
         self.start_time = self.test_results[0].start_time
@@ -514,6 +804,25 @@ class TestSuiteRun:
 
             self.duration += next_result.duration
 
+        return True
+
+    @staticmethod
+    def from_json_object(json_run):
+        """Build a TestSuiteRun from its to_json_object form."""
+        test_suite_run = TestSuiteRun(sys.intern(json_run[JSonLabels.TEST_SUITE_LABEL]),
+                                      TestMachine.from_json_object(json_run[JSonLabels.MACHINE]))
+        test_suite_run.test_results = [TestResult.from_json_object(r) for r in json_run[JSonLabels.TEST_RESULTS]]
+        test_suite_run.notes = json_run[JSonLabels.NOTES]
+        test_suite_run.duration = json_run[JSonLabels.DURATION]
+        test_suite_run.start_time = datetime_from_utc_format(json_run[JSonLabels.START_TIME])
+        test_suite_run.build_info = BuildInfo.from_json_object(json_run[JSonLabels.BUILD_TESTED])
+        return test_suite_run
+
+    @staticmethod
+    def from_json_file(filename: str):
+        with open(filename, mode="r") as jsonFile:
+            return TestSuiteRun.from_json_object(json.load(jsonFile))
+
     def to_json_object(self):
         test_result_json = [r.to_json_object() for r in self.test_results]
 
@@ -527,6 +836,7 @@ class TestSuiteRun:
                 JSonLabels.BSON_DATE: datetime_in_utc_format(self.start_time)
             },
             JSonLabels.BUILD_TESTED: self.build_info.to_json_object(),
+            JSonLabels.SCHEMA_VERSION: SCHEMA_VERSION,
         }
         return result
 
@@ -535,6 +845,43 @@ class TestSuiteRun:
             json.dump(self.to_json_object(), jsonFile, indent=3,
                       sort_keys=True)
 
+
+def read_schema_version(filename, max_bytes=_SCHEMA_VERSION_BYTES):
+    """Schema version stamped in a results file, read from its first few KB without parsing it.
+    0 for files written before the stamp was added."""
+    with open(filename, mode="r", errors="ignore") as f:
+        return schema_version_of(f.read(max_bytes), max_bytes)
+
+
+def schema_version_of(content, max_bytes=_SCHEMA_VERSION_BYTES):
+    """Schema version stamped in the text or bytes of a results file, found in its first few KB."""
+    head = content[:max_bytes]
+    if isinstance(head, bytes):
+        head = head.decode(errors="ignore")
+    match = re.search(_SCHEMA_VERSION_REGEX, head)
+    return int(match.group(1)) if match else 0
+
+
+def use_compact_model(compact=True):
+    """In compact mode OpResults don't keep the log line they were parsed from.
+    Labels are always interned and all model classes use __slots__."""
+    OpResult.keep_source_lines = not compact
+
+
+def load_test_suite_runs(filenames):
+    """Bulk load results.json files, or containers of runs (see resultsContainer.py),
+    into TestSuiteRuns, e.g. for analysing long histories."""
+    from resultsContainer import is_container, read_container
+
+    test_suite_runs = []
+    for filename in filenames:
+        if is_container(filename):
+            test_suite_runs.extend(TestSuiteRun.from_json_object(json_run)
+                                   for json_run in read_container(filename).read_runs())
+        else:
+            test_suite_runs.append(TestSuiteRun.from_json_file(filename))
+    return test_suite_runs
+
 # ---------------------------------------------------------
 # Data collection - general
 # These methods can have knowledge of the test folder structures
@@ -553,6 +900,191 @@ def get_pamir_log_path(test_dir):
     return os.path.join(test_dir, "data/pamir.log")
 
 
+# archive members the collectors read, relative to the test folder (lower case)
+_ARCHIVED_LOG_NAMES = ["testrun.log", "data/pamir-perf.log", "data/pamir.log"]
+_ARCHIVED_RUN_FILE_NAMES = ["host-samples.csv", "calibration.json"]  # in the run folder itself rather than a test folder
+_GATHERED_FOLDER = "gathered"  # beside the archives, for the results scraped from them
+
+
+def archive_member_key(member_name):
+    """Map an archive member name to '<test folder>/<log name>' in lower case, or just the
+    file name for files of the run folder itself, or None if it is not a log the collectors read.
+    Any folders above the test folder (e.g. r70160/DPT1/...) are ignored."""
+    parts = member_name.replace("\\", "/").lower().split("/")
+    if parts[-1] in _ARCHIVED_RUN_FILE_NAMES:
+        return parts[-1]
+
+    for log_name in _ARCHIVED_LOG_NAMES:
+        log_parts = log_name.split("/")
+        if len(parts) > len(log_parts) and parts[-len(log_parts):] == log_parts:
+            return "/".join(parts[-len(log_parts) - 1:])
+
+    return None
+
+
+class _EnoughRead(Exception):
+    """Stops decompressing once the start of every member wanted has been read"""
+
+
+def _head_io_factory(max_bytes, member_count):
+    """py7zr writer factory keeping only the first max_bytes of each member,
+    which stops the extraction once it has them for all member_count members."""
+    from py7zr.io import BytesIOFactory, Py7zBytesIO
+
+    class HeadBytesIO(Py7zBytesIO):
+        def write(self, s):
+            Py7zBytesIO.write(self, s[:max(0, self.limit - self.size())])
+            if self.size() >= self.limit:
+                factory.full.add(self.filename)
+                if len(factory.full) >= member_count:
+                    raise _EnoughRead()
+            return len(s)
+
+    class HeadIOFactory(BytesIOFactory):
+        def create(self, filename):
+            product = HeadBytesIO(filename, self.limit)
+            self.products[filename] = product
+            return product
+
+    factory = HeadIOFactory(max_bytes)
+    factory.full = set()
+    return factory
+
+
+class ArchivedRunFolder:
+    """In-memory view of a test run folder stored as a <run>.7z archive.
+    Only the logs the collectors read are decompressed and nothing is written to disk.
+
+    Requires py7zr which can be installed via  python -m pip install py7zr"""
+    def __init__(self, archive_path: str):
+        self.base_path = os.path.normpath(archive_path)
+        self.archive_time = datetime.fromtimestamp(os.path.getmtime(archive_path))
+        self.members = {}  # type: Dict[str, bytes]
+        self.mod_times = {}  # type: Dict[str, datetime]
+        self.test_dirs = {}  # lower case test folder name -> name as archived
+
+    def _open_archive(self):
+        import importlib.util
+        if not importlib.util.find_spec("py7zr"):
+            raise Exception(ArchivedRunFolder.__doc__)
+
+        import py7zr
+        return py7zr.SevenZipFile(self.base_path, mode="r")
+
+    def list_member_keys(self):
+        """Keys of the logs held in the archive, without decompressing anything."""
+        with self._open_archive() as archive:
+            keys = [archive_member_key(info.filename) for info in archive.list() if not info.is_directory]
+
+        return sorted(key for key in keys if key is not None)
+
+    def load(self, key_filter=None, max_bytes=None):
+        """Decompress the wanted members into memory.
+        key_filter optionally narrows the members loaded, given a '<test folder>/<log name>' key.
+        max_bytes optionally keeps only the start of each member, decompressing no further than needed."""
+        with self._open_archive() as archive:
+            targets = {}
+            limit = 1
+            for info in archive.list():
+                if info.is_directory:
+                    continue
+
+                key = archive_member_key(info.filename)
+                if key is None or (key_filter is not None and not key_filter(key)):
+                    continue
+
+                targets[info.filename] = key
+                self.mod_times[key] = datetime.fromtimestamp(info.creationtime.timestamp())
+                if "/" in key:
+                    test_dir = key.partition("/")[0]
+                    self.test_dirs[test_dir] = info.filename.replace("\\", "/").split("/")[-key.count("/") - 1]
+                limit = max(limit, info.uncompressed + 1)
+
+            if len(targets) == 0:
+                return
+
+            if hasattr(archive, "read"):
+                # py7zr < 1.0
+                products = archive.read(targets=list(targets))
+            else:
+                from py7zr.io import BytesIOFactory
+                if max_bytes is None:
+                    factory = BytesIOFactory(limit)
+                else:
+                    factory = _head_io_factory(max_bytes, len(targets))
+                try:
+                    archive.extract(targets=list(targets), factory=factory)
+                except _EnoughRead:
+                    pass
+                products = factory.products
+
+        for name, product in products.items():
+            product.seek(0)
+            self.members[targets[name]] = product.read(max_bytes)
+
+    def _relative_key(self, path):
+        rel_path = os.path.relpath(os.path.normpath(path), self.base_path)
+        return rel_path.replace("\\", "/").lower()
+
+    def contains(self, path):
+        """True if path is the archive or lies inside it."""
+        normed = os.path.normpath(path)
+        return normed == self.base_path or normed.startswith(os.path.join(self.base_path, ""))
+
+    def has_path(self, path):
+        key = self._relative_key(path)
+        return key == "." or key in self.test_dirs or key in self.members
+
+    def open_text(self, path, encoding=None):
+        key = self._relative_key(path)
+        if key not in self.members:
+            raise FileNotFoundError("No member {} in archive {}".format(key, self.base_path))
+
+        if encoding is None:
+            encoding = locale.getpreferredencoding(False)
+
+        return io.StringIO(self.members[key].decode(encoding, errors="ignore"))
+
+    def get_file_datetime(self, path):
+        return self.mod_times.get(self._relative_key(path), self.archive_time)
+
+    def get_file_size(self, path):
+        return len(self.members.get(self._relative_key(path), b""))
+
+    def list_test_dirs(self):
+        return sorted(os.path.join(self.base_path, d) for d in self.test_dirs.values())
+
+
+def is_run_archive(path):
+    return path.lower().endswith(".7z") and os.path.isfile(path)
+
+
+@contextmanager
+def open_run_folder(path):
+    """Context in which the logs of a run folder or <run>.7z archive can be read by the collectors.
+    Yields the base path to pass them."""
+    global _archived_run
+    if not is_run_archive(path):
+        yield path
+        return
+
+    archived_run = ArchivedRunFolder(path)
+    archived_run.load()
+    _archived_run = archived_run
+    try:
+        yield archived_run.base_path
+    finally:
+        _archived_run = None
+
+
+def list_test_dirs(base_path):
+    """Test folders in a run folder, or in the archived run being scraped."""
+    if _archived_run is not None and _archived_run.contains(base_path):
+        return _archived_run.list_test_dirs()
+
+    return sorted(entry.path for entry in os.scandir(base_path) if entry.is_dir())
+
+
 def collect_tc_stopwatch_data(test_result, test_dir, stopwatch_ops=None):
     """Collect timing from the TestComplete Test logs for
     the startup and shutdown."""
@@ -612,10 +1144,44 @@ def collect_test_suite_run_data(test_suite_run: TestSuiteRun, base_path: str):
         test_suite_run.build_info = collect_build_info_from_test(base_path, test_suite_run.test_results[0].label)
 
     if not test_suite_run.calc_start_duration_from_tests():
-        test_suite_run.startDateTime = get_file_datetime(base_path)
+        test_suite_run.start_time = get_file_datetime(base_path)
 
     pass
 
+
+def collect_host_load(test_suite_run: TestSuiteRun, base_path: str):
+    """If the host was sampled during the run (see hostSampler.py), summarise the samples
+    taken within each test's start time and duration."""
+    from bisect import bisect_left, bisect_right
+
+    samples_file = os.path.join(base_path, "host-samples.csv")
+    if not path_exists(samples_file):
+        return
+
+    from hostSampler import read_host_samples_from
+    with open_log_file(samples_file) as f:
+        samples = read_host_samples_from(f)
+    sample_times = [sample.time for sample in samples]
+
+    for test_result in test_suite_run.test_results:
+        if test_result.start_time is None:
+            continue
+
+        end_time = test_result.start_time + timedelta(milliseconds=test_result.duration)
+        first = bisect_left(sample_times, test_result.start_time)
+        last = bisect_right(sample_times, end_time)
+        test_result.host_load = HostLoad.from_samples(samples[first:last])
+
+
+def collect_machine_calibration(test_suite_run: TestSuiteRun, base_path: str):
+    """If the machine was calibrated for the run (see machineCalibration.py), add its scores."""
+    calibration_file = os.path.join(base_path, "calibration.json")
+    if not path_exists(calibration_file):
+        return
+
+    with open_log_file(calibration_file) as f:
+        test_suite_run.machine.calibration = MachineCalibration.from_json_object(json.load(f))
+
 # ---------------------------------------------------------
 #  Test collection routines and close support methods
 # ---------------------------------------------------------
@@ -1011,16 +1577,23 @@ def scrape_test_run(base_path, collector, test_label):
     """Collect data from extra test run"""
     test_dir = test_dir_from_label(base_path, test_label)
 
-    if not os.path.exists(test_dir):
+    if not path_exists(test_dir):
         return None
 
-    return collector(test_dir, test_label)
+    if _gather_stats is None:
+        return collector(test_dir, test_label)
+
+    collector_start = time.perf_counter()
+    try:
+        return collector(test_dir, test_label)
+    finally:
+        _gather_stats.add_collector_time(collector.__name__, time.perf_counter() - collector_start)
 
 
-def scrape_test_runs(base_path, out_filename, tests_to_scrape):
+def scrape_test_runs(base_path, out_filepath, tests_to_scrape):
     global _output_file
     test_runs = []
-    with open(os.path.join(base_path, out_filename), mode="w") as _output_file:
+    with open(out_filepath, mode="w") as _output_file:
         for collector, label in tests_to_scrape:
             result = scrape_test_run(base_path, collector, label)
             if result is not None:
@@ -1030,19 +1603,37 @@ def scrape_test_runs(base_path, out_filename, tests_to_scrape):
     return test_runs
 
 
-def main(base_path):
+def scrape_test_suite_run(base_path, output_prefix, gather_stats=None, machine=None, suite_label=None):
+    """Scrape all known tests under base_path into a TestSuiteRun.
+    The spreadsheet text files are written to paths starting with output_prefix.
+    Pass a GatherStats to have it filled in. machine and suite_label default to this host's,
+    for runs scraped on the machine that ran them."""
+    global _gather_stats
+    _gather_stats = gather_stats
+    gather_start = time.perf_counter()
+    try:
+        return _scrape_test_suite_run(base_path, output_prefix, machine, suite_label)
+    finally:
+        _gather_stats = None
+        if gather_stats is not None:
+            gather_stats.total_seconds = time.perf_counter() - gather_start
+
+
+def _scrape_test_suite_run(base_path, output_prefix, machine=None, suite_label=None):
     # It might be worth checking file structure at this point and bailing out if we dont recognise test data.
-    global _output_file
-    machine = test_machine_from_host()
+    if machine is None:
+        machine = test_machine_from_host()
+    if suite_label is None:
+        suite_label = TEST_SUITE_LABEL
 
-    test_suite_run = TestSuiteRun(TEST_SUITE_LABEL, machine)
+    test_suite_run = TestSuiteRun(suite_label, machine)
 
     basic_tests = [
         (basic_design_test_collector, "DPT1"),
         (basic_design_test_collector, "DPT2"),
         (basic_build_test_collector, "BBT3"),
     ]
-    timing_array = scrape_test_runs(base_path, "baseline-results2.txt", basic_tests)
+    timing_array = scrape_test_runs(base_path, output_prefix + "baseline-results2.txt", basic_tests)
 
     extra_tests = [
         (nav_trim_test_collector, "NTT4"),
@@ -1068,18 +1659,129 @@ def main(base_path):
         (full_sync_test_collector, "UK-SYNC"),
         (sapphire_report_test_collector, "UK-SAREP"),
     ]
-    timing_array2 = scrape_test_runs(base_path, "extra-results2.txt", extra_tests)
+    timing_array2 = scrape_test_runs(base_path, output_prefix + "extra-results2.txt", extra_tests)
 
     timing_array.extend(timing_array2)
     for td in timing_array:
         test_suite_run.append_result(td)
 
     collect_test_suite_run_data(test_suite_run, base_path)
+    collect_host_load(test_suite_run, base_path)
+    collect_machine_calibration(test_suite_run, base_path)
+    return test_suite_run
+
+
+def write_metrics(test_suite_run, metrics_dir, gather_stats):
+    from openMetrics import write_metrics_file
+    print("Metrics written to: {}".format(write_metrics_file(test_suite_run, metrics_dir, gather_stats)))
+
+
+def add_to_rollups(test_suite_run, rollups_file):
+    from rollups import update_rollups
+    if update_rollups([test_suite_run], rollups_file) > 0:
+        print("Rollups updated: {}".format(rollups_file))
+
+
+def main(base_path, metrics_dir=None, rollups_file=None):
+    gather_stats = GatherStats()
+    test_suite_run = scrape_test_suite_run(base_path, os.path.join(base_path, ""), gather_stats)
     test_suite_run.to_json_file(os.path.join(base_path, "results.json"))
+    if metrics_dir is not None:
+        write_metrics(test_suite_run, metrics_dir, gather_stats)
+    if rollups_file is not None:
+        add_to_rollups(test_suite_run, rollups_file)
 
-if __name__ == "__main__":
-    _base_path = os.getcwd()
-    if len(sys.argv) > 1:
-        _base_path = sys.argv[1]
 
-    main(_base_path)
+def archive_run_name(archive_path):
+    """r70160.7z -> r70160. Run folder names are returned as they are."""
+    name = os.path.basename(os.path.normpath(archive_path))
+    return name[:-len(".7z")] if name.lower().endswith(".7z") else name
+
+
+def loose_results_file(run_path):
+    """The results.json gathered on the machine that ran a run: in the run folder, or for
+    <run>.7z the loose copy <run>.results.json zip-to-archive saves beside the archive."""
+    if os.path.isdir(run_path):
+        return os.path.join(run_path, "results.json")
+    return os.path.join(os.path.dirname(os.path.abspath(run_path)), archive_run_name(run_path) + ".results.json")
+
+
+def recorded_test_machine(run_path):
+    """(TestMachine, test suite label) from the results.json gathered on the machine that ran
+    a run (see loose_results_file), or (None, None) if there is none."""
+    try:
+        with open(loose_results_file(run_path), "r") as f:
+            data = json.load(f)
+        return (TestMachine.from_json_object(data[JSonLabels.MACHINE]),
+                data[JSonLabels.TEST_SUITE_LABEL])
+    except (IOError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+def gather_run(path, output_prefix, gather_stats=None, machine=None, suite_label=None):
+    """Scrape a run folder or <run>.7z archive into a TestSuiteRun.
+    The spreadsheet text files are written to paths starting with output_prefix.
+    machine and suite_label default to this host's (see scrape_test_suite_run)."""
+    with open_run_folder(path) as base_path:
+        test_suite_run = scrape_test_suite_run(base_path, output_prefix, gather_stats, machine, suite_label)
+
+    test_suite_run.notes = "Test folder: {}".format(archive_run_name(path))
+    return test_suite_run
+
+
+def main_from_archive(archive_path, output_path=None, metrics_dir=None, rollups_file=None):
+    """Scrape a <run>.7z archive without extracting it to disk.
+    Results, and the spreadsheet text files, are written to output_path (default: a gathered
+    folder beside the archive) as <run>.results.json. The run keeps the test machine and suite
+    label of the loose copy of results.json beside the archive, which is never overwritten."""
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(archive_path)), _GATHERED_FOLDER)
+    os.makedirs(output_path, exist_ok=True)
+
+    output_prefix = os.path.join(output_path, archive_run_name(archive_path) + ".")
+    results_file = output_prefix + "results.json"
+    if os.path.abspath(results_file) == loose_results_file(archive_path):
+        raise ValueError("{} is the copy of the results from the test machine. "
+                         "Give another output folder.".format(results_file))
+
+    machine, suite_label = recorded_test_machine(archive_path)
+    gather_stats = GatherStats()
+    test_suite_run = gather_run(archive_path, output_prefix, gather_stats, machine, suite_label)
+    test_suite_run.to_json_file(results_file)
+    if metrics_dir is not None:
+        write_metrics(test_suite_run, metrics_dir, gather_stats)
+    if rollups_file is not None:
+        add_to_rollups(test_suite_run, rollups_file)
+    return test_suite_run
+
+
+def main_from_archive_store(store_path, output_path=None, metrics_dir=None, rollups_file=None):
+    """Scrape every <run>.7z archive in store_path."""
+    archives = sorted(name for name in os.listdir(store_path) if name.lower().endswith(".7z"))
+    for archive_name in archives:
+        print("Gathering perf data from archive: {}".format(archive_name))
+        try:
+            main_from_archive(os.path.join(store_path, archive_name), output_path, metrics_dir, rollups_file)
+        except (IOError, IndexError, KeyError, ValueError) as err:
+            print("Error: {}: {}".format(archive_name, err))
+
+
+if __name__ == "__main__":
+    import argparse
+    _parser = argparse.ArgumentParser(description="Gather perf results from a test run folder.")
+    _parser.add_argument("path", nargs="?", default=os.getcwd(),
+                         help="run folder, or with -a a <run>.7z or a folder of them")
+    _parser.add_argument("output_path", nargs="?",
+                         help="with -a, where to write results (default: a gathered folder beside the archives)")
+    _parser.add_argument("-a", "--archive", action="store_true", help="scrape .7z archives without extracting")
+    _parser.add_argument("-m", "--metrics-dir", help="also write OpenMetrics text to this textfile-collector dir")
+    _parser.add_argument("-r", "--rollups", help="also add the results to this rollups file for dashboards")
+    _args = _parser.parse_args()
+
+    if _args.archive:
+        if os.path.isdir(_args.path):
+            main_from_archive_store(_args.path, _args.output_path, _args.metrics_dir, _args.rollups)
+        else:
+            main_from_archive(_args.path, _args.output_path, _args.metrics_dir, _args.rollups)
+    else:
+        main(_args.path, _args.metrics_dir, _args.rollups)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Samples host load while a test suite runs so noisy timings can be explained.
+
+Writes host-samples.csv into the run folder: one row per interval with CPU %,
+memory in use, disk bytes read and written during the interval and the busiest
+processes. gatherperfdata summarises the rows falling within each test's
+start time and duration into results.json.
+
+Start it before the suite and stop it (Ctrl-C or terminate) once the suite is done:
+    hostSampler.py <run_folder> [interval_seconds] [top_process_count]
+
+Requires psutil which can be installed via  python -m pip install psutil
+"""
+
+import sys
+import os
+import os.path
+import csv
+import time
+import threading
+from datetime import datetime
+
+HOST_SAMPLES_FILE = "host-samples.csv"
+
+_DEFAULT_INTERVAL = 1.0  # seconds
+_DEFAULT_TOP_PROCESSES = 3
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S,%f"  # as Pamir logs, local time
+
+
+class SampleColumns:
+    """Column names in host-samples.csv"""
+    TIME = "time"
+    CPU_PERCENT = "cpuPercent"
+    MEMORY_USED = "memoryUsedMB"
+    DISK_READ = "diskReadBytes"
+    DISK_WRITE = "diskWriteBytes"
+    TOP_PROCESSES = "topProcesses"  # name:cpu% separated by ;
+
+    ALL = [TIME, CPU_PERCENT, MEMORY_USED, DISK_READ, DISK_WRITE, TOP_PROCESSES]
+
+
+class HostSample:
+    __slots__ = ("time", "cpu_percent", "memory_used", "disk_read", "disk_write", "top_processes")
+
+    def __init__(self, time_stamp, cpu_percent, memory_used, disk_read, disk_write, top_processes):
+        self.time = time_stamp  # datetime
+        self.cpu_percent = cpu_percent
+        self.memory_used = memory_used  # MB
+        self.disk_read = disk_read  # bytes during the interval
+        self.disk_write = disk_write
+        self.top_processes = top_processes  # list of (name, cpu %)
+
+    def to_row(self):
+        return [self.time.strftime(_TIMESTAMP_FORMAT),
+                "{:.1f}".format(self.cpu_percent),
+                self.memory_used,
+                self.disk_read,
+                self.disk_write,
+                ";".join("{}:{:.1f}".format(name, cpu) for name, cpu in self.top_processes)]
+
+    @staticmethod
+    def from_row(row):
+        top_processes = []
+        if row[SampleColumns.TOP_PROCESSES] != "":
+            for entry in row[SampleColumns.TOP_PROCESSES].split(";"):
+                (name, sep, cpu) = entry.rpartition(":")
+                top_processes.append((name, float(cpu)))
+
+        return HostSample(datetime.strptime(row[SampleColumns.TIME], _TIMESTAMP_FORMAT),
+                          float(row[SampleColumns.CPU_PERCENT]),
+                          int(row[SampleColumns.MEMORY_USED]),
+                          int(row[SampleColumns.DISK_READ]),
+                          int(row[SampleColumns.DISK_WRITE]),
+                          top_processes)
+
+
+def read_host_samples(filename):
+    """Read samples written by HostSampler, oldest first."""
+    with open(filename, mode="r", newline="") as f:
+        return read_host_samples_from(f)
+
+
+def read_host_samples_from(f):
+    """Read samples written by HostSampler from an open text file, oldest first."""
+    return [HostSample.from_row(row) for row in csv.DictReader(f)]
+
+
+def _disk_io_bytes(psutil):
+    """(bytes read, bytes written) by all disks so far. disk_io_counters is None on hosts
+    without disk counters, where no disk I/O is reported."""
+    counters = psutil.disk_io_counters()
+    return (counters.read_bytes, counters.write_bytes) if counters is not None else (0, 0)
+
+
+class HostSampler:
+    """Background thread appending a HostSample to a CSV file every interval seconds."""
+    def __init__(self, filename, interval=_DEFAULT_INTERVAL, top_count=_DEFAULT_TOP_PROCESSES):
+        import importlib.util
+        if not importlib.util.find_spec("psutil"):
+            raise Exception(__doc__)
+
+        self.filename = filename
+        self.interval = interval
+        self.top_count = top_count
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _top_processes(self, psutil):
+        # not the System Idle Process (pid 0), whose CPU is the idle time, nor the sampler
+        ignored_pids = {0, os.getpid()}
+        usage = []
+        for process in psutil.process_iter(["name"]):
+            if process.pid in ignored_pids:
+                continue
+            try:
+                # process_iter caches Process objects so this is the usage since the last sample
+                cpu = process.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            if cpu > 0.0:
+                usage.append((process.info["name"], cpu))
+
+        usage.sort(key=lambda u: u[1], reverse=True)
+        return usage[:self.top_count]
+
+    def run(self):
+        """Sample until stop() is called."""
+        import psutil
+
+        write_header = not os.path.exists(self.filename)
+        with open(self.filename, mode="a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(SampleColumns.ALL)
+
+            # prime the counters that report usage since the previous call
+            psutil.cpu_percent(None)
+            self._top_processes(psutil)
+            last_read, last_write = _disk_io_bytes(psutil)
+
+            while not self._stop_event.wait(self.interval):
+                read_bytes, write_bytes = _disk_io_bytes(psutil)
+                sample = HostSample(datetime.now(),
+                                    psutil.cpu_percent(None),
+                                    int(psutil.virtual_memory().used / (1024 * 1024)),
+                                    read_bytes - last_read,
+                                    write_bytes - last_write,
+                                    self._top_processes(psutil))
+                last_read, last_write = read_bytes, write_bytes
+                writer.writerow(sample.to_row())
+                f.flush()  # so samples survive the sampler being killed
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(run_folder, interval, top_count):
+    sampler = HostSampler(os.path.join(run_folder, HOST_SAMPLES_FILE), interval, top_count)
+    print("Sampling host load every {}s to {}. Ctrl-C to stop.".format(interval, sampler.filename))
+    sampler.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: {} <run_folder> [interval_seconds] [top_process_count]".format(sys.argv[0]))
+        exit()
+
+    _interval = float(sys.argv[2]) if len(sys.argv) > 2 else _DEFAULT_INTERVAL
+    _top_count = int(sys.argv[3]) if len(sys.argv) > 3 else _DEFAULT_TOP_PROCESSES
+    main(sys.argv[1], _interval, _top_count)
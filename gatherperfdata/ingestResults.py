@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""Bulk load results.json files into a document store.
+
+Results are streamed as NDJSON (one compact JSON document per line) in batches
+through a single store connection. Each document gets an _id made from its
+suite label, revision and start time, and is written as an upsert, so a batch
+that fails part way can simply be sent again. Throughput is reported at the end.
+
+Stores:
+    --mongo <uri>       MongoDB via pymongo (python -m pip install pymongo).
+                        The "$date" start times become BSON dates.
+    --file <ndjson>     File backed stand-in for offline use and testing.
+
+Usage:
+    ingestResults.py (--mongo <uri> | --file <ndjson>) <results file or folder> [...]
+"""
+
+import sys
+import os
+import os.path
+import json
+import time
+import argparse
+from gatherperfdata import JSonLabels
+
+_DEFAULT_BATCH_SIZE = 100
+_DEFAULT_RETRIES = 3
+_RETRY_DELAY = 1.0  # seconds, doubled after each failure
+_RESULTS_FILE_SUFFIX = "results.json"
+_ID = "_id"
+
+
+def document_id(data):
+    """Ingest key: suite label, revision and start time."""
+    start_time = data[JSonLabels.START_TIME]
+    if isinstance(start_time, dict):
+        start_time = start_time[JSonLabels.BSON_DATE]
+
+    return "{}|{}|{}".format(data[JSonLabels.TEST_SUITE_LABEL],
+                             data[JSonLabels.BUILD_TESTED][JSonLabels.REVISION],
+                             start_time)
+
+
+def find_results_files(paths):
+    """results.json and <run>.results.json files among paths, searching folders recursively."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(_RESULTS_FILE_SUFFIX):
+                    yield os.path.join(dir_path, file_name)
+
+
+def ndjson_lines(filenames, stats):
+    """Stream each results file as one NDJSON line keyed by document_id."""
+    for filename in filenames:
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+            data[_ID] = document_id(data)
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            print("Skipping {}: {}".format(filename, err))
+            stats.files_skipped += 1
+            continue
+
+        line = json.dumps(data, separators=(",", ":"), sort_keys=True)
+        stats.files += 1
+        stats.bytes += len(line) + 1
+        yield line
+
+
+def batches(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+class IngestStats:
+    def __init__(self):
+        self.files = 0
+        self.files_skipped = 0
+        self.bytes = 0
+        self.batches = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    def report(self, outfile=sys.stdout):
+        seconds = max(self.seconds, 1e-9)
+        print("Ingested {} files ({} skipped) in {} batches, {} retries, {:.2f}s: "
+              "{:.1f} docs/s, {:.2f} MB/s".format(self.files, self.files_skipped, self.batches,
+                                                  self.retries, self.seconds, self.files / seconds,
+                                                  self.bytes / (1024 * 1024) / seconds), file=outfile)
+
+
+# ---------------------------------------------------------
+# Document stores. write_batch must be idempotent per _id.
+# ---------------------------------------------------------
+
+class FileStore:
+    """NDJSON file standing in for a document store.
+    Appends documents; a document already stored with the same _id and content is not
+    written again, a changed one is appended and the last line for an _id wins on load.
+    fail_every makes every nth write_batch fail, to exercise retries offline."""
+    def __init__(self, filename, fail_every=0):
+        self.filename = filename
+        self.fail_every = fail_every
+        self._writes = 0
+        self._documents = {}  # _id -> line
+        self._file = None
+
+    def connect(self):
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line != "":
+                        self._documents[json.loads(line)[_ID]] = line
+
+        self._file = open(self.filename, 'a')
+
+    def write_batch(self, lines):
+        self._writes += 1
+        if self.fail_every > 0 and self._writes % self.fail_every == 0:
+            raise ConnectionError("Simulated store failure on write {}".format(self._writes))
+
+        changed = {}
+        for line in lines:
+            doc_id = json.loads(line)[_ID]
+            if self._documents.get(doc_id) != line:
+                changed[doc_id] = line
+
+        self._file.writelines(line + "\n" for line in changed.values())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # only once written, so a failed batch is written again on retry
+        self._documents.update(changed)
+
+    def count(self):
+        return len(self._documents)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MongoStore:
+    """MongoDB collection. One MongoClient, and so one connection pool, for the whole ingest."""
+    def __init__(self, uri, database, collection):
+        import importlib.util
+        if not importlib.util.find_spec("pymongo"):
+            raise Exception(__doc__)
+
+        self.uri = uri
+        self.database = database
+        self.collection_name = collection
+        self._client = None
+        self._collection = None
+
+    def connect(self):
+        from pymongo import MongoClient
+        self._client = MongoClient(self.uri)
+        self._collection = self._client[self.database][self.collection_name]
+
+    def write_batch(self, lines):
+        from pymongo import ReplaceOne
+        from bson import json_util
+
+        requests = []
+        for line in lines:
+            document = json_util.loads(line)  # {"$date": ...} -> datetime
+            requests.append(ReplaceOne({_ID: document[_ID]}, document, upsert=True))
+        self._collection.bulk_write(requests, ordered=False)
+
+    def count(self):
+        return self._collection.count_documents({})
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+def write_with_retry(store, batch, retries, stats):
+    delay = _RETRY_DELAY
+    for attempt in range(retries + 1):
+        try:
+            store.write_batch(batch)
+            return
+        except Exception as err:
+            if attempt == retries:
+                raise
+            print("Batch write failed ({}). Retrying in {:.1f}s.".format(err, delay))
+            stats.retries += 1
+            time.sleep(delay)
+            delay *= 2
+
+
+def ingest(store, paths, batch_size=_DEFAULT_BATCH_SIZE, retries=_DEFAULT_RETRIES):
+    stats = IngestStats()
+    start = time.perf_counter()
+    store.connect()
+    try:
+        for batch in batches(ndjson_lines(find_results_files(paths), stats), batch_size):
+            write_with_retry(store, batch, retries, stats)
+            stats.batches += 1
+    finally:
+        store.close()
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load results.json files into a document store.")
+    store_group = parser.add_mutually_exclusive_group(required=True)
+    store_group.add_argument("--mongo", metavar="URI", help="MongoDB connection string")
+    store_group.add_argument("--file", metavar="NDJSON", help="file backed stand-in store")
+    parser.add_argument("--database", default="perf")
+    parser.add_argument("--collection", default="testSuiteRuns")
+    parser.add_argument("-b", "--batch-size", type=int, default=_DEFAULT_BATCH_SIZE)
+    parser.add_argument("-r", "--retries", type=int, default=_DEFAULT_RETRIES)
+    parser.add_argument("--fail-every", type=int, default=0, help="file store only: fail every nth batch")
+    parser.add_argument("paths", nargs="+", help="results files or folders to search for them")
+    args = parser.parse_args()
+
+    if args.mongo is not None:
+        store = MongoStore(args.mongo, args.database, args.collection)
+    else:
+        store = FileStore(args.file, args.fail_every)
+
+    stats = ingest(store, args.paths, args.batch_size, args.retries)
+    stats.report()
+
+
+if __name__ == "__main__":
+    main()
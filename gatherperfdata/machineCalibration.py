@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Calibration micro-benchmark so timings from different test machines can be compared.
+
+Runs a short, fixed CPU workload (generate, sort, hash and JSon round trip the same
+pseudo-random numbers every time) and a fixed disk workload (write, sync and read back
+a file in the run folder), and scores each against the reference machine: 1000 is the
+reference, 2000 twice as fast. Each workload is repeated and the fastest time taken.
+
+Run it on the test machine before the suite, giving the run folder; gatherperfdata then
+adds the scores to the machine in results.json:
+    machineCalibration.py calibrate [<run_folder>]
+
+Durations normalised to the reference machine (ms * score / 1000) let one trend line
+mix runs from several machines:
+    machineCalibration.py trend <test> <op> <results file or folder> [...]
+"""
+
+import sys
+import os
+import os.path
+import json
+import math
+import time
+import hashlib
+import argparse
+import tempfile
+from gatherperfdata import (MachineCalibration, OpResultType,
+                            load_test_suite_runs, use_compact_model, datetime_in_utc_format)
+from ingestResults import find_results_files
+
+CALIBRATION_FILE = "calibration.json"
+BENCHMARK_VERSION = 1  # change when the workloads change; scores of different versions don't compare
+REFERENCE_SCORE = 1000
+
+# fastest times of the workloads on the reference machine
+_REFERENCE_CPU_SECONDS = 0.25
+_REFERENCE_IO_SECONDS = 0.05
+
+_REPEATS = 5
+_CPU_NUMBER_COUNT = 200000
+_IO_FILE_MB = 16
+_IO_CHUNK = b"\x5a" * (1024 * 1024)
+
+
+def cpu_workload():
+    """Always does the same work: returns the same digest on every machine."""
+    state = 12345
+    numbers = []
+    for _ in range(_CPU_NUMBER_COUNT):
+        state = (state * 1103515245 + 12345) & 0x7fffffff  # LCG, so no dependence on random's version
+        numbers.append(state)
+
+    numbers.sort()
+    digest = hashlib.sha256()
+    for number in numbers:
+        digest.update(number.to_bytes(4, "little"))
+
+    digest.update(json.dumps(json.loads(json.dumps(numbers[::10]))).encode())
+    return digest.hexdigest()
+
+
+def io_workload(folder):
+    fd, filename = tempfile.mkstemp(prefix="calibration-", dir=folder)
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            for _ in range(_IO_FILE_MB):
+                f.write(_IO_CHUNK)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(filename, mode="rb") as f:
+            while f.read(len(_IO_CHUNK)):
+                pass
+    finally:
+        os.remove(filename)
+
+
+def fastest_seconds(workload, *args):
+    fastest = None
+    for _ in range(_REPEATS):
+        start = time.perf_counter()
+        workload(*args)
+        seconds = time.perf_counter() - start
+        fastest = seconds if fastest is None else min(fastest, seconds)
+    return fastest
+
+
+def calibrate(folder=None):
+    """Benchmark this machine. The disk workload runs in folder (default: temp folder),
+    which should be on the disk the tests use."""
+    if folder is None:
+        folder = tempfile.gettempdir()
+
+    cpu_score = REFERENCE_SCORE * _REFERENCE_CPU_SECONDS / fastest_seconds(cpu_workload)
+    io_score = REFERENCE_SCORE * _REFERENCE_IO_SECONDS / fastest_seconds(io_workload, folder)
+    score = math.sqrt(cpu_score * io_score)
+    return MachineCalibration(round(score, 1), round(cpu_score, 1), round(io_score, 1), BENCHMARK_VERSION)
+
+
+def write_calibration(calibration: MachineCalibration, run_folder):
+    filename = os.path.join(run_folder, CALIBRATION_FILE)
+    with open(filename, mode="w") as f:
+        json.dump(calibration.to_json_object(), f, indent=3, sort_keys=True)
+    return filename
+
+
+# ---------------------------------------------------------
+# Normalised values
+# ---------------------------------------------------------
+
+def normalised_duration(ms, calibration: MachineCalibration):
+    """Duration the op would have taken on the reference machine, or None if the machine
+    was not calibrated with the current benchmark."""
+    if calibration is None or calibration.benchmark_version != BENCHMARK_VERSION:
+        return None
+    return ms * calibration.score / REFERENCE_SCORE
+
+
+def op_values(test_suite_run, test_label):
+    """{op label: OpResult} for a test in a run, run times included."""
+    for test_result in test_suite_run.test_results:
+        if test_result.label == test_label:
+            ops = dict(test_result.op_results)
+            ops.update((op.label, op) for op in test_result.run_ops)
+            return ops
+    return {}
+
+
+def print_trend(test_suite_runs, test_label, op_label, outfile=sys.stdout):
+    """CSV of an op's raw and normalised duration across runs, oldest first.
+    Runs without a start time cannot be placed in the trend and are left out.
+    Runs without a calibration have an empty normalised value."""
+    print("startTime,machine,revision,rawMs,score,normalisedMs", file=outfile)
+    dated_runs = [r for r in test_suite_runs if r.start_time is not None]
+    for test_suite_run in sorted(dated_runs, key=lambda r: r.start_time):
+        op = op_values(test_suite_run, test_label).get(op_label)
+        if op is None or op.type != OpResultType.Duration:
+            continue
+
+        calibration = test_suite_run.machine.calibration
+        normalised = normalised_duration(op.value, calibration)
+        print("{},{},{},{},{},{}".format(datetime_in_utc_format(test_suite_run.start_time),
+                                         test_suite_run.machine.name,
+                                         test_suite_run.build_info.revision,
+                                         op.value,
+                                         calibration.score if calibration is not None else "",
+                                         "{:.0f}".format(normalised) if normalised is not None else ""),
+              file=outfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate test machines and normalise timings.")
+    commands = parser.add_subparsers(dest="command")
+
+    calibrate_parser = commands.add_parser("calibrate", help="benchmark this machine")
+    calibrate_parser.add_argument("run_folder", nargs="?", help="write " + CALIBRATION_FILE + " into this run folder")
+
+    trend_parser = commands.add_parser("trend", help="raw and normalised durations of an op across runs")
+    trend_parser.add_argument("test")
+    trend_parser.add_argument("op")
+    trend_parser.add_argument("paths", nargs="+", help="results files or folders to search for them")
+
+    args = parser.parse_args()
+    if args.command == "calibrate":
+        calibration = calibrate(args.run_folder)
+        print("Score {} (cpu {}, io {})".format(calibration.score, calibration.cpu_score, calibration.io_score))
+        if args.run_folder is not None:
+            print("Written to: {}".format(write_calibration(calibration, args.run_folder)))
+    elif args.command == "trend":
+        use_compact_model()
+        print_trend(load_test_suite_runs(find_results_files(args.paths)), args.test, args.op)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""OpenMetrics / Prometheus text exposition of gathered perf results.
+
+gatherperfdata writes one file per test suite label (i.e. per test machine) into a
+node_exporter textfile-collector directory, replacing the previous run's file, so
+the latest values of each op can be alerted on. Series are labelled with the suite,
+test, op, revision, version and machine. Ops of a calibrated machine also get a
+duration normalised to the reference machine. Gather self-metrics (log bytes parsed,
+seconds per collector) are included.
+
+The reader here is a local stand-in for a scraper, to check a file parses:
+    openMetrics.py <file.prom>
+"""
+
+import sys
+import os
+import os.path
+import re
+import time
+from gatherperfdata import JSonLabels, OpResultType, TestSuiteRun, GatherStats
+from machineCalibration import normalised_duration
+
+METRICS_FILE_SUFFIX = ".prom"
+_PREFIX = "pamir_perf_"
+
+_METRIC_NAME_REGEX = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+_LABEL_REGEX = r'\s*([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"\s*,?'
+_SAMPLE_REGEX = r"^(" + _METRIC_NAME_REGEX + r")(?:\{(.*)\})? (\S+)$"
+
+
+class Metric:
+    """A metric family: a name, its type and help, and samples of (labels, value)."""
+    def __init__(self, name, metric_type, help_text):
+        self.name = name
+        self.type = metric_type
+        self.help = help_text
+        self.samples = []
+
+    def add(self, labels, value):
+        self.samples.append((labels, value))
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_metrics(metrics):
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.help))
+        lines.append("# TYPE {} {}".format(metric.name, metric.type))
+        for labels, value in metric.samples:
+            label_text = ",".join('{}="{}"'.format(k, escape_label_value(v)) for k, v in labels.items())
+            if label_text != "":
+                label_text = "{" + label_text + "}"
+            lines.append("{}{} {}".format(metric.name, label_text, format_value(value)))
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_from_test_suite_run(test_suite_run: TestSuiteRun, gather_stats: GatherStats = None):
+    build = test_suite_run.build_info
+    run_labels = {
+        "suite": test_suite_run.suite_label,
+        "revision": build.revision,
+        "version": build.version_short,
+        "machine": test_suite_run.machine.name,
+    }
+
+    def labels(**extra):
+        result = dict(run_labels)
+        result.update(extra)
+        return result
+
+    suite_start = Metric(_PREFIX + "suite_start_timestamp_seconds", "gauge",
+                         "Start time of the gathered test suite run.")
+    suite_duration = Metric(_PREFIX + "suite_duration_seconds", "gauge",
+                            "Total duration of the tests in the suite run.")
+    test_duration = Metric(_PREFIX + "test_duration_seconds", "gauge",
+                           "Duration of a test, from its Pamir log.")
+    op_duration = Metric(_PREFIX + "op_duration_seconds", "gauge",
+                         "Duration of a timed operation within a test.")
+    op_file_size = Metric(_PREFIX + "op_file_size_bytes", "gauge",
+                          "File size recorded by an operation within a test.")
+    op_normalised = Metric(_PREFIX + "op_normalised_duration_seconds", "gauge",
+                           "Duration of an operation scaled to the reference machine by its calibration score.")
+    calibration = test_suite_run.machine.calibration
+
+    if test_suite_run.start_time is not None:
+        suite_start.add(labels(), test_suite_run.start_time.timestamp())
+    suite_duration.add(labels(), test_suite_run.duration / 1000.0)
+
+    for test_result in test_suite_run.test_results:
+        test_duration.add(labels(test=test_result.label), test_result.duration / 1000.0)
+        seen_ops = set()
+        for json_op in test_result.to_json_object()[JSonLabels.OP_RESULTS]:
+            # a scraper rejects duplicate series so only the first op of a given label is kept
+            if json_op[JSonLabels.LABEL] in seen_ops:
+                continue
+            seen_ops.add(json_op[JSonLabels.LABEL])
+
+            op_labels = labels(test=test_result.label, op=json_op[JSonLabels.LABEL])
+            if json_op[JSonLabels.TYPE] == OpResultType.FileSize.name:
+                op_file_size.add(op_labels, json_op[JSonLabels.VALUE] * 1024)
+            else:
+                op_duration.add(op_labels, json_op[JSonLabels.VALUE] / 1000.0)
+                normalised = normalised_duration(json_op[JSonLabels.VALUE], calibration)
+                if normalised is not None:
+                    op_normalised.add(op_labels, normalised / 1000.0)
+
+    metrics = [suite_start, suite_duration, test_duration, op_duration, op_file_size, op_normalised]
+
+    if gather_stats is not None:
+        gather_time = Metric(_PREFIX + "gather_timestamp_seconds", "gauge",
+                             "When the results were gathered.")
+        gather_time.add(labels(), time.time())
+        bytes_parsed = Metric(_PREFIX + "gather_parsed_bytes", "gauge",
+                              "Bytes of log opened for parsing by the gather.")
+        bytes_parsed.add(labels(), gather_stats.bytes_parsed)
+        gather_seconds = Metric(_PREFIX + "gather_seconds", "gauge",
+                                "Wall-clock seconds taken by the gather.")
+        gather_seconds.add(labels(), gather_stats.total_seconds)
+        collector_seconds = Metric(_PREFIX + "gather_collector_seconds", "gauge",
+                                   "Seconds spent in each test collector during the gather.")
+        for collector_name, seconds in sorted(gather_stats.collector_seconds.items()):
+            collector_seconds.add(labels(collector=collector_name), seconds)
+        metrics.extend([gather_time, bytes_parsed, gather_seconds, collector_seconds])
+
+    return metrics
+
+
+def metrics_file_path(metrics_dir, suite_label):
+    safe_label = re.sub(r"[^a-zA-Z0-9_-]", "_", suite_label)
+    return os.path.join(metrics_dir, _PREFIX + safe_label + METRICS_FILE_SUFFIX)
+
+
+def write_metrics_file(test_suite_run: TestSuiteRun, metrics_dir, gather_stats: GatherStats = None):
+    """Write the run to <metrics_dir>/pamir_perf_<suite label>.prom.
+    Written to a temporary file then renamed so the collector never reads half a file."""
+    filename = metrics_file_path(metrics_dir, test_suite_run.suite_label)
+    temp_filename = filename + ".tmp"  # ignored by the textfile collector
+    with open(temp_filename, mode="w", newline="\n") as f:
+        f.write(format_metrics(metrics_from_test_suite_run(test_suite_run, gather_stats)))
+
+    os.replace(temp_filename, filename)
+    return filename
+
+
+# ---------------------------------------------------------
+# Stand-in scraper
+# ---------------------------------------------------------
+
+def parse_labels(label_text):
+    labels = {}
+    position = 0
+    while position < len(label_text):
+        match = re.compile(_LABEL_REGEX).match(label_text, position)
+        if match is None or match.end() == position:
+            raise ValueError("Bad labels: {}".format(label_text))
+        value = match.group(2).replace("\\n", "\n").replace("\\\"", "\"").replace("\\\\", "\\")
+        labels[match.group(1)] = value
+        position = match.end()
+    return labels
+
+
+def parse_metrics_text(text):
+    """Parse exposition text as a scraper would. Returns {name: Metric}.
+    Raises ValueError on malformed input, samples without a TYPE or a missing # EOF."""
+    metrics = {}
+    lines = text.splitlines()
+    if len(lines) == 0 or lines[-1] != "# EOF":
+        raise ValueError("Missing # EOF")
+
+    for line_num, line in enumerate(lines[:-1], 1):
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            (keyword, name, rest) = line[2:].split(" ", 2)
+            metric = metrics.setdefault(name, Metric(name, "", ""))
+            if keyword == "TYPE":
+                metric.type = rest
+            else:
+                metric.help = rest
+            continue
+
+        match = re.match(_SAMPLE_REGEX, line)
+        if match is None:
+            raise ValueError("Line {}: cannot parse '{}'".format(line_num, line))
+
+        name = match.group(1)
+        if name not in metrics or metrics[name].type == "":
+            raise ValueError("Line {}: no TYPE for {}".format(line_num, name))
+        metrics[name].add(parse_labels(match.group(2) or ""), float(match.group(3)))
+
+    return metrics
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: {} <file.prom>".format(sys.argv[0]))
+        exit()
+
+    with open(sys.argv[1], mode="r") as _f:
+        _metrics = parse_metrics_text(_f.read())
+
+    for _metric in _metrics.values():
+        print("{} ({}): {} samples".format(_metric.name, _metric.type, len(_metric.samples)))
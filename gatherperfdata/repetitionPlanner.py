@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Plan how many times each repeated operation of a test needs running.
+
+Tests such as DPT1 (Design1-5, Check1-5) and BBT3 (Build1-10) repeat an operation
+a fixed number of times and report the average, leaving out the first run. This
+reads the run times of those repetitions from gathered results, pools their
+spread within each run, and works out how many repetitions bring the confidence
+interval of the average within a target fraction of it. Stable ops can be run
+fewer times; noisy ones need more.
+
+Only the spread within a run is reduced by repeating; the spread between runs
+(machine, build) is reported alongside for comparison.
+
+Usage:
+    repetitionPlanner.py <results file or folder> [...] [-c confidence] [-e relative_error]
+"""
+
+import sys
+import re
+import json
+import math
+import argparse
+from datetime import datetime
+from statistics import NormalDist, mean, stdev
+from gatherperfdata import load_test_suite_runs, use_compact_model
+from ingestResults import find_results_files
+
+_DEFAULT_CONFIDENCE = 0.95
+_DEFAULT_RELATIVE_ERROR = 0.05  # half-width of the interval as a fraction of the mean
+_DEFAULT_MIN_REPETITIONS = 2
+_DEFAULT_MAX_REPETITIONS = 20
+_WARM_UP_RUNS = 1  # first repetition is left out of the averages
+
+_REPEATED_LABEL_REGEX = r"^(.*?)(\d+)$"  # Design3 -> (Design, 3)
+
+
+class OpHistory:
+    """Repetition times (ms) of one repeated op of a test, per gathered run."""
+    def __init__(self, test_label, op_label):
+        self.test_label = test_label
+        self.op_label = op_label
+        self.runs = []  # list of lists of ms, warm up left out
+        self.current_repetitions = 0  # including warm up, in the latest run
+
+    def samples(self):
+        return [ms for run in self.runs for ms in run]
+
+    def pooled_stdev(self):
+        """Standard deviation within a run, pooled across runs. None if no run repeats."""
+        sum_squares = 0.0
+        degrees = 0
+        for run in self.runs:
+            if len(run) < 2:
+                continue
+            run_mean = mean(run)
+            sum_squares += sum((ms - run_mean) ** 2 for ms in run)
+            degrees += len(run) - 1
+
+        return math.sqrt(sum_squares / degrees) if degrees > 0 else None
+
+    def between_run_stdev(self):
+        run_means = [mean(run) for run in self.runs if len(run) > 0]
+        return stdev(run_means) if len(run_means) > 1 else 0.0
+
+
+class OpPlan:
+    def __init__(self, history: OpHistory, mean_ms, within_stdev, repetitions):
+        self.history = history
+        self.mean_ms = mean_ms
+        self.within_stdev = within_stdev
+        self.repetitions = repetitions  # including warm up
+
+
+def repetitions_needed(mean_ms, within_stdev, confidence, relative_error,
+                       min_repetitions=_DEFAULT_MIN_REPETITIONS, max_repetitions=_DEFAULT_MAX_REPETITIONS):
+    """Timed repetitions (not counting warm up) so that the confidence interval of
+    the average is within +/- relative_error of it: n = (z * s / (e * mean))^2"""
+    if mean_ms <= 0:
+        return min_repetitions
+
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    n = math.ceil((z * within_stdev / (relative_error * mean_ms)) ** 2)
+    return min(max(n, min_repetitions), max_repetitions)
+
+
+def collect_op_histories(test_suite_runs):
+    """OpHistory for each (test, repeated op), from runs in start time order,
+    those without a start time last."""
+    histories = {}
+    runs = sorted(test_suite_runs, key=lambda r: (r.start_time is None, r.start_time or datetime.min))
+    for test_suite_run in runs:
+        for test_result in test_suite_run.test_results:
+            repetitions = {}  # op label -> [(repetition number, ms)]
+            for op in test_result.run_ops:
+                match = re.match(_REPEATED_LABEL_REGEX, op.label)
+                if match:
+                    repetitions.setdefault(match.group(1), []).append((int(match.group(2)), op.value))
+
+            for op_label, times in repetitions.items():
+                if len(times) < 2:
+                    continue  # a single run time, not a repeated op
+                key = (test_result.label, op_label)
+                history = histories.setdefault(key, OpHistory(*key))
+                times.sort()
+                history.runs.append([ms for _, ms in times[_WARM_UP_RUNS:]])
+                history.current_repetitions = len(times)
+
+    return [histories[key] for key in sorted(histories)]
+
+
+def plan_repetitions(histories, confidence=_DEFAULT_CONFIDENCE, relative_error=_DEFAULT_RELATIVE_ERROR,
+                     min_repetitions=_DEFAULT_MIN_REPETITIONS, max_repetitions=_DEFAULT_MAX_REPETITIONS):
+    plans = []
+    for history in histories:
+        within_stdev = history.pooled_stdev()
+        if within_stdev is None:
+            continue
+        mean_ms = mean(history.samples())
+        timed = repetitions_needed(mean_ms, within_stdev, confidence, relative_error,
+                                   min_repetitions, max_repetitions)
+        plans.append(OpPlan(history, mean_ms, within_stdev, timed + _WARM_UP_RUNS))
+
+    return plans
+
+
+def test_plan(plans):
+    """{test label: repetitions}. Ops of a test repeat together (Design1, Check1, Design2, ...)
+    so a test runs as many repetitions as its noisiest op needs."""
+    result = {}
+    for plan in plans:
+        label = plan.history.test_label
+        result[label] = max(result.get(label, 0), plan.repetitions)
+    return result
+
+
+def print_plans(plans, outfile=sys.stdout):
+    print("{:<12}{:<10}{:>5}{:>10}{:>8}{:>10}{:>9}{:>9}".format(
+        "test", "op", "runs", "mean (s)", "cv %", "btwn cv %", "current", "planned"), file=outfile)
+
+    test_repetitions = test_plan(plans)
+    saved_ms = 0
+    for plan in plans:
+        history = plan.history
+        print("{:<12}{:<10}{:>5}{:>10.3f}{:>8.1f}{:>10.1f}{:>9}{:>9}".format(
+            history.test_label, history.op_label, len(history.runs), plan.mean_ms / 1000.0,
+            100.0 * plan.within_stdev / plan.mean_ms if plan.mean_ms > 0 else 0.0,
+            100.0 * history.between_run_stdev() / plan.mean_ms if plan.mean_ms > 0 else 0.0,
+            history.current_repetitions, plan.repetitions), file=outfile)
+        saved_ms += (history.current_repetitions - test_repetitions[history.test_label]) * plan.mean_ms
+
+    print("Estimated change in suite time per run: {:+.1f}s".format(-saved_ms / 1000.0), file=outfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan repetitions of repeated test ops from their history.")
+    parser.add_argument("paths", nargs="+", help="results files or folders to search for them")
+    parser.add_argument("-c", "--confidence", type=float, default=_DEFAULT_CONFIDENCE)
+    parser.add_argument("-e", "--relative-error", type=float, default=_DEFAULT_RELATIVE_ERROR,
+                        help="interval half-width as a fraction of the mean")
+    parser.add_argument("--min", type=int, default=_DEFAULT_MIN_REPETITIONS, help="fewest timed repetitions")
+    parser.add_argument("--max", type=int, default=_DEFAULT_MAX_REPETITIONS, help="most timed repetitions")
+    parser.add_argument("-o", "--output", help="also write the plan per test to this JSon file")
+    args = parser.parse_args()
+
+    use_compact_model()
+    test_suite_runs = load_test_suite_runs(find_results_files(args.paths))
+    plans = plan_repetitions(collect_op_histories(test_suite_runs), args.confidence, args.relative_error,
+                             args.min, args.max)
+    print_plans(plans)
+
+    if args.output is not None:
+        with open(args.output, mode="w") as f:
+            json.dump(test_plan(plans), f, indent=3, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
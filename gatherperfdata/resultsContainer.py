@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Many test suite runs in one compact file.
+
+A container is NDJSON (one compact results JSon per line) where each line is
+compressed as its own gzip member, so the whole file is still a valid gzip stream
+(gzip -dc gives the NDJSON) while any single run can be read by seeking to it.
+A sidecar index, <container>.idx, holds the byte offset and length of each run by
+revision, start time and test suite label. Runs are appended; a run added again replaces the earlier
+one in the index.
+
+load_test_suite_runs in gatherperfdata reads containers as well as results.json files.
+
+Usage:
+    resultsContainer.py list <container> [<from_revision> [<to_revision>]]
+    resultsContainer.py extract <container> <revision> <start_time> [-s <suite_label>] [-o <output.json>]
+"""
+
+import sys
+import os
+import os.path
+import gzip
+import json
+import argparse
+from bisect import bisect_left, bisect_right
+from gatherperfdata import JSonLabels
+
+CONTAINER_SUFFIX = ".ndjson.gz"
+INDEX_SUFFIX = ".idx"
+
+
+class IndexLabels:
+    """Magic strings for the container index"""
+    RUNS = "runs"
+    OFFSET = "offset"
+    LENGTH = "length"
+
+
+def run_key(json_run):
+    """(revision, start time, suite label) identifying a run in a container."""
+    start_time = json_run[JSonLabels.START_TIME]
+    if isinstance(start_time, dict):
+        start_time = start_time[JSonLabels.BSON_DATE]
+    return (json_run[JSonLabels.BUILD_TESTED][JSonLabels.REVISION], start_time,
+            json_run[JSonLabels.TEST_SUITE_LABEL])
+
+
+class ResultsContainer:
+    """Reads runs from a container through its index."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self.entries = {}  # (revision, start time, suite label) -> (offset, length)
+        self._sorted_keys = None
+
+    def load_index(self):
+        if not os.path.exists(self.index_filename):
+            return
+
+        with open(self.index_filename, 'r') as f:
+            for entry in json.load(f)[IndexLabels.RUNS]:
+                key = (entry[JSonLabels.REVISION], entry[JSonLabels.START_TIME], entry[JSonLabels.TEST_SUITE_LABEL])
+                self.entries[key] = (entry[IndexLabels.OFFSET], entry[IndexLabels.LENGTH])
+        self._sorted_keys = None
+
+    def keys(self):
+        """(revision, start time, suite label) of each run, in order."""
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self.entries)
+        return self._sorted_keys
+
+    def _read(self, f, key):
+        offset, length = self.entries[key]
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(length)))
+
+    def get(self, revision, start_time, suite_label):
+        """The results JSon of one run: a seek and a read of just that run."""
+        with open(self.filename, 'rb') as f:
+            return self._read(f, (revision, start_time, suite_label))
+
+    def query(self, from_revision, to_revision=None):
+        """Results JSon of the runs that tested revisions from_revision to to_revision inclusive."""
+        if to_revision is None:
+            to_revision = from_revision
+
+        keys = self.keys()
+        revisions = [key[0] for key in keys]
+        return self.read_runs(keys[bisect_left(revisions, from_revision):bisect_right(revisions, to_revision)])
+
+    def read_runs(self, keys=None):
+        """Results JSon of the given runs, or of all of them, in order."""
+        with open(self.filename, 'rb') as f:
+            for key in (keys if keys is not None else self.keys()):
+                yield self._read(f, key)
+
+
+class ResultsContainerWriter(ResultsContainer):
+    """Appends runs to a container, creating it if need be. Call save() or close() to index them."""
+    def __init__(self, filename):
+        ResultsContainer.__init__(self, filename)
+        self.load_index()
+        self._file = open(filename, 'ab')
+
+    def append(self, json_run):
+        line = json.dumps(json_run, separators=(",", ":"), sort_keys=True) + "\n"
+        member = gzip.compress(line.encode(), mtime=0)
+        offset = self._file.tell()
+        self._file.write(member)
+        self.entries[run_key(json_run)] = (offset, len(member))
+        self._sorted_keys = None
+
+    def save(self):
+        """Make the runs appended so far durable and index them.
+        Runs are written before the index, and the index is replaced atomically,
+        so an interrupted write leaves at worst some unindexed bytes at the end."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        index = [{JSonLabels.REVISION: key[0],
+                  JSonLabels.START_TIME: key[1],
+                  JSonLabels.TEST_SUITE_LABEL: key[2],
+                  IndexLabels.OFFSET: self.entries[key][0],
+                  IndexLabels.LENGTH: self.entries[key][1]} for key in self.keys()]
+        temp_filename = self.index_filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump({IndexLabels.RUNS: index}, f, separators=(",", ":"))
+
+        os.replace(temp_filename, self.index_filename)
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self.save()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_container(filename):
+    return filename.endswith(CONTAINER_SUFFIX)
+
+
+def read_container(filename):
+    container = ResultsContainer(filename)
+    container.load_index()
+    return container
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or extract runs in a results container.")
+    commands = parser.add_subparsers(dest="command")
+
+    list_parser = commands.add_parser("list", help="list the runs in a container")
+    list_parser.add_argument("container")
+    list_parser.add_argument("from_revision", type=int, nargs="?")
+    list_parser.add_argument("to_revision", type=int, nargs="?")
+
+    extract_parser = commands.add_parser("extract", help="write one run out as results JSon")
+    extract_parser.add_argument("container")
+    extract_parser.add_argument("revision", type=int)
+    extract_parser.add_argument("start_time", help="as in the run's startDateTime, e.g. 2016-05-26T12:03:45.583382Z")
+    extract_parser.add_argument("-s", "--suite", help="test suite label, if runs of several share the start time")
+    extract_parser.add_argument("-o", "--output", help="default: standard output")
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+
+    container = read_container(args.container)
+    if args.command == "list":
+        keys = container.keys()
+        if args.from_revision is not None:
+            to_revision = args.to_revision if args.to_revision is not None else args.from_revision
+            keys = [key for key in keys if args.from_revision <= key[0] <= to_revision]
+        for revision, start_time, suite_label in keys:
+            print("r{}\t{}\t{}".format(revision, start_time, suite_label))
+    else:
+        suites = [key[2] for key in container.keys()
+                  if key[:2] == (args.revision, args.start_time) and args.suite in (None, key[2])]
+        if len(suites) != 1:
+            print("{} runs match.".format(len(suites)))
+            sys.exit(1)
+        json_run = container.get(args.revision, args.start_time, suites[0])
+        if args.output is None:
+            json.dump(json_run, sys.stdout, indent=3, sort_keys=True)
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(json_run, f, indent=3, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+"""Index of test runs by the Pamir build they tested.
+
+Maps revision, version (short and long), machine and start time to the run folder
+or <run>.7z archive holding the logs. The index is filled by reading just the first
+few kilobytes of each test's pamir.log, runs in parallel, and is kept up to date
+incrementally: only runs that are new or have changed since the last update are read.
+
+Usage:
+    revisionIndex.py update <index_file> <runs_folder> [<runs_folder> ...]
+    revisionIndex.py query <index_file> <from_revision> [<to_revision>]
+"""
+
+import sys
+import os
+import os.path
+import json
+import argparse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from gatherperfdata import (JSonLabels, ArchivedRunFolder, open_log_file,
+                            read_pamir_log_header, datetime_in_utc_format, datetime_from_utc_format,
+                            archive_run_name, loose_results_file, _PAMIR_LOG_HEADER_BYTES)
+
+_DEFAULT_WORKERS = 8
+
+
+class IndexLabels:
+    """Magic strings for the index file, in addition to JSonLabels"""
+    PATH = "path"
+    MODIFIED = "modified"
+    SIZE = "size"
+    RUNS = "runs"
+
+
+def find_pamir_logs_in_folder(run_folder):
+    """Pamir logs of the tests in a run folder, sorted by test folder name.
+    File names are matched ignoring case as they vary between Pamir.log and pamir.log."""
+    pamir_logs = []
+    test_dirs = sorted((d for d in os.scandir(run_folder) if d.is_dir()), key=lambda d: d.name)
+    for test_dir in test_dirs:
+        data_dir = os.path.join(test_dir.path, "data")
+        if not os.path.isdir(data_dir):
+            continue
+
+        for entry in os.scandir(data_dir):
+            if entry.name.lower() == "pamir.log" and entry.is_file():
+                pamir_logs.append(entry.path)
+                break
+
+    return pamir_logs
+
+
+def read_recorded_run(results_file):
+    """(machine name, start time) from a results.json (or loose <run>.results.json copy),
+    ("", None) if there is none."""
+    try:
+        with open(results_file, 'r') as f:
+            data = json.load(f)
+        return (data[JSonLabels.MACHINE][JSonLabels.NAME],
+                datetime_from_utc_format(data.get(JSonLabels.START_TIME, "")))
+    except (IOError, ValueError, KeyError, TypeError):
+        return "", None
+
+
+def run_header(headers):
+    """(start_time, version_short, version_long, revision) of a run from the pamir.log headers
+    of its tests: the earliest start, as the test folders do not run in name order, and the
+    version of the first that has one."""
+    start_times = [header[0] for header in headers if header[0] is not None]
+    start_time = min(start_times) if start_times else None
+    for header in headers:
+        if header[3] > 0:
+            return (start_time,) + tuple(header[1:])
+
+    return start_time, "", "", 0
+
+
+def header_from_folder(run_folder):
+    headers = []
+    for pamir_log in find_pamir_logs_in_folder(run_folder):
+        try:
+            with open_log_file(pamir_log, encoding="utf8") as file:
+                headers.append(read_pamir_log_header(file))
+        except IOError:
+            continue
+
+    return run_header(headers)
+
+
+def header_from_archive(archive_path):
+    archived_run = ArchivedRunFolder(archive_path)
+    pamir_keys = sorted(k for k in archived_run.list_member_keys() if k.endswith("/data/pamir.log"))
+    if len(pamir_keys) == 0:
+        return run_header([])
+
+    archived_run.load(lambda k: k in pamir_keys, _PAMIR_LOG_HEADER_BYTES)
+    headers = []
+    for key in pamir_keys:
+        with archived_run.open_text(os.path.join(archived_run.base_path, key), "utf8") as file:
+            headers.append(read_pamir_log_header(file))
+
+    return run_header(headers)
+
+
+def scan_run(run_path):
+    """Build the index entry for a run folder or <run>.7z archive."""
+    if os.path.isdir(run_path):
+        start_time, ver_short, ver_long, revision = header_from_folder(run_path)
+    else:
+        start_time, ver_short, ver_long, revision = header_from_archive(run_path)
+    # the start recorded when the run was gathered, where there is one
+    machine, recorded_start_time = read_recorded_run(loose_results_file(run_path))
+    if recorded_start_time is not None:
+        start_time = recorded_start_time
+
+    stat = os.stat(run_path)
+    return {
+        IndexLabels.PATH: run_path,
+        IndexLabels.MODIFIED: stat.st_mtime_ns,
+        IndexLabels.SIZE: stat.st_size,
+        JSonLabels.REVISION: revision,
+        JSonLabels.VERSION_SHORT: ver_short,
+        JSonLabels.VERSION_LONG: ver_long,
+        JSonLabels.MACHINE: machine,
+        JSonLabels.START_TIME: datetime_in_utc_format(start_time),
+    }
+
+
+def scan_run_or_error(run_path):
+    """(index entry, None) for a run, or (None, the error) if it could not be read."""
+    try:
+        return scan_run(run_path), None
+    except Exception as err:
+        return None, err
+
+
+def find_runs(runs_folder):
+    """Run folders and archives directly under runs_folder."""
+    runs = []
+    for entry in os.scandir(runs_folder):
+        if entry.is_dir() or (entry.is_file() and entry.name.lower().endswith(".7z")):
+            runs.append(os.path.abspath(entry.path))
+
+    return runs
+
+
+class RevisionIndex:
+    """Runs sorted by revision, persisted as JSon."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.runs = []  # sorted by revision
+        self._runs_by_name = None
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, 'r') as f:
+            self.runs = json.load(f)[IndexLabels.RUNS]
+        self._runs_by_name = None
+
+    def save(self):
+        """Write the index atomically so an interrupted update never leaves it half written."""
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump({IndexLabels.RUNS: self.runs}, f, indent=1, sort_keys=True)
+
+        os.replace(temp_filename, self.filename)
+
+    def update(self, runs_folders, workers=_DEFAULT_WORKERS):
+        """Rescan new or changed runs in the given folders and drop their runs that no longer exist.
+        Runs indexed from other folders are kept. A run that cannot be read is reported and
+        left out, to be tried again next update. Returns the number of runs scanned."""
+        known = {run[IndexLabels.PATH]: run for run in self.runs}
+        scanned_folders = {os.path.abspath(runs_folder) for runs_folder in runs_folders}
+        current = {path: run for path, run in known.items() if os.path.dirname(path) not in scanned_folders}
+        to_scan = []
+        for runs_folder in runs_folders:
+            for run_path in find_runs(runs_folder):
+                run = known.get(run_path)
+                stat = os.stat(run_path)
+                if (run is not None
+                    and run[IndexLabels.MODIFIED] == stat.st_mtime_ns
+                    and run[IndexLabels.SIZE] == stat.st_size):
+                    current[run_path] = run
+                else:
+                    to_scan.append(run_path)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for run_path, (run, err) in zip(to_scan, executor.map(scan_run_or_error, to_scan)):
+                if err is not None:
+                    print("Could not index {}: {}".format(run_path, err), file=sys.stderr)
+                    continue
+                current[run[IndexLabels.PATH]] = run
+
+        self.runs = sorted(current.values(),
+                           key=lambda r: (r[JSonLabels.REVISION], r[JSonLabels.START_TIME]))
+        self._runs_by_name = None
+        return len(to_scan)
+
+    def query(self, from_revision, to_revision=None):
+        """Runs that tested revisions from_revision to to_revision inclusive."""
+        if to_revision is None:
+            to_revision = from_revision
+
+        revisions = [run[JSonLabels.REVISION] for run in self.runs]
+        first = bisect_left(revisions, from_revision)
+        last = bisect_right(revisions, to_revision)
+        return self.runs[first:last]
+
+    def find_run(self, run_name):
+        """Index entry for a run with the given folder or archive name, or None."""
+        if self._runs_by_name is None:
+            self._runs_by_name = {archive_run_name(run[IndexLabels.PATH]): run for run in self.runs}
+
+        return self._runs_by_name.get(run_name)
+
+
+def print_runs(runs, outfile=sys.stdout):
+    for run in runs:
+        print("r{}\t{}\t{}\t{}\t{}".format(run[JSonLabels.REVISION],
+                                          run[JSonLabels.VERSION_SHORT],
+                                          run[JSonLabels.MACHINE],
+                                          run[JSonLabels.START_TIME],
+                                          run[IndexLabels.PATH]), file=outfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index test runs by Pamir revision.")
+    commands = parser.add_subparsers(dest="command")
+
+    update_parser = commands.add_parser("update", help="scan new or changed runs into the index")
+    update_parser.add_argument("index_file")
+    update_parser.add_argument("runs_folders", nargs="+", help="folders holding run folders or .7z archives")
+    update_parser.add_argument("-w", "--workers", type=int, default=_DEFAULT_WORKERS)
+
+    query_parser = commands.add_parser("query", help="list runs that tested a revision range")
+    query_parser.add_argument("index_file")
+    query_parser.add_argument("from_revision", type=int)
+    query_parser.add_argument("to_revision", type=int, nargs="?")
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+
+    index = RevisionIndex(args.index_file)
+    index.load()
+
+    if args.command == "update":
+        scanned = index.update(args.runs_folders, args.workers)
+        index.save()
+        print("Scanned {} runs. {} runs indexed.".format(scanned, len(index.runs)))
+    else:
+        print_runs(index.query(args.from_revision, args.to_revision))
+
+
+if __name__ == "__main__":
+    main()
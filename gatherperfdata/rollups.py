@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+"""Pre-aggregated op values for trend dashboards.
+
+For each (test, op, machine) the values of every gathered run are rolled up into
+buckets by revision (every 100 revisions by default), day and ISO week of the run's
+start. Each bucket keeps count, min, max, mean and a log-binned histogram, from which
+the median and 95th percentile are read to within 1%. Buckets are updated in place as
+runs are added, so adding a run costs the same however long the history is, and a run
+already rolled up is not added twice.
+
+gatherperfdata updates the rollups after each gather when given -r <rollups.json>.
+The dashboard reads only the rollups file:
+    rollups.py update <rollups.json> <results file or folder> [...]
+    rollups.py dashboard <rollups.json> <dashboard.html> [-g revision|day|week]
+"""
+
+import os
+import os.path
+import json
+import math
+import html
+import argparse
+from gatherperfdata import JSonLabels, OpResultType, use_compact_model, load_test_suite_runs
+from ingestResults import find_results_files, document_id
+from resultsContainer import CONTAINER_SUFFIX
+
+_DEFAULT_REVISION_BUCKET = 100
+_RELATIVE_ACCURACY = 0.01  # of the median and p95 read from the histogram
+_GAMMA = (1 + _RELATIVE_ACCURACY) / (1 - _RELATIVE_ACCURACY)
+
+_KEY_SEPARATOR = "|"  # test|op|machine
+
+
+class Granularity:
+    REVISION = "revision"
+    DAY = "day"
+    WEEK = "week"
+
+    ALL = [REVISION, DAY, WEEK]
+
+
+class RollupLabels:
+    """Magic strings for the rollups file"""
+    REVISION_BUCKET_SIZE = "revisionBucketSize"
+    RUNS = "runs"
+    ROLLUPS = "rollups"
+    COUNT = "count"
+    MIN = "min"
+    MAX = "max"
+    MEAN = "mean"
+    MEDIAN = "median"
+    P95 = "p95"
+    TOTAL = "total"
+    BINS = "bins"
+    UNIT = "unit"
+
+
+class Rollup:
+    """Summary of the values in one bucket. Values must be positive (ms or KB);
+    zeros are counted in their own bin."""
+    __slots__ = ("count", "min", "max", "total", "bins", "unit")
+
+    def __init__(self, unit):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0
+        self.bins = {}  # bin index -> count, bin i holds values in (gamma^(i-1), gamma^i]
+        self.unit = unit
+
+    @staticmethod
+    def bin_index(value):
+        if value <= 0:
+            return 0
+        return int(math.ceil(math.log(value, _GAMMA)))
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = Rollup.bin_index(value)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def quantile(self, q):
+        """Value at quantile q, to within the relative accuracy and clamped to [min, max]."""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 0 if index == 0 else 2 * _GAMMA ** index / (_GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+    def to_json_object(self):
+        return {
+            RollupLabels.COUNT: self.count,
+            RollupLabels.MIN: self.min,
+            RollupLabels.MAX: self.max,
+            RollupLabels.MEAN: round(self.mean(), 1),
+            RollupLabels.MEDIAN: round(self.quantile(0.5), 1),
+            RollupLabels.P95: round(self.quantile(0.95), 1),
+            RollupLabels.TOTAL: self.total,
+            RollupLabels.UNIT: self.unit,
+            RollupLabels.BINS: {str(index): count for index, count in sorted(self.bins.items())},
+        }
+
+    @staticmethod
+    def from_json_object(json_rollup):
+        rollup = Rollup(json_rollup[RollupLabels.UNIT])
+        rollup.count = json_rollup[RollupLabels.COUNT]
+        rollup.min = json_rollup[RollupLabels.MIN]
+        rollup.max = json_rollup[RollupLabels.MAX]
+        rollup.total = json_rollup[RollupLabels.TOTAL]
+        rollup.bins = {int(index): count for index, count in json_rollup[RollupLabels.BINS].items()}
+        return rollup
+
+
+def rollup_key(test_label, op_label, machine_name):
+    return _KEY_SEPARATOR.join([test_label, op_label, machine_name])
+
+
+def split_rollup_key(key):
+    return key.split(_KEY_SEPARATOR)
+
+
+def bucket_labels(test_suite_run, revision_bucket_size):
+    """{granularity: bucket label} for a run. Labels sort in time order.
+    A run with no start time is only rolled up by revision."""
+    revision = test_suite_run.build_info.revision
+    labels = {Granularity.REVISION: "{:08d}".format(revision // revision_bucket_size * revision_bucket_size)}
+    start_time = test_suite_run.start_time
+    if start_time is not None:
+        iso_year, iso_week, _ = start_time.isocalendar()
+        labels[Granularity.DAY] = start_time.strftime("%Y-%m-%d")
+        labels[Granularity.WEEK] = "{:04d}-W{:02d}".format(iso_year, iso_week)
+    return labels
+
+
+class RollupStore:
+    """Rollups persisted as JSon: {granularity: {test|op|machine: {bucket: Rollup}}}"""
+    def __init__(self, filename, revision_bucket_size=_DEFAULT_REVISION_BUCKET):
+        self.filename = filename
+        self.revision_bucket_size = revision_bucket_size
+        self.run_ids = set()
+        self.rollups = {granularity: {} for granularity in Granularity.ALL}
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+
+        self.revision_bucket_size = data[RollupLabels.REVISION_BUCKET_SIZE]
+        self.run_ids = set(data[RollupLabels.RUNS])
+        for granularity, keys in data[RollupLabels.ROLLUPS].items():
+            self.rollups[granularity] = {key: {bucket: Rollup.from_json_object(rollup)
+                                               for bucket, rollup in buckets.items()}
+                                         for key, buckets in keys.items()}
+
+    def save(self):
+        """Write atomically so a dashboard never reads half a file."""
+        data = {
+            RollupLabels.REVISION_BUCKET_SIZE: self.revision_bucket_size,
+            RollupLabels.RUNS: sorted(self.run_ids),
+            RollupLabels.ROLLUPS: {granularity: {key: {bucket: rollup.to_json_object()
+                                                       for bucket, rollup in buckets.items()}
+                                                 for key, buckets in keys.items()}
+                                   for granularity, keys in self.rollups.items()},
+        }
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            json.dump(data, f, separators=(",", ":"), sort_keys=True)
+
+        os.replace(temp_filename, self.filename)
+
+    def add_run(self, test_suite_run):
+        """Roll up the op values of a run. Returns False if the run was already added."""
+        json_run = test_suite_run.to_json_object()
+        run_id = document_id(json_run)
+        if run_id in self.run_ids:
+            return False
+
+        machine_name = test_suite_run.machine.name or test_suite_run.suite_label
+        buckets = bucket_labels(test_suite_run, self.revision_bucket_size)
+        for json_result in json_run[JSonLabels.TEST_RESULTS]:
+            for json_op in json_result[JSonLabels.OP_RESULTS]:
+                unit = "KB" if json_op[JSonLabels.TYPE] == OpResultType.FileSize.name else "ms"
+                key = rollup_key(json_result[JSonLabels.LABEL], json_op[JSonLabels.LABEL], machine_name)
+                for granularity, bucket in buckets.items():
+                    key_buckets = self.rollups[granularity].setdefault(key, {})
+                    rollup = key_buckets.get(bucket)
+                    if rollup is None:
+                        rollup = key_buckets[bucket] = Rollup(unit)
+                    rollup.add(json_op[JSonLabels.VALUE])
+
+        self.run_ids.add(run_id)
+        return True
+
+
+def find_runs_files(paths):
+    """results files (see ingestResults.find_results_files) and containers of runs among paths,
+    searching folders recursively."""
+    for filename in find_results_files(paths):
+        yield filename
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith(CONTAINER_SUFFIX):
+                        yield os.path.join(dir_path, file_name)
+
+
+def update_rollups(test_suite_runs, rollups_file):
+    """Add runs to the rollups file. Returns the number of runs added."""
+    store = RollupStore(rollups_file)
+    store.load()
+    added = sum(1 for run in test_suite_runs if store.add_run(run))
+    if added > 0:
+        store.save()
+    return added
+
+
+# ---------------------------------------------------------
+# Dashboard
+# ---------------------------------------------------------
+
+_CHART_WIDTH = 320
+_CHART_HEIGHT = 60
+
+_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Pamir perf trends by {granularity}</title>
+<style>
+body {{ font-family: sans-serif; font-size: 13px; }}
+table {{ border-collapse: collapse; }}
+td, th {{ padding: 2px 8px; border-bottom: 1px solid #ddd; text-align: right; }}
+td.label, th.label {{ text-align: left; }}
+polyline.median {{ fill: none; stroke: #1f77b4; stroke-width: 1.5; }}
+polyline.p95 {{ fill: none; stroke: #ff7f0e; stroke-width: 1; stroke-dasharray: 3 2; }}
+</style>
+</head>
+<body>
+<h1>Pamir perf trends by {granularity}</h1>
+<p>Median (solid) and 95th percentile (dashed) per {granularity}. {run_count} runs.</p>
+<table>
+<tr><th class="label">test</th><th class="label">op</th><th class="label">machine</th><th>buckets</th>
+<th>latest</th><th>median</th><th>p95</th><th>trend</th></tr>
+{rows}
+</table>
+</body>
+</html>
+"""
+
+
+def svg_polyline(values, low, high, css_class):
+    step = _CHART_WIDTH / max(len(values) - 1, 1)
+    span = (high - low) or 1
+    points = " ".join("{:.1f},{:.1f}".format(i * step, _CHART_HEIGHT - (v - low) / span * _CHART_HEIGHT)
+                      for i, v in enumerate(values))
+    return '<polyline class="{}" points="{}"/>'.format(css_class, points)
+
+
+def dashboard_row(key, buckets):
+    ordered = [buckets[bucket] for bucket in sorted(buckets)]
+    medians = [rollup[RollupLabels.MEDIAN] for rollup in ordered]
+    p95s = [rollup[RollupLabels.P95] for rollup in ordered]
+    low = min(rollup[RollupLabels.MIN] for rollup in ordered)
+    high = max(p95s)
+    latest = ordered[-1]
+    unit = latest[RollupLabels.UNIT]
+
+    chart = '<svg width="{}" height="{}">{}{}</svg>'.format(_CHART_WIDTH, _CHART_HEIGHT,
+                                                           svg_polyline(medians, low, high, "median"),
+                                                           svg_polyline(p95s, low, high, "p95"))
+    cells = [html.escape(part) for part in split_rollup_key(key)]
+    return ('<tr><td class="label">{}</td><td class="label">{}</td><td class="label">{}</td>'
+            '<td>{}</td><td>{} {}</td><td>{}</td><td>{}</td><td>{}</td></tr>'
+            .format(cells[0], cells[1], cells[2], len(ordered), html.escape(sorted(buckets)[-1]), unit,
+                    latest[RollupLabels.MEDIAN], latest[RollupLabels.P95], chart))
+
+
+def write_dashboard(rollups_file, html_file, granularity=Granularity.WEEK):
+    """Render one row per test, op and machine from the rollups file alone.
+    The file is read as plain JSon; the histograms are not needed to draw."""
+    with open(rollups_file, 'r') as f:
+        data = json.load(f)
+
+    keys = data[RollupLabels.ROLLUPS].get(granularity, {})
+    rows = [dashboard_row(key, keys[key]) for key in sorted(keys) if len(keys[key]) > 0]
+    with open(html_file, mode="w", encoding="utf8") as f:
+        f.write(_PAGE_TEMPLATE.format(granularity=granularity, run_count=len(data[RollupLabels.RUNS]),
+                                      rows="\n".join(rows)))
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up op values for trend dashboards.")
+    commands = parser.add_subparsers(dest="command")
+
+    update_parser = commands.add_parser("update", help="add gathered runs to the rollups")
+    update_parser.add_argument("rollups_file")
+    update_parser.add_argument("paths", nargs="+",
+                               help="results files, containers of runs, or folders to search for them")
+
+    dashboard_parser = commands.add_parser("dashboard", help="write a static HTML dashboard from the rollups")
+    dashboard_parser.add_argument("rollups_file")
+    dashboard_parser.add_argument("html_file")
+    dashboard_parser.add_argument("-g", "--granularity", choices=Granularity.ALL, default=Granularity.WEEK)
+
+    args = parser.parse_args()
+    if args.command == "update":
+        use_compact_model()
+        # a file at a time, so only one container's runs are held at once
+        runs = (run for filename in find_runs_files(args.paths) for run in load_test_suite_runs([filename]))
+        added = update_rollups(runs, args.rollups_file)
+        print("Added {} runs to {}".format(added, args.rollups_file))
+    elif args.command == "dashboard":
+        rows = write_dashboard(args.rollups_file, args.html_file, args.granularity)
+        print("Dashboard of {} series written to {}".format(rows, args.html_file))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 python gatherperfdata.py .\r79370_V53
 python gatherperfdata.py .\r79586_V6
 python gatherperfdata.py .\r70160
+python gatherperfdata.py -a .\testdata\r70160.7z
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""Where does suite wall-clock go? Lines up the TC.Stopwatch timings, pamir-perf.log
+operations and pamir.log time stamps of each test on one timeline and splits the
+test's wall-clock time into:
+
+    ops             covered by a known operation (perf log op or stopwatch timing)
+    idle            Pamir running but logging nothing for longer than the idle threshold
+    uninstrumented  Pamir active but not inside any known operation
+    harness         outside Pamir altogether: TestComplete set up and tear down
+
+A test's wall-clock runs from the end of the previous test (its testrun.log being
+written) to the end of its own. Stopwatch lines carry no time stamp so start up
+timings are placed from the first pamir.log entry, and shutdown timings from its
+"Shutting down" entry (else its last) onwards, as TC times shutdown to the process exiting,
+well after Pamir stops logging.
+File times are moved onto the log clock using the offset between pamir.log's
+modified time and its last entry, rounded to the half hour.
+
+Usage:
+    timeGaps.py <run_folder | run.7z> [idle_threshold_seconds]
+"""
+
+import sys
+import os.path
+import re
+from datetime import timedelta
+from gatherperfdata import (open_run_folder, list_test_dirs, open_log_file,
+                            get_test_log_path, get_perf_log_path, get_pamir_log_path,
+                            get_matching_lines_from_file, get_file_datetime, path_exists,
+                            parse_pamir_timestamp, PAMIR_TIMESTAMP_REGEX)
+
+_DEFAULT_IDLE_THRESHOLD = 2.0  # seconds
+_CLOCK_OFFSET_ROUNDING = 30 * 60  # seconds
+
+# perf log lines look like (tab separated):
+#   1	2016-05-26 12:26:20,609	Server.SaveProject	Complete	43
+_PERF_COMPLETE_REGEX = r"^\d+\t(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})\t([^\t]+)\tComplete\t(\d+)"
+_PERF_TIMESTAMP_REGEX = r"^\d+\t(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})\t"
+_PAMIR_SHUTDOWN_MARKER = "INFO : Shutting down"
+
+
+class Attribution:
+    """Wall-clock split, all in ms."""
+    LABELS = ["wall", "ops", "idle", "uninstrumented", "harness"]
+
+    def __init__(self):
+        self.wall = 0
+        self.ops = 0
+        self.idle = 0
+        self.uninstrumented = 0
+        self.harness = 0
+
+    def add(self, other):
+        for label in Attribution.LABELS:
+            setattr(self, label, getattr(self, label) + getattr(other, label))
+
+
+# ---------------------------------------------------------
+# Interval arithmetic on (start, end) datetime tuples
+# ---------------------------------------------------------
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(i for i in intervals if i[1] > i[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def clip_intervals(intervals, start, end):
+    return merge_intervals((max(s, start), min(e, end)) for s, e in intervals)
+
+
+def subtract_intervals(intervals, to_remove):
+    """intervals - to_remove. Both must be merged."""
+    result = []
+    for start, end in intervals:
+        for r_start, r_end in to_remove:
+            if r_end <= start or r_start >= end:
+                continue
+            if r_start > start:
+                result.append((start, r_start))
+            start = max(start, r_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def total_ms(intervals):
+    return int(sum((end - start).total_seconds() for start, end in intervals) * 1000)
+
+
+# ---------------------------------------------------------
+# Timeline of one test
+# ---------------------------------------------------------
+
+def read_log_stamps(filename, regex):
+    stamps = []
+    try:
+        with open_log_file(filename, encoding="iso_8859_1") as file:
+            for line in file:
+                match = re.search(regex, line)
+                if match:
+                    stamps.append(parse_pamir_timestamp(match.group(1)))
+    except IOError:
+        pass
+    return stamps
+
+
+def read_marked_stamp(filename, regex, marker):
+    """Time stamp of the first line containing marker, or None."""
+    try:
+        with open_log_file(filename, encoding="iso_8859_1") as file:
+            for line in file:
+                if marker in line:
+                    match = re.search(regex, line)
+                    if match:
+                        return parse_pamir_timestamp(match.group(1))
+    except IOError:
+        pass
+    return None
+
+
+def read_perf_ops(filename):
+    """(label, start, end) for each completed operation in a perf log."""
+    ops = []
+    try:
+        with open_log_file(filename, encoding="iso_8859_1") as file:
+            for line in file:
+                match = re.search(_PERF_COMPLETE_REGEX, line)
+                if match:
+                    end = parse_pamir_timestamp(match.group(1))
+                    ops.append((match.group(2), end - timedelta(milliseconds=int(match.group(3))), end))
+    except IOError:
+        pass
+    return ops
+
+
+def read_stopwatch_timings(test_dir):
+    """(label, ms) for each TC.Stopwatch line, in log order."""
+    timings = []
+    for line in get_matching_lines_from_file(get_test_log_path(test_dir), "TC.Stopwatch"):
+        parts = line.split(",")
+        try:
+            timings.append((parts[1], int(float(parts[-1]))))
+        except (IndexError, ValueError):
+            continue
+    return timings
+
+
+def clock_offset(pamir_log, last_stamp):
+    """Offset between file times and the log clock, e.g. when files are listed in UTC."""
+    seconds = (get_file_datetime(pamir_log) - last_stamp).total_seconds()
+    return timedelta(seconds=round(seconds / _CLOCK_OFFSET_ROUNDING) * _CLOCK_OFFSET_ROUNDING)
+
+
+class TestTimeline:
+    def __init__(self, label):
+        self.label = label
+        self.pamir_start = None
+        self.pamir_end = None
+        self.harness_start = None
+        self.harness_end = None
+        self.activity = []  # time stamps of any log line
+        self.ops = []  # (label, start, end)
+
+    def attribute(self, idle_threshold):
+        attribution = Attribution()
+        wall = (self.harness_start, self.harness_end)
+        attribution.wall = total_ms([wall])
+
+        covered = clip_intervals([(start, end) for _, start, end in self.ops], *wall)
+        attribution.ops = total_ms(covered)
+
+        pamir = clip_intervals([(self.pamir_start, self.pamir_end)], *wall)
+        attribution.harness = total_ms(subtract_intervals(subtract_intervals([wall], pamir), covered))
+
+        gaps = []
+        activity = sorted(self.activity)
+        for prev, cur in zip(activity, activity[1:]):
+            if (cur - prev).total_seconds() > idle_threshold:
+                gaps.append((prev, cur))
+        idle = subtract_intervals(clip_intervals(gaps, self.pamir_start, self.pamir_end), covered)
+        attribution.idle = total_ms(clip_intervals(idle, *wall))
+
+        attribution.uninstrumented = attribution.wall - attribution.ops - attribution.harness - attribution.idle
+        return attribution
+
+
+def timeline_from_test_dir(test_dir):
+    """Returns None if the test has no Pamir log to anchor it."""
+    pamir_log = get_pamir_log_path(test_dir)
+    pamir_stamps = read_log_stamps(pamir_log, PAMIR_TIMESTAMP_REGEX)
+    if len(pamir_stamps) == 0:
+        return None
+
+    timeline = TestTimeline(os.path.basename(test_dir))
+    timeline.pamir_start = pamir_stamps[0]
+    timeline.pamir_end = pamir_stamps[-1]
+    timeline.activity = pamir_stamps + read_log_stamps(get_perf_log_path(test_dir), _PERF_TIMESTAMP_REGEX)
+    timeline.ops = read_perf_ops(get_perf_log_path(test_dir))
+
+    start_up_end = timeline.pamir_start
+    shutdowns = []
+    for label, ms in read_stopwatch_timings(test_dir):
+        if "shutdown" in label.lower():
+            shutdowns.append((label, ms))
+        else:
+            op_end = start_up_end + timedelta(milliseconds=ms)
+            timeline.ops.append((label, start_up_end, op_end))
+            start_up_end = op_end
+
+    shutdown_end = read_marked_stamp(pamir_log, PAMIR_TIMESTAMP_REGEX, _PAMIR_SHUTDOWN_MARKER)
+    if shutdown_end is None:
+        shutdown_end = timeline.pamir_end
+    for label, ms in shutdowns:
+        op_end = shutdown_end + timedelta(milliseconds=ms)
+        timeline.ops.append((label, shutdown_end, op_end))
+        shutdown_end = op_end
+
+    offset = clock_offset(pamir_log, timeline.pamir_end)
+    test_log = get_test_log_path(test_dir)
+    if path_exists(test_log):
+        timeline.harness_end = max(get_file_datetime(test_log) - offset, timeline.pamir_end)
+    else:
+        timeline.harness_end = timeline.pamir_end
+
+    return timeline
+
+
+def timelines_for_run(base_path):
+    """Timelines of the tests in a run in the order they ran, chained so each test's
+    wall-clock starts where the previous one ended."""
+    timelines = []
+    for test_dir in list_test_dirs(base_path):
+        timeline = timeline_from_test_dir(test_dir)
+        if timeline is None:
+            print("No Pamir log for {}. Skipped.".format(os.path.basename(test_dir)))
+            continue
+        timelines.append(timeline)
+
+    timelines.sort(key=lambda t: t.pamir_start)
+    prev_end = None
+    for timeline in timelines:
+        timeline.harness_start = timeline.pamir_start
+        if prev_end is not None and prev_end < timeline.pamir_start:
+            timeline.harness_start = prev_end
+        prev_end = timeline.harness_end
+
+    return timelines
+
+
+def print_attribution(label, attribution, outfile):
+    def sec_and_pct(ms):
+        pct = 100.0 * ms / attribution.wall if attribution.wall > 0 else 0.0
+        return "{:9.1f} {:5.1f}%".format(ms / 1000.0, pct)
+
+    print("{:<16}{:>9.1f} {} {} {} {}".format(label, attribution.wall / 1000.0,
+                                            sec_and_pct(attribution.ops),
+                                            sec_and_pct(attribution.idle),
+                                            sec_and_pct(attribution.uninstrumented),
+                                            sec_and_pct(attribution.harness)), file=outfile)
+
+
+def main(path, idle_threshold=_DEFAULT_IDLE_THRESHOLD, outfile=sys.stdout):
+    with open_run_folder(path) as base_path:
+        timelines = timelines_for_run(base_path)
+
+    print("{:<16}{:>9} {:>16} {:>16} {:>16} {:>16}".format("test", "wall (s)", "ops", "idle",
+                                                         "uninstrumented", "harness"), file=outfile)
+    total = Attribution()
+    for timeline in timelines:
+        attribution = timeline.attribute(idle_threshold)
+        total.add(attribution)
+        print_attribution(timeline.label, attribution, outfile)
+
+    print_attribution("TOTAL", total, outfile)
+    return total
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: {} <run_folder | run.7z> [idle_threshold_seconds]".format(sys.argv[0]))
+        exit()
+
+    _idle_threshold = float(sys.argv[2]) if len(sys.argv) > 2 else _DEFAULT_IDLE_THRESHOLD
+    main(sys.argv[1], _idle_threshold)
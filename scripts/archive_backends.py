@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+"""How zip-to-archive writes an archive of a run folder.
+
+7z runs the 7-Zip executable, as zip-to-archive always has, and is the default: it is the
+only format gatherperfdata -a, revisionIndex, distributedGather and timeGaps read. The others
+are written from Python so any host can archive without 7-Zip, when chosen with -b; their runs
+can be searched and extracted with archive_index but not gathered:
+  tar.xz  - tar streamed from disk and compressed with LZMA in chunks on several threads.
+            Each chunk is a complete xz stream; xz, tar -xJf and Python read the
+            concatenated streams as one.
+  tar.zst - the same with zstd chunks (frames). Needs zstandard (pip install zstandard).
+  zip     - LZMA compressed members, one at a time.
+  dedup   - each distinct file content stored once in a pack shared by all runs, with
+            a manifest per run (see archive_dedup).
+Members keep the modification times of the files. An index of the members is written
+next to each archive (see archive_index), and verify_archive checks an archive against it.
+Archives are written under a temporary name and renamed once complete, so an archive
+that exists is whole.
+Given a Throttle (see archive_throttle) the Python backends hold their reads and writes to
+its bandwidth limits and pause while a test runs; 7z is suspended while a test runs.
+"""
+
+import os
+import io
+import lzma
+import shutil
+import hashlib
+import tarfile
+import zipfile
+from subprocess import run
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from archive_dedup import ManifestLabels, MANIFEST_SUFFIX, PACK_FOLDER, BLOB_SUFFIX, read_manifest, \
+    write_dedup_archive, pack_path_for, blob_path
+from archive_index import IndexLabels, HashingReader, member_entry, index_folder, list_folder, index_name_for, \
+    write_index, read_index
+from archive_throttle import Throttle, throttled_reader, throttled_writer, run_pausing_while_testing
+
+SEVEN_ZIP_EXE = r"c:\Program Files\7-Zip\7z.exe"
+
+_CHUNK_SIZE = 16 * 1024 * 1024  # bytes of tar compressed as one stream
+_XZ_PRESET = 6
+_ZSTD_LEVEL = 10
+_COPY_SIZE = 1024 * 1024
+_TEMP_SUFFIX = ".tmp"
+
+
+class Backends:
+    SEVEN_ZIP = "7z"
+    TAR_XZ = "tar.xz"
+    TAR_ZST = "tar.zst"
+    ZIP = "zip"
+    DEDUP = "dedup"
+    ALL = [SEVEN_ZIP, TAR_XZ, TAR_ZST, ZIP, DEDUP]
+
+
+def archive_suffix(backend):
+    if backend == Backends.DEDUP:
+        return MANIFEST_SUFFIX
+    return "." + backend
+
+
+def seven_zip_exe():
+    """Path of the 7-Zip executable, or None if it is not installed."""
+    if os.path.exists(SEVEN_ZIP_EXE):
+        return SEVEN_ZIP_EXE
+    return shutil.which("7z") or shutil.which("7za")
+
+
+def default_backend():
+    """7z, the format the tools that read archived runs understand. Never changed for a
+    missing 7-Zip: archives the other tools cannot read must be asked for."""
+    return Backends.SEVEN_ZIP
+
+
+def _zstd_compress_chunk(chunk):
+    """zstd needs zstandard: pip install zstandard"""
+    import importlib.util
+    if not importlib.util.find_spec("zstandard"):
+        raise Exception(_zstd_compress_chunk.__doc__)
+
+    import zstandard
+    return zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(chunk)
+
+
+def _xz_compress_chunk(chunk):
+    return lzma.compress(chunk, format=lzma.FORMAT_XZ, preset=_XZ_PRESET)
+
+
+def _zstd_stream(fileobj):
+    """zstd needs zstandard: pip install zstandard"""
+    import importlib.util
+    if not importlib.util.find_spec("zstandard"):
+        raise Exception(_zstd_stream.__doc__)
+
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+
+
+def _xz_stream(fileobj):
+    return lzma.open(fileobj, "rb")
+
+
+class ParallelCompressWriter(io.RawIOBase):
+    """Write-only file that compresses what is written to it a chunk at a time on a thread pool,
+    writing the compressed chunks to fileobj in order. No more than two chunks per thread are
+    held at once, so memory stays bounded however much is written."""
+    def __init__(self, fileobj, compress_chunk, threads, chunk_size=_CHUNK_SIZE):
+        io.RawIOBase.__init__(self)
+        self._fileobj = fileobj
+        self._compress_chunk = compress_chunk
+        self._threads = max(1, threads)
+        self._buffer = bytearray()
+        self._pending = deque()  # futures of compressed chunks, in order
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._written = 0
+        self.chunk_size = chunk_size
+        self.blocks = []  # offset in fileobj of each compressed chunk, as written
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, chunk):
+        while len(self._pending) >= 2 * self._threads:
+            self._write_next()
+        self._pending.append(self._executor.submit(self._compress_chunk, chunk))
+
+    def _write_next(self):
+        compressed = self._pending.popleft().result()
+        self.blocks.append(self._written)
+        self._fileobj.write(compressed)
+        self._written += len(compressed)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self._buffer) > 0 or len(self._pending) == 0:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while len(self._pending) > 0:
+                self._write_next()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            io.RawIOBase.close(self)
+
+
+def _write_tar(archive_name, folder, compress_chunk, threads, throttle):
+    """Returns the index entries of the members, hashed as they are read into the archive."""
+    files = []  # (member path, stat, sha256, offset of its data in the tar)
+    with open(archive_name, "wb") as f:
+        with ParallelCompressWriter(throttled_writer(f, throttle), compress_chunk, threads) as writer:
+            # stream mode: tar blocks go straight to the writer as each file is read
+            with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                for dir_path, dir_names, file_names in os.walk(folder):
+                    dir_names.sort()
+                    if dir_path != folder:
+                        tar.addfile(tar.gettarinfo(dir_path, os.path.relpath(dir_path, folder)))
+                    for name in sorted(file_names):
+                        file_path = os.path.join(dir_path, name)
+                        member_path = os.path.relpath(file_path, folder).replace(os.sep, "/")
+                        info = tar.gettarinfo(file_path, member_path)
+                        if not info.isfile():
+                            tar.addfile(info)
+                            continue
+                        with open(file_path, "rb") as member_file:
+                            reader = HashingReader(throttled_reader(member_file, throttle))
+                            tar.addfile(info, reader)
+                        # the data ends tar.offset, padded to whole blocks
+                        data_blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+                        files.append((member_path, os.stat(file_path), reader.hexdigest(),
+                                      tar.offset - data_blocks * tarfile.BLOCKSIZE))
+
+    members = []
+    for member_path, file_stat, digest, data_offset in files:
+        chunk, offset = divmod(data_offset, writer.chunk_size)
+        members.append(member_entry(member_path, file_stat, digest, writer.blocks[chunk], offset))
+    return members
+
+
+def _write_zip(archive_name, folder, throttle):
+    """Returns the index entries of the members."""
+    members = index_folder(folder, throttle)
+    with open(archive_name, "wb") as f, \
+            zipfile.ZipFile(throttled_writer(f, throttle), "w", compression=zipfile.ZIP_LZMA) as archive:
+        for dir_path, dir_names, file_names in os.walk(folder):
+            dir_names.sort()
+            if dir_path != folder:
+                # so that empty folders are kept
+                archive.write(dir_path, os.path.relpath(dir_path, folder))
+            for name in sorted(file_names):
+                file_path = os.path.join(dir_path, name)
+                # read here rather than by archive.write, so the reads can be throttled
+                info = zipfile.ZipInfo.from_file(file_path, os.path.relpath(file_path, folder))
+                info.compress_type = zipfile.ZIP_LZMA
+                with open(file_path, "rb") as member_file, archive.open(info, "w") as member:
+                    shutil.copyfileobj(throttled_reader(member_file, throttle), member, _COPY_SIZE)
+
+        offsets = {info.filename: info.header_offset for info in archive.infolist()}
+    for member in members:
+        member[IndexLabels.BLOCK] = offsets[member[IndexLabels.PATH]]
+    return members
+
+
+def _dedup_members(manifest_name):
+    """Index entries of a dedup archive: the block of each is its blob in the pack."""
+    members = []
+    for entry in read_manifest(manifest_name)[ManifestLabels.FILES]:
+        digest = entry[ManifestLabels.HASH]
+        members.append({IndexLabels.PATH: entry[ManifestLabels.PATH],
+                        IndexLabels.SIZE: entry[ManifestLabels.SIZE],
+                        IndexLabels.MODIFIED: entry[ManifestLabels.MODIFIED],
+                        IndexLabels.HASH: digest,
+                        IndexLabels.BLOCK: "/".join([PACK_FOLDER, digest[:2], digest + BLOB_SUFFIX]),
+                        IndexLabels.OFFSET: 0})
+    return members
+
+
+def temp_name_for(archive_name):
+    """Where an archive is written until it is complete"""
+    return archive_name + _TEMP_SUFFIX
+
+
+def write_archive(backend, archive_name, folder, threads=0, throttle: Throttle = None):
+    """Archive the contents of folder (not the folder itself) as archive_name, and its index.
+    The folder is left as it is. threads: threads to compress with, 0 for one per core (7z: its default).
+    throttle: limits to hold to while archiving, if any. 7z takes only its pausing; with
+    bandwidth limits it compresses on one thread, as they cannot be held to from outside.
+    Returns True if the archive was written. A failed backend leaves no archive behind, and
+    archive_name only ever appears complete."""
+    temp_name = temp_name_for(archive_name)
+    if os.path.exists(temp_name):
+        # left by an archiving that died; 7z would add to it
+        os.remove(temp_name)
+
+    if backend == Backends.SEVEN_ZIP:
+        exe = seven_zip_exe()
+        if exe is None:
+            print("7-Zip not found at {}".format(SEVEN_ZIP_EXE))
+            return False
+        members = list_folder(folder)
+        # -t7z as the temporary name does not say the format; non-solid so that
+        # archive_index and the gatherers can extract a member without the ones before it
+        command = [exe, "a", "-t7z", "-ms=off", temp_name, os.path.join(folder, "*"), "-bso0"]
+        if throttle is not None and throttle.limits_bandwidth():
+            threads = 1
+        if threads > 0:
+            command.append("-mmt{}".format(threads))
+        try:
+            if throttle is not None and throttle.monitor is not None:
+                returncode = run_pausing_while_testing(command, throttle.monitor)
+            else:
+                returncode = run(command).returncode
+        except Exception as err:
+            print("Could not run 7z: {}".format(err))
+            returncode = None
+        if returncode is not None and returncode != 0:
+            print("7z returned {}".format(returncode))
+        if returncode != 0 or not os.path.exists(temp_name):
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            return False
+        os.replace(temp_name, archive_name)
+        write_index(archive_name, members)
+        return True
+
+    threads = threads or os.cpu_count() or 1
+    try:
+        if backend == Backends.TAR_XZ:
+            members = _write_tar(temp_name, folder, _xz_compress_chunk, threads, throttle)
+        elif backend == Backends.TAR_ZST:
+            members = _write_tar(temp_name, folder, _zstd_compress_chunk, threads, throttle)
+        elif backend == Backends.ZIP:
+            members = _write_zip(temp_name, folder, throttle)
+        elif backend == Backends.DEDUP:
+            stats = write_dedup_archive(archive_name, folder, threads, throttle)
+            print(stats.report(os.path.basename(folder)))
+            members = _dedup_members(archive_name)
+        else:
+            raise ValueError("Unknown archive backend: {}".format(backend))
+        if backend != Backends.DEDUP:
+            # dedup writes its manifest through the same temporary name itself
+            os.replace(temp_name, archive_name)
+        write_index(archive_name, members)
+    except Exception as err:
+        print("Could not write {}: {}".format(archive_name, err))
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        return False
+
+    return True
+
+
+def _verify_tar(archive_name, members, open_stream, throttle):
+    """Read the whole tar once, hashing each file against its index entry"""
+    remaining = {member[IndexLabels.PATH]: member[IndexLabels.HASH] for member in members}
+    with open(archive_name, "rb") as f, open_stream(throttled_reader(f, throttle)) as stream:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                reader = HashingReader(tar.extractfile(info))
+                while reader.read(_COPY_SIZE):
+                    pass
+                if remaining.pop(info.name, None) != reader.hexdigest():
+                    raise Exception("{} does not match the index".format(info.name))
+    if len(remaining) > 0:
+        raise Exception("{} members of the index are missing".format(len(remaining)))
+
+
+def _verify_zip(archive_name, members, throttle):
+    with open(archive_name, "rb") as f, zipfile.ZipFile(throttled_reader(f, throttle)) as archive:
+        for member in members:
+            # reading checks the CRC too
+            if hashlib.sha256(archive.read(member[IndexLabels.PATH])).hexdigest() != member[IndexLabels.HASH]:
+                raise Exception("{} does not match the index".format(member[IndexLabels.PATH]))
+
+
+def _verify_dedup(archive_name, members, throttle):
+    pack_path = pack_path_for(os.path.dirname(os.path.abspath(archive_name)))
+    for digest in sorted({member[IndexLabels.HASH] for member in members}):
+        with open(blob_path(pack_path, digest), "rb") as f, _xz_stream(throttled_reader(f, throttle)) as blob:
+            reader = HashingReader(blob)
+            while reader.read(_COPY_SIZE):
+                pass
+        if reader.hexdigest() != digest:
+            raise Exception("Blob {} in the pack is corrupt".format(digest))
+
+
+def verify_archive(backend, archive_name, throttle: Throttle = None):
+    """Check that archive_name holds what its index says: every member read back and hashed
+    (7z: tested by 7-Zip). Returns True if it does."""
+    try:
+        if backend == Backends.SEVEN_ZIP:
+            exe = seven_zip_exe()
+            if exe is None:
+                raise Exception("7-Zip not found at {}".format(SEVEN_ZIP_EXE))
+            command = [exe, "t", archive_name, "-bso0"]
+            if throttle is not None and throttle.monitor is not None:
+                returncode = run_pausing_while_testing(command, throttle.monitor)
+            else:
+                returncode = run(command).returncode
+            if returncode != 0:
+                raise Exception("7z test returned {}".format(returncode))
+            return True
+
+        members = read_index(index_name_for(archive_name))[IndexLabels.MEMBERS]
+        if backend == Backends.TAR_XZ:
+            _verify_tar(archive_name, members, _xz_stream, throttle)
+        elif backend == Backends.TAR_ZST:
+            _verify_tar(archive_name, members, _zstd_stream, throttle)
+        elif backend == Backends.ZIP:
+            _verify_zip(archive_name, members, throttle)
+        elif backend == Backends.DEDUP:
+            _verify_dedup(archive_name, members, throttle)
+        else:
+            raise ValueError("Unknown archive backend: {}".format(backend))
+    except Exception as err:
+        print("Could not verify {}: {}".format(archive_name, err))
+        return False
+
+    return True
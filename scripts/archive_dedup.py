@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""Deduplicated archiving of run folders: each distinct file content is stored once.
+
+Run folders repeat the same input jobs, templates and DLL snapshots in every test's
+data folder, and every run repeats them again. Here each file is hashed (sha256) and its
+content stored, xz compressed, once in a pack shared by all runs:
+    <zip_folder>/pack/<first 2 hex digits>/<sha256>.xz
+A manifest per run, <zip_folder>/<run>.manifest.json, lists each file's path, size,
+modification time, mode and hash, and the folders, so restore rebuilds the exact folder.
+
+zip-to-archive writes these with -b dedup. Here:
+    archive_dedup.py restore <run.manifest.json> <target_folder>
+    archive_dedup.py stats <zip_folder>
+"""
+
+import os
+import sys
+import json
+import lzma
+import stat
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from archive_throttle import throttled_reader, throttled_writer
+
+MANIFEST_SUFFIX = ".manifest.json"
+PACK_FOLDER = "pack"
+BLOB_SUFFIX = ".xz"
+
+_READ_SIZE = 1024 * 1024
+_XZ_PRESET = 6
+
+# blobs being stored by a thread of this process: digest -> Event set when stored
+_storing = {}
+_storing_lock = threading.Lock()
+
+
+class ManifestLabels:
+    """Magic strings for the run manifest"""
+    RUN = "run"
+    FILES = "files"
+    FOLDERS = "folders"
+    PATH = "path"
+    SIZE = "size"
+    MODIFIED = "mtimeNs"
+    MODE = "mode"
+    HASH = "sha256"
+
+
+class DedupStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0  # of the files
+        self.contents = {}  # sha256 -> size, of each distinct content among the files
+        self.blobs = 0  # added to the pack, or in it for pack_stats
+        self.blob_bytes = 0  # uncompressed, of those blobs
+        self.stored_bytes = 0  # compressed, of those blobs
+
+    def add_file(self, entry):
+        self.files += 1
+        self.bytes += entry[ManifestLabels.SIZE]
+        self.contents[entry[ManifestLabels.HASH]] = entry[ManifestLabels.SIZE]
+
+    def unique_bytes(self):
+        return sum(self.contents.values())
+
+    def ratio(self):
+        """Bytes of the files for each byte of distinct content among them, before compression"""
+        unique_bytes = self.unique_bytes()
+        return self.bytes / unique_bytes if unique_bytes > 0 else 1.0
+
+    def report(self, name):
+        text = "{}: {} files, {:.1f} MB, {:.1f} MB unique (dedup ratio {:.1f}); " \
+               "{} blobs of {:.1f} MB stored, {:.2f} MB compressed"\
+            .format(name, self.files, self.bytes / 1e6, self.unique_bytes() / 1e6, self.ratio(),
+                    self.blobs, self.blob_bytes / 1e6, self.stored_bytes / 1e6)
+        reused_bytes = self.unique_bytes() - self.blob_bytes
+        if reused_bytes > 0:
+            text += "; {:.1f} MB already in the pack".format(reused_bytes / 1e6)
+        return text
+
+
+def pack_path_for(zip_folder):
+    return os.path.join(zip_folder, PACK_FOLDER)
+
+
+def blob_path(pack_path, digest):
+    return os.path.join(pack_path, digest[:2], digest + BLOB_SUFFIX)
+
+
+def hash_file(filename, throttle=None):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as raw_file:
+        f = throttled_reader(raw_file, throttle)
+        for block in iter(lambda: f.read(_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_blob(pack_path, digest, filename, throttle=None):
+    """Compress the file into the pack under its hash unless it is there already.
+    Returns the bytes added to the pack. Reads and writes are held to throttle if given."""
+    target = blob_path(pack_path, digest)
+    if os.path.exists(target):
+        return 0
+
+    with _storing_lock:
+        stored = _storing.get(digest)
+        if stored is None:
+            _storing[digest] = threading.Event()
+    if stored is not None:
+        # another run's compressor is storing the same content
+        stored.wait()
+        return 0
+
+    try:
+        return _write_blob(target, digest, filename, throttle)
+    finally:
+        with _storing_lock:
+            _storing.pop(digest).set()
+
+
+def _write_blob(target, digest, filename, throttle):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(prefix=digest[:8], suffix=".tmp", dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, "wb") as raw_out, open(filename, "rb") as raw_file:
+            out = throttled_writer(raw_out, throttle)
+            f = throttled_reader(raw_file, throttle)
+            compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=_XZ_PRESET)
+            for block in iter(lambda: f.read(_READ_SIZE), b""):
+                out.write(compressor.compress(block))
+            out.write(compressor.flush())
+        # another compressor may have stored the same blob meanwhile; either copy will do
+        os.replace(temp_name, target)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+    return os.path.getsize(target)
+
+
+def _archive_file(pack_path, folder, file_path, throttle):
+    file_stat = os.stat(file_path)
+    digest = hash_file(file_path, throttle)
+    stored = store_blob(pack_path, digest, file_path, throttle)
+    return {ManifestLabels.PATH: os.path.relpath(file_path, folder).replace(os.sep, "/"),
+            ManifestLabels.SIZE: file_stat.st_size,
+            ManifestLabels.MODIFIED: file_stat.st_mtime_ns,
+            ManifestLabels.MODE: stat.S_IMODE(file_stat.st_mode),
+            ManifestLabels.HASH: digest}, stored
+
+
+def write_dedup_archive(manifest_name, folder, threads=0, throttle=None):
+    """Store the files of folder in the pack next to manifest_name and write the manifest.
+    Files are hashed and compressed on threads (0 for one per core), their reads and writes
+    held to throttle (an archive_throttle.Throttle) if given. Returns DedupStats."""
+    pack_path = pack_path_for(os.path.dirname(os.path.abspath(manifest_name)))
+    file_paths = []
+    folders = []
+    for dir_path, dir_names, file_names in os.walk(folder):
+        dir_names.sort()
+        # the run folder itself too, as "."
+        folders.append({ManifestLabels.PATH: os.path.relpath(dir_path, folder).replace(os.sep, "/"),
+                        ManifestLabels.MODIFIED: os.stat(dir_path).st_mtime_ns})
+        file_paths.extend(os.path.join(dir_path, name) for name in sorted(file_names))
+
+    stats = DedupStats()
+    files = []
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+        for entry, stored in pool.map(lambda file_path: _archive_file(pack_path, folder, file_path, throttle),
+                                      file_paths):
+            files.append(entry)
+            stats.add_file(entry)
+            if stored > 0:
+                stats.blobs += 1
+                stats.blob_bytes += entry[ManifestLabels.SIZE]
+                stats.stored_bytes += stored
+
+    # the manifest last, and atomically, so it only ever refers to blobs already stored
+    temp_name = manifest_name + ".tmp"
+    with open(temp_name, "w") as f:
+        json.dump({ManifestLabels.RUN: os.path.basename(os.path.normpath(folder)),
+                   ManifestLabels.FOLDERS: folders,
+                   ManifestLabels.FILES: files}, f, indent=1)
+    os.replace(temp_name, manifest_name)
+    return stats
+
+
+def read_manifest(manifest_name):
+    with open(manifest_name, "r") as f:
+        return json.load(f)
+
+
+def read_blob(pack_path, digest):
+    """File object of a blob's content, decompressing as it is read"""
+    return lzma.open(blob_path(pack_path, digest), "rb")
+
+
+def restore(manifest_name, target_folder):
+    """Rebuild the run folder from its manifest and the pack: contents, folders, modes and
+    modification times. Each file is checked against its hash. Returns the files restored."""
+    manifest = read_manifest(manifest_name)
+    pack_path = pack_path_for(os.path.dirname(os.path.abspath(manifest_name)))
+    os.makedirs(target_folder, exist_ok=True)
+    for entry in manifest[ManifestLabels.FOLDERS]:
+        os.makedirs(os.path.join(target_folder, entry[ManifestLabels.PATH]), exist_ok=True)
+
+    for entry in manifest[ManifestLabels.FILES]:
+        file_path = os.path.join(target_folder, entry[ManifestLabels.PATH])
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        digest = hashlib.sha256()
+        with read_blob(pack_path, entry[ManifestLabels.HASH]) as blob, open(file_path, "wb") as out:
+            for block in iter(lambda: blob.read(_READ_SIZE), b""):
+                digest.update(block)
+                out.write(block)
+        if digest.hexdigest() != entry[ManifestLabels.HASH]:
+            raise Exception("Blob {} in the pack is corrupt".format(entry[ManifestLabels.HASH]))
+        os.chmod(file_path, entry[ManifestLabels.MODE])
+        os.utime(file_path, ns=(entry[ManifestLabels.MODIFIED], entry[ManifestLabels.MODIFIED]))
+
+    # folder times last, as creating what is in them changes them
+    for entry in manifest[ManifestLabels.FOLDERS]:
+        os.utime(os.path.join(target_folder, entry[ManifestLabels.PATH]),
+                 ns=(entry[ManifestLabels.MODIFIED], entry[ManifestLabels.MODIFIED]))
+
+    return len(manifest[ManifestLabels.FILES])
+
+
+def pack_stats(zip_folder):
+    """DedupStats of all the runs with manifests in zip_folder against the whole pack."""
+    stats = DedupStats()
+    for name in os.listdir(zip_folder):
+        if name.endswith(MANIFEST_SUFFIX):
+            for entry in read_manifest(os.path.join(zip_folder, name))[ManifestLabels.FILES]:
+                stats.add_file(entry)
+
+    pack_path = pack_path_for(zip_folder)
+    for dir_path, dir_names, file_names in os.walk(pack_path):
+        for name in file_names:
+            if name.endswith(BLOB_SUFFIX):
+                stats.blobs += 1
+                stats.blob_bytes += stats.contents.get(name[:-len(BLOB_SUFFIX)], 0)
+                stats.stored_bytes += os.path.getsize(os.path.join(dir_path, name))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore deduplicated run archives or report on their pack.")
+    commands = parser.add_subparsers(dest="command")
+
+    restore_parser = commands.add_parser("restore", help="rebuild a run folder from its manifest")
+    restore_parser.add_argument("manifest")
+    restore_parser.add_argument("target_folder")
+
+    stats_parser = commands.add_parser("stats", help="dedup ratio of all the runs in a zip folder")
+    stats_parser.add_argument("zip_folder")
+
+    args = parser.parse_args()
+    if args.command == "restore":
+        print("Restored {} files to {}".format(restore(args.manifest, args.target_folder), args.target_folder))
+    elif args.command == "stats":
+        print(pack_stats(args.zip_folder).report(args.zip_folder))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""Index of the members of each run archive, and a tool to search and extract them.
+
+zip-to-archive writes <run>.idx.json next to each archive it writes, listing every member
+with its size, modification time, sha256 and where its data starts:
+  tar.xz, tar.zst - block: file offset of the compressed chunk holding the start of the
+                    member, offset: where the member starts within that chunk's data.
+                    Extracting decompresses from that chunk only as far as the member.
+  zip             - block: offset of the member's local header.
+  7z              - no offset or hash: written non-solid (-ms=off), each member is compressed
+                    on its own and extracted alone through py7zr, checked by 7z's own CRC.
+  dedup           - block: the member's blob in the pack.
+
+Searching reads only the indexes, never the archives:
+    archive_index.py find <zip_folder> <member_pattern> [-f <from_revision>] [-t <to_revision>] [-x <out_folder>]
+    archive_index.py extract <run.idx.json> <member_path> [-o <output_file>]
+e.g. every UK-HHT8 testrun.log from r75000 to r80000:
+    archive_index.py find c:/Test/ZippedOutput "UK-HHT8/testrun.log" -f 75000 -t 80000
+Patterns are matched, ignoring case, against the member path within the run folder.
+"""
+
+import os
+import re
+import sys
+import json
+import lzma
+import fnmatch
+import hashlib
+import argparse
+from archive_throttle import throttled_reader
+from archive_dedup import MANIFEST_SUFFIX, pack_path_for, read_blob
+
+INDEX_SUFFIX = ".idx.json"
+ARCHIVE_SUFFIXES = [".tar.xz", ".tar.zst", ".zip", ".7z", MANIFEST_SUFFIX]
+
+_RUN_REVISION_REGEX = r"(?:^|[-_])r(\d+)(?=_|$)"  # r70160, 16-05-26-122551-r70160_b3149_v5.1_...
+_COPY_SIZE = 1024 * 1024
+
+
+class IndexLabels:
+    """Magic strings for the archive index"""
+    RUN = "run"
+    REVISION = "revision"
+    ARCHIVE = "archive"
+    MEMBERS = "members"
+    PATH = "path"
+    SIZE = "size"
+    MODIFIED = "mtimeNs"
+    HASH = "sha256"
+    BLOCK = "block"
+    OFFSET = "offset"
+
+
+class HashingReader:
+    """Read-only file wrapper that hashes what is read through it, so a file can be
+    archived and hashed in one read."""
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+def member_entry(path, file_stat, digest, block=None, offset=0):
+    return {IndexLabels.PATH: path,
+            IndexLabels.SIZE: file_stat.st_size,
+            IndexLabels.MODIFIED: file_stat.st_mtime_ns,
+            IndexLabels.HASH: digest,
+            IndexLabels.BLOCK: block,
+            IndexLabels.OFFSET: offset}
+
+
+def folder_files(folder):
+    """(path, member path) of each file in folder, member paths relative to it with / separators"""
+    for dir_path, dir_names, file_names in os.walk(folder):
+        dir_names.sort()
+        for name in sorted(file_names):
+            file_path = os.path.join(dir_path, name)
+            yield file_path, os.path.relpath(file_path, folder).replace(os.sep, "/")
+
+
+def list_folder(folder):
+    """Member entries, without hashes or blocks, for the files of a folder, from their stat alone.
+    For 7z, which checks its members against CRCs of its own, so the files are not read twice."""
+    return [member_entry(member_path, os.stat(file_path), None) for file_path, member_path in folder_files(folder)]
+
+
+def index_folder(folder, throttle=None):
+    """Member entries, without blocks, for the files of a folder, reading each to hash it.
+    For archive formats whose writer cannot hash the files as it reads them.
+    Reads are held to throttle (an archive_throttle.Throttle) if given."""
+    members = []
+    for file_path, member_path in folder_files(folder):
+        with open(file_path, "rb") as f:
+            reader = HashingReader(throttled_reader(f, throttle))
+            while reader.read(_COPY_SIZE):
+                pass
+        members.append(member_entry(member_path, os.stat(file_path), reader.hexdigest()))
+    return members
+
+
+def run_name_for(archive_name):
+    """r70160.tar.xz -> r70160"""
+    name = os.path.basename(archive_name)
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def index_name_for(archive_name):
+    return os.path.join(os.path.dirname(archive_name), run_name_for(archive_name) + INDEX_SUFFIX)
+
+
+def revision_of_run(run_name):
+    match = re.search(_RUN_REVISION_REGEX, run_name, re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+
+def write_index(archive_name, members):
+    """Write the index of an archive next to it, atomically. Returns its name."""
+    run_name = run_name_for(archive_name)
+    index_name = index_name_for(archive_name)
+    temp_name = index_name + ".tmp"
+    with open(temp_name, "w") as f:
+        json.dump({IndexLabels.RUN: run_name,
+                   IndexLabels.REVISION: revision_of_run(run_name),
+                   IndexLabels.ARCHIVE: os.path.basename(archive_name),
+                   IndexLabels.MEMBERS: members}, f, indent=1)
+    os.replace(temp_name, index_name)
+    return index_name
+
+
+def read_index(index_name):
+    with open(index_name, "r") as f:
+        return json.load(f)
+
+
+# ---------------------------------------------------------
+# Searching and extracting
+# ---------------------------------------------------------
+
+def find_members(zip_folder, pattern, from_revision=None, to_revision=None):
+    """(index file name, index, member entry) of the members matching pattern in the runs
+    of revisions from_revision to to_revision inclusive, in revision order."""
+    pattern = pattern.replace("\\", "/").lower()
+    found = []
+    for name in sorted(os.listdir(zip_folder)):
+        if not name.endswith(INDEX_SUFFIX):
+            continue
+
+        index_name = os.path.join(zip_folder, name)
+        index = read_index(index_name)
+        if index[IndexLabels.REVISION] is None:
+            # written before the revision was found in the middle of run names
+            index[IndexLabels.REVISION] = revision_of_run(index[IndexLabels.RUN])
+        revision = index[IndexLabels.REVISION]
+        if from_revision is not None or to_revision is not None:
+            if revision is None:
+                continue
+            if (from_revision is not None and revision < from_revision
+                    or to_revision is not None and revision > to_revision):
+                continue
+
+        for member in index[IndexLabels.MEMBERS]:
+            if fnmatch.fnmatchcase(member[IndexLabels.PATH].lower(), pattern):
+                found.append((index_name, index, member))
+
+    found.sort(key=lambda item: (item[1][IndexLabels.REVISION] or 0, item[1][IndexLabels.RUN],
+                                 item[2][IndexLabels.PATH]))
+    return found
+
+
+def _read_from_stream(stream, offset, size):
+    """size bytes starting offset bytes into a decompressed stream"""
+    while offset > 0:
+        skipped = len(stream.read(min(offset, _COPY_SIZE)))
+        if skipped == 0:
+            raise EOFError("Archive ends before the member")
+        offset -= skipped
+    return stream.read(size)
+
+
+def _read_tar_xz(archive_name, member):
+    with open(archive_name, "rb") as f:
+        f.seek(member[IndexLabels.BLOCK])
+        # reads on across the following chunks (xz streams) if the member continues into them
+        with lzma.LZMAFile(f) as stream:
+            return _read_from_stream(stream, member[IndexLabels.OFFSET], member[IndexLabels.SIZE])
+
+
+def _read_tar_zst(archive_name, member):
+    """tar.zst needs zstandard: pip install zstandard"""
+    import importlib.util
+    if not importlib.util.find_spec("zstandard"):
+        raise Exception(_read_tar_zst.__doc__)
+
+    import zstandard
+    with open(archive_name, "rb") as f:
+        f.seek(member[IndexLabels.BLOCK])
+        with zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as stream:
+            return _read_from_stream(stream, member[IndexLabels.OFFSET], member[IndexLabels.SIZE])
+
+
+def _read_zip(archive_name, member):
+    import zipfile
+    with zipfile.ZipFile(archive_name) as archive:
+        return archive.read(member[IndexLabels.PATH])
+
+
+def _read_7z(archive_name, member):
+    """7z members need py7zr: python -m pip install py7zr"""
+    import importlib.util
+    if not importlib.util.find_spec("py7zr"):
+        raise Exception(_read_7z.__doc__)
+
+    import py7zr
+    with py7zr.SevenZipFile(archive_name, mode="r") as archive:
+        names = {name.replace("\\", "/"): name for name in archive.getnames()}
+        target = names[member[IndexLabels.PATH]]
+        if hasattr(archive, "read"):
+            # py7zr < 1.0
+            product = archive.read(targets=[target])[target]
+        else:
+            from py7zr.io import BytesIOFactory
+            factory = BytesIOFactory(member[IndexLabels.SIZE] + 1)
+            archive.extract(targets=[target], factory=factory)
+            product = factory.products[target]
+    product.seek(0)
+    return product.read()
+
+
+def _read_dedup(archive_name, member):
+    with read_blob(pack_path_for(os.path.dirname(archive_name)), member[IndexLabels.HASH]) as blob:
+        return blob.read()
+
+
+def read_member(index_name, index, member):
+    """Content of one member of the archive an index belongs to, checked against its hash if it has one."""
+    archive_name = os.path.join(os.path.dirname(index_name), index[IndexLabels.ARCHIVE])
+    if archive_name.endswith(".tar.xz"):
+        data = _read_tar_xz(archive_name, member)
+    elif archive_name.endswith(".tar.zst"):
+        data = _read_tar_zst(archive_name, member)
+    elif archive_name.endswith(".zip"):
+        data = _read_zip(archive_name, member)
+    elif archive_name.endswith(".7z"):
+        data = _read_7z(archive_name, member)
+    elif archive_name.endswith(MANIFEST_SUFFIX):
+        data = _read_dedup(archive_name, member)
+    else:
+        raise Exception("Unknown archive format: {}".format(archive_name))
+
+    if member[IndexLabels.HASH] is not None and hashlib.sha256(data).hexdigest() != member[IndexLabels.HASH]:
+        raise Exception("{} in {} does not match its hash in the index".format(member[IndexLabels.PATH],
+                                                                                archive_name))
+    return data
+
+
+def write_member(data, member, output_file):
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "wb") as f:
+        f.write(data)
+    os.utime(output_file, ns=(member[IndexLabels.MODIFIED], member[IndexLabels.MODIFIED]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the archive indexes and extract single members.")
+    commands = parser.add_subparsers(dest="command")
+
+    find_parser = commands.add_parser("find", help="members matching a pattern in all the indexes of a folder")
+    find_parser.add_argument("zip_folder")
+    find_parser.add_argument("pattern", help="e.g. UK-HHT8/testrun.log or */data/*.log")
+    find_parser.add_argument("-f", "--from-revision", type=int)
+    find_parser.add_argument("-t", "--to-revision", type=int)
+    find_parser.add_argument("-x", "--extract-to", help="also extract them to <folder>/<run>/<member path>")
+
+    extract_parser = commands.add_parser("extract", help="one member of an indexed archive")
+    extract_parser.add_argument("index", help="<run>" + INDEX_SUFFIX)
+    extract_parser.add_argument("member", help="path within the run folder, e.g. UK-HHT8/testrun.log")
+    extract_parser.add_argument("-o", "--output", help="default: standard output")
+
+    args = parser.parse_args()
+    if args.command == "find":
+        found = find_members(args.zip_folder, args.pattern, args.from_revision, args.to_revision)
+        for index_name, index, member in found:
+            print("{}\t{}\t{}".format(index[IndexLabels.RUN], member[IndexLabels.PATH], member[IndexLabels.SIZE]))
+            if args.extract_to is not None:
+                write_member(read_member(index_name, index, member), member,
+                             os.path.join(args.extract_to, index[IndexLabels.RUN], member[IndexLabels.PATH]))
+        print("{} members found.".format(len(found)), file=sys.stderr)
+    elif args.command == "extract":
+        index = read_index(args.index)
+        members = [m for m in index[IndexLabels.MEMBERS]
+                   if m[IndexLabels.PATH].lower() == args.member.replace("\\", "/").lower()]
+        if len(members) == 0:
+            print("No member {} in {}".format(args.member, args.index), file=sys.stderr)
+            sys.exit(1)
+        data = read_member(args.index, index, members[0])
+        if args.output is None:
+            sys.stdout.buffer.write(data)
+        else:
+            write_member(data, members[0], args.output)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
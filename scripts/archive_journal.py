@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""Journal of zip-to-archive's progress through each run folder, so an interrupted run can be resumed.
+
+Each step done for a folder is appended to <zip_folder>/archive-journal.jsonl, one JSON
+object a line, written through to disk before the next step starts:
+    gathered      - backups cleaned out and perf data gathered
+    jsonCopied    - results.json copied loose to the zip folder
+    compressed    - archive and index written (under a temporary name, then renamed)
+    verified      - archive read back and checked against its index
+    sourceRemoved - run folder deleted; the folder is done
+The last step recorded for a folder says what is left to do. A line cut short by a crash
+is ignored, which only means that step is done again.
+    zip-to-archive.py <source_folder> <zip_folder> --resume
+finishes the folders the journal has unfinished; this lists them:
+    archive_journal.py <zip_folder>
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime
+
+JOURNAL_NAME = "archive-journal.jsonl"
+
+
+class Steps:
+    GATHERED = "gathered"
+    JSON_COPIED = "jsonCopied"
+    COMPRESSED = "compressed"
+    VERIFIED = "verified"
+    SOURCE_REMOVED = "sourceRemoved"
+    ALL = [GATHERED, JSON_COPIED, COMPRESSED, VERIFIED, SOURCE_REMOVED]
+
+
+class JournalLabels:
+    """Magic strings for the journal"""
+    RUN = "run"
+    STEP = "step"
+    SOURCE = "source"
+    ARCHIVE = "archive"
+    BACKEND = "backend"
+    MODIFIED = "mtimeNs"
+    TIME = "time"
+
+
+def step_done(last_step, step):
+    """Whether a folder whose last step done was last_step has got as far as step"""
+    return Steps.ALL.index(last_step) >= Steps.ALL.index(step)
+
+
+class ArchiveJournal:
+    """The journal of one zip folder. Thread safe."""
+    def __init__(self, zip_folder):
+        self.path = os.path.join(zip_folder, JOURNAL_NAME)
+        self._lock = threading.Lock()
+
+    def record(self, run, step, source, archive, backend, modtime):
+        """Append a step done for a run folder, and flush it to disk."""
+        entry = {JournalLabels.RUN: run,
+                 JournalLabels.STEP: step,
+                 JournalLabels.SOURCE: os.path.abspath(source),
+                 JournalLabels.ARCHIVE: os.path.abspath(archive),
+                 JournalLabels.BACKEND: backend,
+                 JournalLabels.MODIFIED: modtime,
+                 JournalLabels.TIME: datetime.now().isoformat(timespec="seconds")}
+        line = (json.dumps(entry) + "\n").encode()
+        with self._lock:
+            with open(self.path, "a+b") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # after a line cut short by a crash, which would take this entry with it
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
+
+    def load(self):
+        """The last entry for each run folder in the journal, by run name"""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+
+        with self._lock, open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # cut short by a crash
+                entries[entry[JournalLabels.RUN]] = entry
+        return entries
+
+    def unfinished(self):
+        """Last entries of the run folders not yet done, in run name order"""
+        return [entry for run, entry in sorted(self.load().items())
+                if not step_done(entry[JournalLabels.STEP], Steps.SOURCE_REMOVED)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the run folders zip-to-archive has left unfinished.")
+    parser.add_argument("zip_folder")
+    args = parser.parse_args()
+
+    unfinished = ArchiveJournal(args.zip_folder).unfinished()
+    for entry in unfinished:
+        print("{}\t{}\t{}".format(entry[JournalLabels.RUN], entry[JournalLabels.STEP], entry[JournalLabels.TIME]))
+    print("{} unfinished.".format(len(unfinished)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
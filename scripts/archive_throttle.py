@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""Keep archiving out of the way of the timing tests running on the same machine.
+
+  - TokenBucket limits the bytes per second read from or written to disk. One bucket is
+    shared by every compressor, so the limit holds however many run at once.
+  - lower_priority drops this process (and the 7z processes it starts) to the lowest
+    CPU and I/O priority.
+  - TestActivityMonitor reports a test as running while any <run>/<test>/testrun.log under
+    the base path has been modified in the last few minutes; archiving waits until none has.
+
+The Python backends read and write through the Throttle; 7z cannot be limited from
+outside so it is suspended while a test runs instead, which needs psutil
+(python -m pip install psutil).
+"""
+
+import os
+import sys
+import time
+import glob
+import threading
+
+_DEFAULT_QUIET_SECONDS = 180  # a testrun.log modified this recently means a test is running
+_DEFAULT_CHECK_INTERVAL = 10.0  # seconds between looks for test activity
+_TEST_LOG_PATTERN = os.path.join("*", "*", "testrun.log")
+
+
+class TokenBucket:
+    """Allows rate bytes per second on average, in bursts of up to burst bytes. Thread safe."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """Take count bytes' worth, sleeping as long as it takes to earn them.
+        More than a burst at once is allowed, and paid for by waiting."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TestActivityMonitor:
+    """Whether a timing test is running on this machine, judged by its testrun.log being written."""
+    def __init__(self, base_path, quiet_seconds=_DEFAULT_QUIET_SECONDS, check_interval=_DEFAULT_CHECK_INTERVAL):
+        self.base_path = base_path
+        self.quiet_seconds = quiet_seconds
+        self.check_interval = check_interval
+        self._active_log = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _find_active_log(self):
+        now = time.time()
+        for log in glob.iglob(os.path.join(self.base_path, _TEST_LOG_PATTERN)):
+            try:
+                if now - os.path.getmtime(log) < self.quiet_seconds:
+                    return log
+            except OSError:
+                continue  # moved or removed while looking
+        return None
+
+    def active_log(self):
+        """A testrun.log being written to, or None. Looks again at most every check_interval seconds."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.check_interval:
+                self._active_log = self._find_active_log()
+                self._checked = now
+            return self._active_log
+
+    def wait_until_idle(self):
+        """Return once no test is running. Returns the seconds waited."""
+        log = self.active_log()
+        if log is None:
+            return 0.0
+
+        print("Test running ({} is being written). Pausing archiving.".format(log))
+        start = time.monotonic()
+        while self.active_log() is not None:
+            time.sleep(self.check_interval)
+        waited = time.monotonic() - start
+        print("No test running. Resuming archiving after {:.0f}s.".format(waited))
+        return waited
+
+
+class Throttle:
+    """Limits on archiving: bytes per second read and written, and pausing while tests run.
+    Any of them may be None."""
+    def __init__(self, read_rate=None, write_rate=None, monitor: TestActivityMonitor = None):
+        self.read_bucket = TokenBucket(read_rate) if read_rate else None
+        self.write_bucket = TokenBucket(write_rate) if write_rate else None
+        self.monitor = monitor
+
+    def limits_bandwidth(self):
+        return self.read_bucket is not None or self.write_bucket is not None
+
+    def wait_until_idle(self):
+        if self.monitor is not None:
+            self.monitor.wait_until_idle()
+
+    def read(self, count):
+        self.wait_until_idle()
+        if self.read_bucket is not None:
+            self.read_bucket.consume(count)
+
+    def write(self, count):
+        self.wait_until_idle()
+        if self.write_bucket is not None:
+            self.write_bucket.consume(count)
+
+
+class ThrottledReader:
+    """File wrapper whose reads are held to the throttle"""
+    def __init__(self, fileobj, throttle: Throttle):
+        self._fileobj = fileobj
+        self._throttle = throttle
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._throttle.read(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+class ThrottledWriter:
+    """File wrapper whose writes are held to the throttle"""
+    def __init__(self, fileobj, throttle: Throttle):
+        self._fileobj = fileobj
+        self._throttle = throttle
+
+    def write(self, data):
+        self._throttle.write(len(data))
+        return self._fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+def throttled_reader(fileobj, throttle):
+    return ThrottledReader(fileobj, throttle) if throttle is not None else fileobj
+
+
+def throttled_writer(fileobj, throttle):
+    return ThrottledWriter(fileobj, throttle) if throttle is not None else fileobj
+
+
+def lower_priority():
+    """Run this process, and the processes it starts, at the lowest CPU and I/O priority.
+    Uses psutil where installed (python -m pip install psutil); without it only the CPU
+    priority is lowered, and only on Unix."""
+    import importlib.util
+    if importlib.util.find_spec("psutil"):
+        import psutil
+        process = psutil.Process()
+        if sys.platform == "win32":
+            process.nice(psutil.IDLE_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_VERYLOW)
+        else:
+            process.nice(19)
+            if hasattr(psutil, "IOPRIO_CLASS_IDLE"):
+                process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        return
+
+    if not hasattr(os, "nice"):
+        raise Exception(lower_priority.__doc__)
+    os.nice(19)
+
+
+def can_suspend_processes():
+    """Suspending a process while a test runs needs psutil: python -m pip install psutil"""
+    import importlib.util
+    return importlib.util.find_spec("psutil") is not None
+
+
+def run_pausing_while_testing(command, monitor: TestActivityMonitor):
+    """Run command, suspending it while a test runs. Returns its exit code.
+    Suspending needs psutil (see can_suspend_processes)."""
+    if not can_suspend_processes():
+        raise Exception(can_suspend_processes.__doc__)
+
+    import psutil
+    from subprocess import Popen, TimeoutExpired
+    process = Popen(command)
+    try:
+        while process.poll() is None:
+            if monitor.active_log() is not None:
+                suspended = psutil.Process(process.pid)
+                suspended.suspend()
+                try:
+                    monitor.wait_until_idle()
+                finally:
+                    suspended.resume()
+            try:
+                process.wait(timeout=monitor.check_interval)
+            except TimeoutExpired:
+                pass  # still running
+    except BaseException:
+        process.kill()
+        raise
+    return process.returncode
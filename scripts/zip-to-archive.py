@@ -1,19 +1,39 @@
 #!/usr/bin/env python3
 # Script version 2016.08.18.14.15
 
-import sys
 import os
-from subprocess import run
+import argparse
 from shutil import rmtree, copy2
 from datetime import timedelta, datetime
-import gatherperfdata
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from archive_backends import Backends, SEVEN_ZIP_EXE, archive_suffix, default_backend, seven_zip_exe, \
+    write_archive, verify_archive
+from archive_index import index_name_for
+from archive_journal import ArchiveJournal, JournalLabels, Steps, step_done
+from archive_throttle import Throttle, TestActivityMonitor, can_suspend_processes, lower_priority
 
 """Zip up each directory in the current folder as separate archives to a specified location (default hardcoded).
-  The original directories will be deleted."""
+  The original directories will be deleted.
+  With more than one compressor (-j) archiving is pipelined: the next folders are cleaned and
+  gathered while up to that many folders are being compressed.
+  Archives are written with 7-Zip, the only format the tools that gather archived runs read.
+  Without 7-Zip another format must be chosen with -b (see archive_backends).
+  Each archive gets an index of its members, <run>.idx.json, for archive_index to search and extract from.
+  A folder is only deleted once its archive has been read back and checked against that index.
+  Each step is recorded in a journal in the zip folder (see archive_journal); after an interruption
+    zip-to-archive.py <source_folder> <zip_folder> --resume
+  finishes the folders that were under way.
+  To archive while timing tests run on the same machine without disturbing them (see archive_throttle):
+    --low-priority            lowest CPU and I/O priority, for this and 7z
+    --read-limit/--write-limit MB per second read or written (Python backends; 7z gets one thread)
+    --pause-while-testing     wait while a testrun.log under the source folder is being written
+    --throttled               all of these, limited to 20 MB/s"""
 
 _ZIP_OUTPUT_DIR = r"c:\Test\ZippedOutput"
 _DEFAULT_MIN_DAYS_OLD = 100    # days
 _DEFAULT_MAX_FILES_TO_ZIP = 30
+_DEFAULT_DISK_COMPRESSORS = 2  # archives read from one disk at once; more only makes it seek
+_THROTTLED_MB_PER_SECOND = 20
 
 
 def calc_birth_date_from_age(days_old: int):
@@ -70,6 +90,8 @@ def try_gather_perf_data(test_folder):
 
     try:
         print("Gathering perf data for: {}".format(test_folder))
+        # imported here as it reads the Windows COMPUTERNAME on import, which other agents lack
+        import gatherperfdata
         gatherperfdata.main(test_folder)
     except FileNotFoundError as err:
         print(err)
@@ -95,70 +117,225 @@ def copy_result_json_to_archive_folder(zip_folder, test_run_folder, test_dir_nam
         print(err)
 
 
-def main(base_path, zip_folder, min_days_old, max_folders_to_zip=0):
-    if not (os.path.exists(zip_folder)):
-        print("Error: Output folder '{0}' does not exist.".format(zip_folder))
-        return
+def default_compressor_count(disk_compressors=_DEFAULT_DISK_COMPRESSORS):
+    """Compressors to run at once: one per two cores, as 7z uses more than one thread each,
+    but no more than the disk can keep fed."""
+    return max(1, min(disk_compressors, (os.cpu_count() or 1) // 2))
 
-    cwd = os.getcwd()
-    gather_script_exists = os.path.exists(os.path.join(cwd, "gatherperfdata.py"))
-    if gather_script_exists:
-        print("Gather perf script found. Will run it on any folders that don't have result.json.")
 
-    cut_off_date_ns = int(calc_birth_date_from_age(min_days_old)*1e9)
-    dirs = [d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))]
+class ArchiveJob:
+    """A run folder cleaned, gathered and ready to compress"""
+    def __init__(self, test_dir_name, test_run_folder, archive_name, modtime):
+        self.test_dir_name = test_dir_name
+        self.test_run_folder = test_run_folder
+        self.archive_name = archive_name
+        self.modtime = modtime
+
+
+def record_step(journal: ArchiveJournal, job: ArchiveJob, step, backend):
+    if journal is not None:
+        journal.record(job.test_dir_name, step, job.test_run_folder, job.archive_name, backend, job.modtime)
 
-    total_files_zipped = 0
 
-    for test_dir_name in dirs:
-        archive_name = os.path.join(zip_folder, "%s.7z" % test_dir_name)
+def prepare_run_folder(base_path, zip_folder, test_dir_name, min_days_old, gather_script_exists,
+                       backend=Backends.SEVEN_ZIP, journal: ArchiveJournal = None):
+    """Clean out backups, gather and check the age of one run folder, recording the steps in journal.
+    Returns an ArchiveJob, or None if the folder is not to be archived."""
+    archive_name = os.path.join(zip_folder, test_dir_name + archive_suffix(backend))
 
-        if os.path.exists(archive_name):
+    if os.path.exists(archive_name):
+        entry = journal.load().get(test_dir_name) if journal is not None else None
+        if entry is not None and not step_done(entry[JournalLabels.STEP], Steps.SOURCE_REMOVED):
+            print("Archive {} is unfinished ({} last). Skipping: finish it with --resume."
+                  .format(test_dir_name, entry[JournalLabels.STEP]))
+        else:
             print("Error: Archive %s already exists. Skipping." % test_dir_name)
-            continue
+        return None
 
-        cur_test_run_folder = os.path.join(base_path, test_dir_name)
+    cur_test_run_folder = os.path.join(base_path, test_dir_name)
 
-        # regardless of age, we want to clean out backups from test folders
-        remove_pamir_backup_files(cur_test_run_folder)
+    # regardless of age, we want to clean out backups from test folders
+    remove_pamir_backup_files(cur_test_run_folder)
 
-        # run data gatherer to be sure we've run it
-        if gather_script_exists:
-            try_gather_perf_data(cur_test_run_folder)
+    # run data gatherer to be sure we've run it
+    if gather_script_exists:
+        try_gather_perf_data(cur_test_run_folder)
 
-        modtime = get_latest_mod_date_in_sub_dirs(cur_test_run_folder)
-        if modtime > cut_off_date_ns:
-            print("Skipping {}: only {} days old (less than {})."
-                  .format(test_dir_name, calc_age_from_modtime(modtime), min_days_old))
+    cut_off_date_ns = int(calc_birth_date_from_age(min_days_old)*1e9)
+    modtime = get_latest_mod_date_in_sub_dirs(cur_test_run_folder)
+    if modtime > cut_off_date_ns:
+        print("Skipping {}: only {} days old (less than {})."
+              .format(test_dir_name, calc_age_from_modtime(modtime), min_days_old))
+        return None
+
+    job = ArchiveJob(test_dir_name, cur_test_run_folder, archive_name, modtime)
+    record_step(journal, job, Steps.GATHERED, backend)
+
+    # grab json result for easy access
+    copy_result_json_to_archive_folder(zip_folder, cur_test_run_folder, test_dir_name)
+    record_step(journal, job, Steps.JSON_COPIED, backend)
+    return job
+
+
+def compress_run_folder(job: ArchiveJob, backend=Backends.SEVEN_ZIP, threads=0, throttle: Throttle = None,
+                        journal: ArchiveJournal = None, last_step=Steps.JSON_COPIED):
+    """Archive the run folder, verify the archive and remove the folder, recording each step in journal.
+    Starts after last_step, the last step already done. threads limits the threads used to
+    compress (0: the default). Returns True if archived and the folder removed."""
+    if not step_done(last_step, Steps.COMPRESSED):
+        if not write_archive(backend, job.archive_name, job.test_run_folder, threads, throttle):
+            print("Failed to archive {}".format(job.test_dir_name))
+            return False
+        os.utime(job.archive_name, None, ns=(job.modtime, job.modtime))
+        record_step(journal, job, Steps.COMPRESSED, backend)
+
+    if not step_done(last_step, Steps.VERIFIED):
+        if not verify_archive(backend, job.archive_name, throttle):
+            # removed so that it is written again; the folder is kept
+            print("Failed to verify the archive of {}. Removing it.".format(job.test_dir_name))
+            for name in [job.archive_name, index_name_for(job.archive_name)]:
+                if os.path.exists(name):
+                    os.remove(name)
+            return False
+        record_step(journal, job, Steps.VERIFIED, backend)
+
+    rmtree(job.test_run_folder, ignore_errors=True)
+    if os.path.exists(job.test_run_folder):
+        # e.g. a file held open on Windows; left at verified so resuming removes the rest
+        print("Could not remove all of {}. Resume to try again.".format(job.test_run_folder))
+        return False
+    record_step(journal, job, Steps.SOURCE_REMOVED, backend)
+    return True
+
+
+def resume(zip_folder, throttle: Throttle = None):
+    """Finish the run folders the journal of zip_folder has unfinished, each from the step it got to."""
+    journal = ArchiveJournal(zip_folder)
+    unfinished = journal.unfinished()
+    total_archived = 0
+    for entry in unfinished:
+        backend = entry[JournalLabels.BACKEND]
+        job = ArchiveJob(entry[JournalLabels.RUN], entry[JournalLabels.SOURCE], entry[JournalLabels.ARCHIVE],
+                         entry[JournalLabels.MODIFIED])
+        last_step = entry[JournalLabels.STEP]
+        if step_done(last_step, Steps.COMPRESSED) and not os.path.exists(job.archive_name):
+            # removed when it failed verification
+            last_step = Steps.JSON_COPIED
+        if not step_done(last_step, Steps.COMPRESSED) and not os.path.exists(job.test_run_folder):
+            print("Cannot resume {}: neither its folder nor its archive remain.".format(job.test_dir_name))
             continue
 
-        # grab json result for easy access
-        copy_result_json_to_archive_folder(zip_folder, cur_test_run_folder, test_dir_name)
+        print("Resuming {} after {}".format(job.test_dir_name, last_step))
+        if throttle is not None:
+            throttle.wait_until_idle()
+        if last_step == Steps.GATHERED:
+            copy_result_json_to_archive_folder(zip_folder, job.test_run_folder, job.test_dir_name)
+            record_step(journal, job, Steps.JSON_COPIED, backend)
+            last_step = Steps.JSON_COPIED
+        total_archived += compress_run_folder(job, backend, 0, throttle, journal, last_step)
 
-        total_files_zipped += 1
-        print("Zipping {}: {}".format(total_files_zipped, test_dir_name))
-        zip_command = r'c:\Program Files\7-Zip\7z.exe a "{0}" "{1}\*" -sdel -bso0'\
-            .format(archive_name, cur_test_run_folder)
-        result = run(zip_command)
+    print("Finished {} of {} unfinished folders".format(total_archived, len(unfinished)))
 
-        if result.returncode == 0 and os.path.exists(archive_name):
-            os.utime(archive_name, None, ns=(modtime, modtime))
-            rmtree(cur_test_run_folder, ignore_errors=True)
 
-        if 0 < max_folders_to_zip <= total_files_zipped:
-            break
+def make_throttle(base_path, read_limit=None, write_limit=None, pause_while_testing=False):
+    """Throttle for the limits given in MB per second, or None if there are none."""
+    if read_limit is None and write_limit is None and not pause_while_testing:
+        return None
+    monitor = TestActivityMonitor(base_path) if pause_while_testing else None
+    return Throttle(read_limit and read_limit * 1e6, write_limit and write_limit * 1e6, monitor)
 
-if __name__ == "__main__":
-    _zip_folder = _ZIP_OUTPUT_DIR
-    _min_days_old = _DEFAULT_MIN_DAYS_OLD
-    _base_path = "."
 
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "-h":
-            print("zip-to-archive [source_folder] [dest_folder] [minimum_age] [max_files_to_zip]")
-            exit()
+def main(base_path, zip_folder, min_days_old, max_folders_to_zip=0, compressors=1, backend=None,
+         throttle: Throttle = None):
+    """Archive the old run folders in base_path. With compressors > 1 (0 to suit the cores and disk)
+    up to that many are compressed at once, each given a share of the cores, while the
+    next folders are prepared. backend is one of archive_backends.Backends, default 7z.
+    throttle (see make_throttle) is shared by all the compressors, so its limits are for them all."""
+    if not (os.path.exists(zip_folder)):
+        print("Error: Output folder '{0}' does not exist.".format(zip_folder))
+        return
+
+    cwd = os.getcwd()
+    gather_script_exists = os.path.exists(os.path.join(cwd, "gatherperfdata.py"))
+    if gather_script_exists:
+        print("Gather perf script found. Will run it on any folders that don't have result.json.")
+
+    if backend is None:
+        backend = default_backend()
+    if backend == Backends.SEVEN_ZIP and seven_zip_exe() is None:
+        print("Error: 7-Zip not found at {}. Install it, or choose another format with -b "
+              "(archives only archive_index can read).".format(SEVEN_ZIP_EXE))
+        return
+
+    if compressors == 0:
+        compressors = default_compressor_count()
+    threads = max(1, (os.cpu_count() or 1) // compressors) if compressors > 1 else 0
+
+    dirs = [d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))]
+    journal = ArchiveJournal(zip_folder)
+
+    total_files_zipped = 0
+    total_archived = 0
+    start = datetime.now()
+
+    with ThreadPoolExecutor(max_workers=compressors) as pool:
+        compressing = set()
+        for test_dir_name in dirs:
+            if throttle is not None:
+                # gathering reads every log of the run, so it waits for tests too
+                throttle.wait_until_idle()
+            job = prepare_run_folder(base_path, zip_folder, test_dir_name, min_days_old, gather_script_exists,
+                                     backend, journal)
+            if job is None:
+                continue
+
+            total_files_zipped += 1
+            print("Zipping {}: {}".format(total_files_zipped, test_dir_name))
+            if compressors == 1:
+                total_archived += compress_run_folder(job, backend, 0, throttle, journal)
+            else:
+                # prepare no further ahead than the next folder while all compressors are busy
+                while len(compressing) >= compressors:
+                    done, compressing = wait(compressing, return_when=FIRST_COMPLETED)
+                    total_archived += sum(future.result() for future in done)
+                compressing.add(pool.submit(compress_run_folder, job, backend, threads, throttle, journal))
+
+            if 0 < max_folders_to_zip <= total_files_zipped:
+                break
+
+        total_archived += sum(future.result() for future in wait(compressing).done)
+
+    print("Archived {} of {} folders in {}".format(total_archived, total_files_zipped, datetime.now() - start))
 
-        _base_path = sys.argv[1]
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(prog="zip-to-archive",
+                                      description="Archive old run folders, one archive per folder.")
+    _parser.add_argument("source_folder", nargs="?", help="default: the folder of this script")
+    _parser.add_argument("dest_folder", nargs="?", default=_ZIP_OUTPUT_DIR)
+    _parser.add_argument("minimum_age", nargs="?", type=int, default=_DEFAULT_MIN_DAYS_OLD, help="days")
+    _parser.add_argument("max_files_to_zip", nargs="?", type=int, default=_DEFAULT_MAX_FILES_TO_ZIP)
+    _parser.add_argument("-j", "--compressors", type=int, default=1,
+                         help="folders to compress at once while the next are prepared, "
+                              "0 to suit the cores and disk (default 1: one at a time)")
+    _parser.add_argument("-b", "--backend", choices=Backends.ALL,
+                         help="archive format, default 7z; the others cannot be gathered from")
+    _parser.add_argument("--resume", action="store_true",
+                         help="only finish the folders the journal in dest_folder has unfinished")
+    _parser.add_argument("--low-priority", action="store_true", help="run at the lowest CPU and I/O priority")
+    _parser.add_argument("--read-limit", type=float, help="MB per second to read, all compressors together")
+    _parser.add_argument("--write-limit", type=float, help="MB per second to write, all compressors together")
+    _parser.add_argument("--pause-while-testing", action="store_true",
+                         help="wait while a test under the source folder is writing its testrun.log")
+    _parser.add_argument("--throttled", action="store_true",
+                         help="all of the above, limited to {} MB/s".format(_THROTTLED_MB_PER_SECOND))
+    _args = _parser.parse_args()
+    if _args.throttled:
+        _args.low_priority = _args.pause_while_testing = True
+        _args.read_limit = _args.read_limit or _THROTTLED_MB_PER_SECOND
+        _args.write_limit = _args.write_limit or _THROTTLED_MB_PER_SECOND
+
+    if _args.source_folder is not None:
+        _base_path = _args.source_folder
         if os.path.exists(_base_path):
             os.chdir(_base_path)
 
@@ -171,21 +348,29 @@ if __name__ == "__main__":
 
     # avoid dangerous current working directory
     _cwd = os.getcwd()
-    _max_files_to_zip = _DEFAULT_MAX_FILES_TO_ZIP
     if "windows" in _cwd:
         print("CWD contains the word Windows. Stopping now to avoid potentially serious side effects.")
         exit()
 
-    if len(sys.argv) > 2:
-        _zip_folder = sys.argv[2]
-
-    if len(sys.argv) > 3:
-        _min_days_old = int(sys.argv[3])
-
-    if len(sys.argv) > 4:
-        _max_files_to_zip = int(sys.argv[4])
+    _zip_folder = _args.dest_folder
+    _min_days_old = _args.minimum_age
+    _max_files_to_zip = _args.max_files_to_zip
 
     print("working folder: {}\nzip folder: {}\nmin days old: {}  | max files to zip: {}"
           .format(_cwd, _zip_folder, _min_days_old, _max_files_to_zip))
-    main(_base_path, _zip_folder, _min_days_old, _max_files_to_zip)
+    if _args.low_priority:
+        lower_priority()
+    # 7z is paused from outside, which needs psutil; find out before any folder is started
+    # (resumed folders may be 7z whatever -b says)
+    _seven_zip = _args.resume or (_args.backend or default_backend()) == Backends.SEVEN_ZIP
+    if _args.pause_while_testing and _seven_zip and not can_suspend_processes():
+        _parser.error("--pause-while-testing with 7z: " + can_suspend_processes.__doc__)
+    if (_args.read_limit or _args.write_limit) and _seven_zip:
+        print("7z cannot be held to --read-limit/--write-limit; it compresses on one thread instead.")
+    _throttle = make_throttle(_base_path, _args.read_limit, _args.write_limit, _args.pause_while_testing)
+    if _args.resume:
+        resume(_zip_folder, _throttle)
+    else:
+        main(_base_path, _zip_folder, _min_days_old, _max_files_to_zip, _args.compressors, _args.backend,
+             _throttle)
     print("All done!")